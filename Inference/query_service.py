@@ -0,0 +1,10 @@
+"""Kept for old commands; the code lives in uhi/service.py (same as `python -m uhi service`)."""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from uhi import service as _module
+
+if __name__ == "__main__":
+    _module.main()
+else:
+    sys.modules[__name__] = _module
@@ -11,9 +11,13 @@ Usage:
     Run the script and follow the prompts.
 """
 
+import os
+import sys
 import rasterio
 import numpy as np
 import math
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from uhi.query import location_window, radius_pixels, check_data
 
 # === Configuration ===
 INPUT_MAP = "Final_Map_Clipped.tif"
@@ -23,59 +27,29 @@ def check_location(lat, lon, radius_meters):
     print(f"\n--- Checking Location: {lat}, {lon} (Radius: {radius_meters}m) ---")
     
     with rasterio.open(INPUT_MAP) as src:
-        # 1. Convert Lat/Lon to Raster Coordinate System (Row/Col)
-        # Note: src.index() works for EPSG:4326 files automatically
-        try:
-            row, col = src.index(lon, lat)
-        except IndexError:
+        # 1-2. Lat/Lon -> Row/Col (src.index() works for EPSG:4326 files automatically)
+        # and the search window of +/- radius pixels, clamped to the image
+        window = location_window(src, lat, lon, radius_meters)
+        if window is None:
             print("❌ Error: These coordinates are outside the map boundary!")
             return
+        print(f"ℹ️ Search Window: +/- {radius_pixels(src.res[0], radius_meters)} pixels around center.")
 
-        # 2. Calculate Radius in Pixels
-        # Get resolution in degrees (approximate)
-        # 1 degree lat approx = 111,320 meters
-        res_x = src.res[0] # Pixel width in degrees
-        degrees_per_meter = 1 / 111320 
-        
-        # Convert search radius (meters) -> radius (degrees) -> radius (pixels)
-        radius_deg = radius_meters * degrees_per_meter
-        radius_pixels = int(radius_deg / res_x)
-        
-        # Ensure at least 1 pixel is checked
-        if radius_pixels < 1: radius_pixels = 1
-        
-        print(f"ℹ️ Search Window: +/- {radius_pixels} pixels around center.")
-
-        # 3. Read the Window of Data
-        # We calculate the start/end rows and cols, clamping to image boundaries
-        row_start = max(0, row - radius_pixels)
-        row_end = min(src.height, row + radius_pixels + 1)
-        col_start = max(0, col - radius_pixels)
-        col_end = min(src.width, col + radius_pixels + 1)
-
-        # Read specific window (much faster than reading whole file)
-        window = rasterio.windows.Window.from_slices((row_start, row_end), (col_start, col_end))
+        # 3. Read the Window of Data (much faster than reading whole file)
         data = src.read(1, window=window)
 
-        # 4. Analyze the Data
-        # Filter out NoData or masked values (usually 0 or very small)
-        valid_data = data[data > 0.001] 
-
-        if valid_data.size == 0:
+        # 4. Analyze the Data (NoData / masked values filtered out)
+        result = check_data(lat, lon, radius_meters, data, THRESHOLD_SCORE)
+        if result["Status"] != "Success":
             print("⚠️ Area contains no valid data (likely outside boundary or masked).")
             return
 
-        max_score = np.max(valid_data)
-        avg_score = np.mean(valid_data)
-        
-        # Count how many pixels exceed threshold
-        high_priority_pixels = valid_data[valid_data > THRESHOLD_SCORE]
-        count = high_priority_pixels.size
-
         # 5. Report Results
         print("\n📊 RESULTS:")
-        print(f"   Max Score Found: {max_score:.2f}")
-        print(f"   Avg Score in Radius: {avg_score:.2f}")
+        print(f"   Max Score Found: {result['Max_Score']:.2f}")
+        print(f"   Avg Score in Radius: {result['Avg_Score']:.2f}")
+        print(f"   Pixels above {THRESHOLD_SCORE}: {result['High_Priority_Pixels']} of {result['Valid_Pixels']}")
+        return result
         
         
 # === Interactive Run Section ===
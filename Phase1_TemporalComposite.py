@@ -0,0 +1,337 @@
+"""
+Urban Heat Island (UHI) Project
+Phase 1: Multi-temporal LST / NDVI Ingestion & Seasonal Composites
+------------------------------------------------------------------
+Runs ahead of Phase 2 when there are many Landsat acquisitions per year
+instead of one LST and one NDVI scene.
+
+This script:
+1. Aligns every new scene once to the reference 30 m grid and caches it
+2. Updates running per-pixel statistics incrementally (count, sum,
+   heat-season max and a small fixed-bin histogram for the median).
+   Only the pixels that are valid in the new scene are touched, so adding
+   an acquisition never recomputes the year. A scene is marked in progress
+   in the manifest while its tiles are added; if a run stops half-way, the
+   next run rebuilds the statistics from the recorded scenes.
+3. Writes median / mean / heat-season-max / count composites as GeoTIFFs,
+   which can be used as the LST / NDVI inputs of Phase 2.
+
+Usage:
+    python Phase1_TemporalComposite.py                  # ingest new scenes in SCENE_DIR + write composites
+    python Phase1_TemporalComposite.py ingest a.tif ... # ingest specific scenes (variable from
+                                                        # the LST/ or NDVI/ folder, else --variable)
+    python Phase1_TemporalComposite.py composite        # only (re)write the composites
+    python Phase1_TemporalComposite.py rebuild          # recompute statistics from the aligned cache
+
+Scene file names must contain the acquisition date as YYYYMMDD
+(as in Landsat product IDs, e.g. LC08_L2SP_144051_20240315_..._ST_B10.TIF).
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+# === Configuration ===
+YEAR = 2024
+SCENE_DIR = "IntialData/Landsat_scenes"          # one sub-folder per variable: LST/, NDVI/
+REFERENCE_GRID = "IntialData/Intiial dataset/Bengaluru_LST_2024.tif"   # 30 m grid all scenes are aligned to
+CACHE_DIR = "ppdData(afterPhase2)/temporal_cache"
+COMPOSITE_DIR = "IntialData/Intiial dataset"     # Phase 2 reads its inputs from here
+HEAT_SEASON_MONTHS = (3, 4, 5)                   # Bengaluru pre-monsoon summer
+TILE_ROWS = 512
+
+# Per variable: physical value = DN * scale + offset, plausible range (values
+# outside are treated as cloud / fill) and the histogram used for the median.
+# Median precision is (hi - lo) / bins.
+VARIABLES = {
+    "LST": {"scale": 1.0, "offset": 0.0, "range": (10.0, 74.0), "bins": 128},
+    "NDVI": {"scale": 1.0, "offset": 0.0, "range": (-1.0, 1.0), "bins": 128},
+}
+
+DATE_RE = re.compile(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)")
+
+
+def scene_date(path):
+    m = DATE_RE.search(os.path.basename(path))
+    if not m:
+        raise ValueError(f"No YYYYMMDD date in file name: {path}")
+    return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+
+def scene_id(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# === Composite state (memory-mapped, lives in CACHE_DIR) ===
+def state_dir(variable, year=YEAR):
+    return os.path.join(CACHE_DIR, f"{variable}_{year}")
+
+
+def open_state(variable, year=YEAR, create=True):
+    """Open (or create) the running statistics of one variable/year as memmaps."""
+    d = state_dir(variable, year)
+    manifest_path = os.path.join(d, "manifest.json")
+    with rasterio.open(REFERENCE_GRID) as ref:
+        shape = (ref.height, ref.width)
+    bins = VARIABLES[variable]["bins"]
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        mode = "r+"
+    elif create:
+        os.makedirs(os.path.join(d, "aligned"), exist_ok=True)
+        manifest = {"variable": variable, "year": year, "shape": list(shape),
+                    "range": VARIABLES[variable]["range"], "bins": bins, "scenes": {}}
+        mode = "w+"
+    else:
+        raise FileNotFoundError(manifest_path)
+
+    def mm(name, dtype, full_shape, init=0):
+        path = os.path.join(d, f"{name}.npy")
+        if mode == "w+":
+            arr = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=full_shape)
+            arr[...] = init
+            return arr
+        return np.load(path, mmap_mode="r+")
+
+    state = {
+        "dir": d,
+        "manifest": manifest,
+        "count": mm("count", "uint16", shape),
+        "sum": mm("sum", "float64", shape),
+        "heat_max": mm("heat_max", "float32", shape, init=np.nan),
+        # (rows, cols, bins) so that a tile of rows is one contiguous block
+        "hist": mm("hist", "uint8", shape + (bins,)),
+    }
+    if mode == "w+":
+        save_manifest(state)
+    return state
+
+
+def save_manifest(state):
+    for key in ("count", "sum", "heat_max", "hist"):
+        state[key].flush()
+    with open(os.path.join(state["dir"], "manifest.json"), "w") as f:
+        json.dump(state["manifest"], f, indent=2)
+
+
+# === Step 1: Align a scene once and cache it ===
+def align_scene(path, out_path):
+    with rasterio.open(REFERENCE_GRID) as ref:
+        profile = ref.profile.copy()
+        crs, transform, width, height = ref.crs, ref.transform, ref.width, ref.height
+    profile.update(dtype="float32", count=1, nodata=np.nan, compress="lzw")
+    with rasterio.open(path) as src, \
+            WarpedVRT(src, crs=crs, transform=transform, width=width, height=height,
+                      resampling=Resampling.bilinear, src_nodata=src.nodata, nodata=np.nan) as vrt, \
+            rasterio.open(out_path, "w", **profile) as dst:
+        for r0 in range(0, height, TILE_ROWS):
+            win = Window(0, r0, width, min(TILE_ROWS, height - r0))
+            dst.write(vrt.read(1, window=win, out_dtype="float32"), 1, window=win)
+    print(f"✅ Aligned {os.path.basename(path)} → {out_path}")
+
+
+# === Step 2: Incremental statistics update ===
+def scene_tiles(src, variable):
+    """(r0, r1, flat indices, values) of the valid pixels of an aligned scene, tile by tile."""
+    cfg = VARIABLES[variable]
+    lo, hi = cfg["range"]
+    for r0 in range(0, src.height, TILE_ROWS):
+        r1 = min(r0 + TILE_ROWS, src.height)
+        v = src.read(1, window=Window(0, r0, src.width, r1 - r0)).reshape(-1).astype("float64")
+        v = v * cfg["scale"] + cfg["offset"]
+        idx = np.flatnonzero(np.isfinite(v) & (v >= lo) & (v <= hi))
+        if idx.size:
+            yield r0, r1, idx, v[idx]
+
+
+def check_capacity(state, variable, aligned_path):
+    """Raise before anything is modified if a pixel of the scene has no histogram room left."""
+    limit = np.iinfo(state["hist"].dtype).max
+    with rasterio.open(aligned_path) as src:
+        for r0, r1, idx, _ in scene_tiles(src, variable):
+            if state["count"][r0:r1].reshape(-1)[idx].max() >= limit:
+                raise OverflowError("Too many acquisitions for the uint8 histogram (max 255 per composite)")
+
+
+def accumulate_scene(state, variable, aligned_path, in_heat_season):
+    cfg = VARIABLES[variable]
+    lo, hi = cfg["range"]
+    bins = cfg["bins"]
+    touched = 0
+    with rasterio.open(aligned_path) as src:
+        for r0, r1, idx, vals in scene_tiles(src, variable):
+            count = state["count"][r0:r1].reshape(-1)
+            count[idx] += 1
+            state["sum"][r0:r1].reshape(-1)[idx] += vals
+            if in_heat_season:
+                hm = state["heat_max"][r0:r1].reshape(-1)
+                hm[idx] = np.fmax(hm[idx], vals)
+            b = np.clip(((vals - lo) / (hi - lo) * bins).astype(np.intp), 0, bins - 1)
+            state["hist"][r0:r1].reshape(-1)[idx * bins + b] += 1
+            touched += idx.size
+    return touched
+
+
+def ingest(variable, paths, year=YEAR):
+    state = open_state(variable, year)
+    recover(state, variable)
+    scenes = state["manifest"]["scenes"]
+    for path in sorted(paths):
+        sid = scene_id(path)
+        date = scene_date(path)
+        if date.year != year:
+            continue
+        if sid in scenes:
+            print(f"⏭  {sid} already ingested")
+            continue
+        aligned = os.path.join(state["dir"], "aligned", f"{sid}.tif")
+        if not os.path.exists(aligned):
+            align_scene(path, aligned)
+        heat = date.month in HEAT_SEASON_MONTHS
+        check_capacity(state, variable, aligned)
+        state["manifest"]["in_progress"] = sid
+        save_manifest(state)
+        touched = accumulate_scene(state, variable, aligned, heat)
+        scenes[sid] = {"date": date.strftime("%Y-%m-%d"), "source": path,
+                       "aligned": aligned, "heat_season": heat, "pixels_updated": touched}
+        state["manifest"]["in_progress"] = None
+        save_manifest(state)   # after every scene, so an interrupted run loses only the scene in progress
+        print(f"✅ {variable} {sid}: updated {touched:,} pixels")
+    return state
+
+
+def rebuild_state(state, variable):
+    """Recompute the statistics from the cached aligned scenes (no re-alignment)."""
+    manifest = state["manifest"]
+    scenes = manifest["scenes"]
+    manifest["in_progress"] = "rebuild"
+    save_manifest(state)
+    for key in ("count", "sum", "hist"):
+        state[key][...] = 0
+    state["heat_max"][...] = np.nan
+    for sid, info in sorted(scenes.items(), key=lambda kv: kv[1]["date"]):
+        check_capacity(state, variable, info["aligned"])
+        info["pixels_updated"] = accumulate_scene(state, variable, info["aligned"], info["heat_season"])
+    manifest["in_progress"] = None
+    save_manifest(state)
+    print(f"✅ Rebuilt {variable} {manifest['year']} from {len(scenes)} cached scenes")
+    return state
+
+
+def rebuild(variable, year=YEAR):
+    return rebuild_state(open_state(variable, year), variable)
+
+
+def recover(state, variable):
+    """Rebuild when the last run stopped while a scene (or a rebuild) was half-way through the tiles."""
+    pending = state["manifest"].get("in_progress")
+    if pending:
+        print(f"⚠️ {variable}: interrupted update ({pending}), rebuilding from the recorded scenes")
+        rebuild_state(state, variable)
+
+
+# === Step 3: Composites ===
+def median_from_histogram(hist, count, lo, hi):
+    """Per-pixel median from (n_pix, bins) counts, interpolated inside the bin."""
+    bins = hist.shape[1]
+    width = (hi - lo) / bins
+    cum = np.cumsum(hist, axis=1, dtype="float64")
+    target = 0.5 * count
+    b = np.argmax(cum >= target[:, None], axis=1)
+    pix = np.arange(hist.shape[0])
+    prev = np.where(b > 0, cum[pix, np.maximum(b - 1, 0)], 0.0)
+    c = hist[pix, b].astype("float64")
+    frac = np.divide(target - prev, c, out=np.zeros_like(c), where=c > 0)
+    med = lo + (b + np.clip(frac, 0.0, 1.0)) * width
+    med[count == 0] = np.nan
+    return med.astype("float32")
+
+
+def write_composites(variable, year=YEAR):
+    state = open_state(variable, year, create=False)
+    recover(state, variable)
+    lo, hi = VARIABLES[variable]["range"]
+    with rasterio.open(REFERENCE_GRID) as ref:
+        profile = ref.profile.copy()
+        height, width = ref.height, ref.width
+    profile.update(dtype="float32", count=1, nodata=np.nan, compress="lzw")
+    os.makedirs(COMPOSITE_DIR, exist_ok=True)
+    names = ["median", "mean", "heatmax", "count"]
+    paths = {n: os.path.join(COMPOSITE_DIR, f"Bengaluru_{variable}_{year}_{n}.tif") for n in names}
+    dsts = {n: rasterio.open(p, "w", **profile) for n, p in paths.items()}
+    try:
+        for r0 in range(0, height, TILE_ROWS):
+            r1 = min(r0 + TILE_ROWS, height)
+            win = Window(0, r0, width, r1 - r0)
+            count = state["count"][r0:r1].reshape(-1).astype("float64")
+            hist = state["hist"][r0:r1].reshape(count.size, -1)
+            mean = np.divide(state["sum"][r0:r1].reshape(-1), count,
+                             out=np.full(count.size, np.nan), where=count > 0)
+            out = {
+                "median": median_from_histogram(hist, count, lo, hi),
+                "mean": mean,
+                "heatmax": state["heat_max"][r0:r1].reshape(-1),
+                "count": count,
+            }
+            for n in names:
+                dsts[n].write(out[n].reshape(r1 - r0, width).astype("float32"), 1, window=win)
+    finally:
+        for dst in dsts.values():
+            dst.close()
+    print(f"✅ {variable} {year}: {len(state['manifest']['scenes'])} scenes → "
+          + ", ".join(os.path.basename(p) for p in paths.values()))
+
+
+def scene_variable(path):
+    """Variable of a scene from its folder (SCENE_DIR/<variable>/) or a _<variable>_ token in its name."""
+    folder = os.path.basename(os.path.dirname(os.path.abspath(path))).upper()
+    tokens = re.split(r"[^A-Za-z0-9]+", scene_id(path).upper())
+    for var in VARIABLES:
+        if var.upper() == folder or var.upper() in tokens:
+            return var
+    return None
+
+
+def scan_scenes(variable):
+    return glob.glob(os.path.join(SCENE_DIR, variable, "*.tif")) + \
+        glob.glob(os.path.join(SCENE_DIR, variable, "*.TIF"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-temporal LST/NDVI ingestion and seasonal composites")
+    parser.add_argument("command", nargs="?", default="update", choices=["update", "ingest", "composite", "rebuild"])
+    parser.add_argument("paths", nargs="*", help="scene files (ingest only; default: scan SCENE_DIR)")
+    parser.add_argument("--variable", choices=list(VARIABLES), help="restrict to one variable")
+    parser.add_argument("--year", type=int, default=YEAR)
+    args = parser.parse_args()
+
+    variables = [args.variable] if args.variable else list(VARIABLES)
+    routed = {var: [] for var in variables}
+    for path in args.paths:
+        var = args.variable or scene_variable(path)
+        if var is None:
+            parser.error(f"cannot tell whether {path} is LST or NDVI: put it in an LST/ or NDVI/ folder "
+                         "or pass --variable")
+        routed[var].append(path)
+    for var in variables:
+        if args.paths and not routed[var]:
+            continue
+        if args.command in ("update", "ingest"):
+            ingest(var, routed[var] or scan_scenes(var), args.year)
+        if args.command == "rebuild":
+            rebuild(var, args.year)
+        if args.command in ("update", "composite", "rebuild"):
+            write_composites(var, args.year)
+
+    print("\n🎯 Temporal composites up to date.")
+    print("✅ Point Phase 2 LST_PATH / NDVI_PATH at the *_median.tif or *_heatmax.tif composites.")
@@ -3,66 +3,47 @@ Urban Heat Island (UHI) Project
 Phase 3: Normalization & Constraint Mask Creation
 ------------------------------------------------
 This script:
-1. Normalizes LST and NDVI rasters to a 1–10 scale
+1. Normalizes LST and NDVI rasters to a 1–10 scale (percentile-clipped bounds from
+   uhi/bounds.py, so a single outlier pixel no longer compresses the range)
 2. Creates a binary constraint mask from LULC
 3. Saves outputs for AHP/Weighted Overlay analysis
 
+Run with --profile for a per-step time / memory / bytes report (uhi/profiling.py).
+
 Author: Sanyam Verma
 Date: November 2025
 """
 
-import rasterio
 import numpy as np
+# (the normalization / mask functions live in uhi/normalize.py)
+from uhi.normalize import normalize_raster, create_constraint_mask
+from uhi.profiling import profile_from_argv
 
 # === Step 1: Define file paths ===
 LST_PATH = "Bengaluru_LST_2024_CRS_Clean.tif"
 NDVI_PATH = "Bengaluru_NDVI_2024_CRS_Clean.tif"
 LULC_PATH = "Bengaluru_LULC_2024_Resampled_Clean.tif"
 
-# === Step 2: Define normalization function ===
-def normalize(array, inverse=False):
-    """Normalize array values to a 1–10 scale."""
-    arr = array.astype(float)
-    arr_min, arr_max = np.nanmin(arr), np.nanmax(arr)
-    norm = (arr - arr_min) / (arr_max - arr_min) * 9 + 1  # scale to 1–10
-    if inverse:
-        norm = 11 - norm  # flip scale if needed
-    return np.clip(norm, 1, 10)
+if __name__ == "__main__":
+    profile_from_argv("phase3")
 
-# === Step 3: Normalize LST (direct) ===
-with rasterio.open(LST_PATH) as src:
-    lst = src.read(1)
-    profile = src.profile
-lst_norm = normalize(lst)
-with rasterio.open("LST_norm.tif", "w", **profile) as dst:
-    dst.write(lst_norm.astype("float32"), 1)
-print("✅ LST normalized → LST_norm.tif")
+    # === Step 3: Normalize LST (direct) ===
+    lst_range = normalize_raster(LST_PATH, "LST_norm.tif")
+    print("✅ LST normalized → LST_norm.tif")
 
-# === Step 4: Normalize NDVI (inverse: greener = cooler = lower score) ===
-with rasterio.open(NDVI_PATH) as src:
-    ndvi = src.read(1)
-    profile = src.profile
-ndvi_norm = normalize(ndvi, inverse=True)
-with rasterio.open("NDVI_norm.tif", "w", **profile) as dst:
-    dst.write(ndvi_norm.astype("float32"), 1)
-print("✅ NDVI normalized (inverse) → NDVI_norm.tif")
+    # === Step 4: Normalize NDVI (inverse: greener = cooler = lower score) ===
+    ndvi_range = normalize_raster(NDVI_PATH, "NDVI_norm.tif", inverse=True)
+    print("✅ NDVI normalized (inverse) → NDVI_norm.tif")
 
-# === Step 5: Create Constraint Mask from LULC ===
-# Rule: Built-up (80) → 0, Water (50) → 0, others → 1
-with rasterio.open(LULC_PATH) as src:
-    lulc = src.read(1)
-    profile = src.profile
+    # === Step 5: Create Constraint Mask from LULC ===
+    mask = create_constraint_mask(LULC_PATH, "Constraint_Mask.tif")
+    print("✅ Constraint mask created → Constraint_Mask.tif")
 
-mask = np.ones_like(lulc, dtype="uint8")
-mask[(lulc == 50) | (lulc == 80)] = 0  # unsuitable
-with rasterio.open("Constraint_Mask.tif", "w", **profile) as dst:
-    dst.write(mask, 1)
-print("✅ Constraint mask created → Constraint_Mask.tif")
+    # === Step 6: Quick checks ===
+    print("\n--- Verification ---")
+    print("LST_norm range:", lst_range[0], "to", lst_range[1])
+    print("NDVI_norm range:", ndvi_range[0], "to", ndvi_range[1])
+    print("Constraint mask unique values:", np.unique(mask))
+    print("\n🎯 Normalization & Mask creation complete.")
+    print("Next: Phase 4 → AHP Weighting & Weighted Overlay.")
 
-# === Step 6: Quick checks ===
-print("\n--- Verification ---")
-print("LST_norm range:", np.nanmin(lst_norm), "to", np.nanmax(lst_norm))
-print("NDVI_norm range:", np.nanmin(ndvi_norm), "to", np.nanmax(ndvi_norm))
-print("Constraint mask unique values:", np.unique(mask))
-print("\n🎯 Normalization & Mask creation complete.")
-print("Next: Phase 4 → AHP Weighting & Weighted Overlay.")
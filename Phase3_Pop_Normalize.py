@@ -1,53 +1,17 @@
-import rasterio
-from rasterio.warp import calculate_default_transform, reproject, Resampling
-import numpy as np
+# (normalize_population lives in uhi/normalize.py)
+from uhi.normalize import normalize_population
+from uhi.profiling import profile_from_argv
 
 # Paths
 pop_path = "bengaluru_pop_100m_epsg4326.tif"
 template_path = "LST_norm.tif"      # 30 m template
 output_path = "Population_norm.tif"
-
-# Load template (for CRS, transform, shape)
-with rasterio.open(template_path) as t:
-    template_meta = t.meta.copy()
-    template_transform = t.transform
-    template_crs = t.crs
-    template_shape = (t.height, t.width)
-
-# Read and resample population raster to match template
-with rasterio.open(pop_path) as src:
-    pop_data = src.read(1)
-    pop_meta = src.meta.copy()
-
-    resampled = np.zeros(template_shape, dtype='float32')
-
-    reproject(
-        source=pop_data,
-        destination=resampled,
-        src_transform=src.transform,
-        src_crs=src.crs,
-        dst_transform=template_transform,
-        dst_crs=template_crs,
-        resampling=Resampling.bilinear
-    )
-
-# Normalize to 1–10 scale
-arr = resampled.astype(float)
-arr[arr < 0] = 0  # safety
-valid = arr[arr > 0]
-
-if valid.size > 0:
-    mn = valid.min()
-    mx = valid.max()
-    norm = (arr - mn) / (mx - mn) * 9 + 1
-    norm = np.clip(norm, 1, 10)
-else:
-    norm = arr
-
-# Save Population_norm.tif
-template_meta.update(dtype='float32', compress='lzw')
-
-with rasterio.open(output_path, 'w', **template_meta) as dst:
-    dst.write(norm.astype('float32'), 1)
-
-print("Population_norm.tif created successfully!")
+lulc_path = "Bengaluru_LULC_2024_Resampled_Clean.tif"   # Phase2 LULC on the template grid (dasymetric)
+resampling = "bilinear"             # "conserve" / "dasymetric": people per pixel sum to the WorldPop total
+counts_path = None                  # e.g. "Population_30m_counts.tif" to keep the resampled counts
+
+if __name__ == "__main__":
+    profile_from_argv("phase3_pop")      # --profile: per-step time / memory / bytes report
+    normalize_population(pop_path, template_path, output_path, resampling=resampling, lulc_path=lulc_path,
+                         counts_path=counts_path)
+    print("Population_norm.tif created successfully!")
@@ -0,0 +1,327 @@
+"""
+Benchmark suite
+---------------
+Times and memory-profiles every phase on synthetic inputs (synthetic.py) of
+configurable size:
+
+  phase2_resample   LULC -> LST grid (uhi.preprocess resample_raster)
+  phase2_clean      NaN cleaning of the LST scene (uhi.preprocess clean_nodata)
+  phase3_normalize  LST + NDVI 1-10 scaling with cold histogram bounds (uhi.normalize)
+  phase3_mask       LULC constraint mask (uhi.normalize)
+  phase3_population population reprojection + scaling (uhi.normalize)
+  phase3_pop_dasymetric  mass-conserving LULC-weighted population downscaling + scaling
+  entropy           streaming entropy weights (uhi.ensemble)
+  monte_carlo       weight draws + tiled ensemble with all products written (uhi.ensemble)
+  clip              AOI polygon clip of the ensemble mean (uhi.clip)
+  classify          priority classes + areas (uhi.classify)
+  point_queries     QUERY_POINTS radius lookups in column chunks (uhi.query)
+
+Each repeat of a case runs in a fresh process, so its peak RSS is its own.
+Stage breakdowns and bytes read / written come from uhi/profiling.py. Results go to
+benchmarks/results/bench_<commit>_<time>.json, so runs on different commits can
+be compared:
+
+    python benchmarks/run_benchmarks.py run --sizes 1000 2000
+    python benchmarks/run_benchmarks.py run --sizes 20000 --cases monte_carlo --repeats 1
+    python benchmarks/run_benchmarks.py compare results/bench_a.json results/bench_b.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+for p in (REPO_DIR, BENCH_DIR):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+# ========== CONFIG ==========
+SIZES = (1000, 2000)             # default grid sizes (size x size LST pixels); up to 20000 works
+REPEATS = 3
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+MC_DRAWS = 32                    # Monte Carlo weight draws (fixed, no early stopping)
+QUERY_POINTS = 10000
+QUERY_RADIUS_M = (100, 1000)
+REGRESSION_THRESHOLD = 1.10      # compare: flag cases that got more than 10 % slower / bigger
+CASES = ("phase2_resample", "phase2_clean", "phase3_normalize", "phase3_mask", "phase3_population",
+         "phase3_pop_dasymetric", "entropy", "monte_carlo", "clip", "classify", "point_queries")
+
+# Files each case reads / writes inside the work directory of one size
+def work_paths(work):
+    return {
+        "lulc_30m": os.path.join(work, "LULC_Resampled.tif"),
+        "lst_clean": os.path.join(work, "LST_Clean.tif"),
+        "lst_norm": os.path.join(work, "LST_norm.tif"),
+        "ndvi_norm": os.path.join(work, "NDVI_norm.tif"),
+        "pop_norm": os.path.join(work, "Population_norm.tif"),
+        "pop_dasymetric": os.path.join(work, "Population_norm_dasymetric.tif"),
+        "mask": os.path.join(work, "Constraint_Mask.tif"),
+        "entropy": os.path.join(work, "entropy_weights.json"),
+        "map": os.path.join(work, "Final_UHI_Mitigation_Map_Hybrid.tif"),
+        "mean": os.path.join(work, "Final_UHI_Ensemble_mean.tif"),
+        "clipped": os.path.join(work, "Ensemble_mean_clipped.tif"),
+        "classes": os.path.join(work, "UHI_Priority_Classes.tif"),
+    }
+
+# ---------- Cases ----------
+def case_phase2_resample(inputs, w):
+    from uhi import preprocess as p2
+    p2.resample_raster(inputs["lulc"], inputs["lst"], w["lulc_30m"])
+
+def case_phase2_clean(inputs, w):
+    from uhi import preprocess as p2
+    p2.clean_nodata(inputs["lst"], w["lst_clean"])
+
+def case_phase3_normalize(inputs, w):
+    from uhi import normalize as p3
+    from uhi.bounds import sidecar_path
+    for src in (inputs["lst"], inputs["ndvi"]):
+        if os.path.exists(sidecar_path(src)):
+            os.remove(sidecar_path(src))   # cold bounds: include the histogram scan
+    p3.normalize_raster(inputs["lst"], w["lst_norm"])
+    p3.normalize_raster(inputs["ndvi"], w["ndvi_norm"], inverse=True)
+
+def case_phase3_mask(inputs, w):
+    from uhi import normalize as p3
+    p3.create_constraint_mask(w["lulc_30m"], w["mask"])
+
+def case_phase3_population(inputs, w):
+    from uhi import normalize as pop
+    pop.normalize_population(inputs["pop"], w["lst_norm"], w["pop_norm"])
+
+def case_phase3_pop_dasymetric(inputs, w):
+    from uhi import normalize as pop
+    pop.normalize_population(inputs["pop"], w["lst_norm"], w["pop_dasymetric"], resampling="dasymetric",
+                             lulc_path=w["lulc_30m"])
+
+def _criteria_stack(w):
+    from uhi import ensemble as P
+    registry = {name: {"path": w[key], "inverse": False, "resampling": "bilinear",
+                       "normalize": False, "bounds": "minmax"}
+                for name, key in (("LST", "lst_norm"), ("NDVI", "ndvi_norm"), ("Population", "pop_norm"))}
+    # The 0/1 Phase3 mask stands in for the 0.0001 soft mask; the work per pixel is the same
+    return P.CriteriaStack(list(registry), w["lst_norm"], w["mask"], registry=registry)
+
+def case_entropy(inputs, w):
+    from uhi import ensemble as P
+    with _criteria_stack(w) as cstack:
+        ent_w = P.entropy_weights_streaming(cstack)
+    with open(w["entropy"], "w") as f:
+        json.dump(ent_w.tolist(), f)
+
+def case_monte_carlo(inputs, w):
+    from uhi import ensemble as P
+    P.OUTPUT_DIR = os.path.dirname(w["map"])
+    with open(w["entropy"]) as f:
+        ent_w = np.array(json.load(f))
+    base_M = P.build_pairwise_matrix(["LST", "NDVI", "Population"], P.PAIRWISE)
+    w_ahp, _ = P.ahp_weights_from_matrix(base_M)
+    combined = P.ALPHA * w_ahp + (1.0 - P.ALPHA) * ent_w
+    draws, _ = P.draw_weight_ensemble(base_M, ent_w, MC_DRAWS, sigma=P.PERTURB_SIGMA, alpha=P.ALPHA,
+                                      sampler=P.SAMPLER, seed=P.SEED, tol=None)
+    with _criteria_stack(w) as cstack:
+        exceedance = P.exceedance_thresholds()
+        writers = P.open_product_writers(P.product_paths(exceedance), cstack.meta, thresholds=exceedance)
+        try:
+            P.run_ensemble(cstack, draws, lambda r0, r1, prod: [P.write_window(d, r0, prod[k])
+                                                                for k, d in writers.items()],
+                           thresholds=exceedance, baseline_weights=combined / combined.sum())
+        finally:
+            for d in writers.values():
+                d.close()
+
+def case_clip(inputs, w):
+    import rasterio
+    from uhi import clip
+    with rasterio.open(w["mean"]) as src:
+        b = src.bounds
+    # AOI: a 64-vertex polygon around the centre, covering about half the map
+    cx, cy = (b.left + b.right) / 2, (b.bottom + b.top) / 2
+    rx, ry = (b.right - b.left) * 0.4, (b.top - b.bottom) * 0.4
+    t = np.linspace(0, 2 * np.pi, 65)
+    ring = np.column_stack([cx + rx * np.cos(t) * (1 + 0.1 * np.sin(5 * t)),
+                            cy + ry * np.sin(t) * (1 + 0.1 * np.sin(5 * t))])
+    clip.clip_raster(w["mean"], [{"type": "Polygon", "coordinates": [ring.tolist()]}], w["clipped"])
+
+def case_classify(inputs, w):
+    from uhi import classify
+    classify.classify_map(w["map"], w["classes"])
+
+def case_point_queries(inputs, w):
+    import rasterio
+    from uhi import query as uhi_query
+    from uhi.profiling import stage
+    with rasterio.open(w["map"]) as src:
+        b = src.bounds
+        rng = np.random.default_rng(0)
+        chunk = {
+            "name": np.array([f"P{i}" for i in range(QUERY_POINTS)], dtype=object),
+            "lat": rng.uniform(b.bottom, b.top, QUERY_POINTS),
+            "lon": rng.uniform(b.left, b.right, QUERY_POINTS),
+            "radius": rng.uniform(*QUERY_RADIUS_M, QUERY_POINTS),
+        }
+        with stage("analyze_chunk"):
+            uhi_query.analyze_chunk(src, chunk)
+
+# ---------- Runner ----------
+def _child(case, inputs, w, trace_memory, queue):
+    from uhi import profiling
+    # Imports are not part of the measurement
+    for mod in ("rasterio", "scipy.ndimage", "pandas", "uhi.ensemble"):
+        __import__(mod)
+    rss0 = profiling.rss_mb()
+    profiling.enable(trace_memory)
+    out = io.StringIO()
+    t0, c0 = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(out), profiling.stage(case):
+        globals()["case_" + case](inputs, w)
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+    rep = profiling.report()
+    queue.put({"wall_s": wall, "cpu_s": cpu, "rss_before_mb": rss0, "peak_rss_mb": rep["peak_rss_mb"],
+               "stages": rep["stages"], "io": rep["io"]})
+
+def run_case(case, inputs, w, trace_memory=False):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(case, inputs, w, trace_memory, queue))
+    proc.start()
+    try:
+        result = queue.get()
+    finally:
+        proc.join()
+    return result
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def host_info():
+    import rasterio
+    import scipy
+    info = {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__,
+            "rasterio": rasterio.__version__, "gdal": rasterio.__gdal_version__}
+    try:
+        import numba
+        info["numba"] = numba.__version__
+    except ImportError:
+        info["numba"] = None
+    return info
+
+def run_suite(sizes=SIZES, cases=CASES, repeats=REPEATS, seed=0, trace_memory=False, keep=False, out=None):
+    from synthetic import make_inputs
+    commit, dirty = git_commit()
+    results = {"commit": commit, "dirty": dirty, "created": datetime.now().isoformat(timespec="seconds"),
+               "host": host_info(),
+               "config": {"sizes": list(sizes), "cases": list(cases), "repeats": repeats, "seed": seed,
+                          "mc_draws": MC_DRAWS, "query_points": QUERY_POINTS, "tracemalloc": trace_memory},
+               "results": {}}
+    # Later cases use the outputs of earlier ones, so the dependencies always run
+    needed = [c for c in CASES if c in cases or CASES.index(c) < max(CASES.index(x) for x in cases)]
+    for size in sizes:
+        inputs = make_inputs(os.path.join(DATA_DIR, str(size)), size, seed)
+        work = os.path.join(DATA_DIR, str(size), "work")
+        os.makedirs(work, exist_ok=True)
+        w = work_paths(work)
+        per_size = results["results"][str(size)] = {}
+        for case in needed:
+            timed = case in cases
+            runs = [run_case(case, inputs, w, trace_memory) for _ in range(repeats if timed else 1)]
+            if not timed:
+                continue
+            walls = [r["wall_s"] for r in runs]
+            best = runs[int(np.argmin(walls))]
+            per_size[case] = {
+                "wall_s": [round(x, 4) for x in walls],
+                "median_wall_s": round(float(np.median(walls)), 4),
+                "min_wall_s": round(float(np.min(walls)), 4),
+                "cpu_s": round(float(np.median([r["cpu_s"] for r in runs])), 4),
+                "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+                "rss_delta_mb": round(max(r["peak_rss_mb"] - r["rss_before_mb"] for r in runs), 1),
+                "mpix_per_s": round(size * size / 1e6 / float(np.median(walls)), 2),
+                "read_mb": round(sum(c["read_bytes"] for c in best["io"].values()) / 2**20, 1),
+                "written_mb": round(sum(c["written_bytes"] for c in best["io"].values()) / 2**20, 1),
+                "stages": best["stages"],
+            }
+            r = per_size[case]
+            print(f"⏱️ {size}² {case:<18} median {r['median_wall_s']:8.3f} s | "
+                  f"peak RSS {r['peak_rss_mb']:7.0f} MB (+{r['rss_delta_mb']:.0f}) | {r['mpix_per_s']:7.2f} Mpix/s")
+        if not keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    out = out or os.path.join(RESULTS_DIR, f"bench_{(commit or 'nogit')[:8]}_{stamp}.json")
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Benchmark results saved → {out}")
+    return results
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """Print the median-time and peak-RSS ratios new/old; returns the regressed (size, case) pairs."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"old: {old['commit'] and old['commit'][:8]} ({old['created']})   new: {new['commit'] and new['commit'][:8]} ({new['created']})")
+    if old["host"] != new["host"]:
+        print("⚠️ Different host / library versions, ratios may not mean much")
+    print(f"{'size':>7} {'case':<18}{'old s':>10}{'new s':>10}{'time':>8}{'old MB':>9}{'new MB':>9}{'RSS':>7}")
+    regressed = []
+    for size, cases in new["results"].items():
+        for case, r in cases.items():
+            o = old["results"].get(size, {}).get(case)
+            if o is None:
+                continue
+            t = r["median_wall_s"] / o["median_wall_s"] if o["median_wall_s"] else float("nan")
+            m = r["peak_rss_mb"] / o["peak_rss_mb"] if o["peak_rss_mb"] else float("nan")
+            flag = ""
+            if t > threshold or m > threshold:
+                flag = " 🔺"
+                regressed.append((size, case))
+            elif t < 1 / threshold:
+                flag = " ✅"
+            print(f"{size:>7} {case:<18}{o['median_wall_s']:>10.3f}{r['median_wall_s']:>10.3f}{t:>7.2f}x"
+                  f"{o['peak_rss_mb']:>9.0f}{r['peak_rss_mb']:>9.0f}{m:>6.2f}x{flag}")
+    print(f"{len(regressed)} regression(s) above {threshold:.2f}x")
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UHI pipeline benchmarks on synthetic rasters")
+    sub = parser.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run", help="run the benchmarks and save a JSON result file")
+    r.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="grid sizes (pixels per side)")
+    r.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    r.add_argument("--repeats", type=int, default=REPEATS)
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--tracemalloc", action="store_true", help="also record per-stage tracemalloc peaks (slower)")
+    r.add_argument("--keep", action="store_true", help="keep the intermediate rasters in benchmarks/data/<size>/work")
+    r.add_argument("--out", help="result file (default benchmarks/results/bench_<commit>_<time>.json)")
+    c = sub.add_parser("compare", help="compare two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    if args.command == "run":
+        run_suite(args.sizes, args.cases, args.repeats, args.seed, args.tracemalloc, args.keep, args.out)
+    else:
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
@@ -0,0 +1,167 @@
+"""
+Synthetic Bengaluru-like inputs for the benchmarks
+--------------------------------------------------
+Writes LST / NDVI / LULC / population GeoTIFFs of any size (1k x 1k up to
+20k x 20k pixels and beyond). Everything is generated in row blocks, so memory
+stays bounded by BLOCK_ROWS whatever the size.
+
+All layers come from the same smooth "urbanness" field, so they are correlated
+the way the real data is:
+  LST         deg C, 28-45, hotter in the built-up core, a few hot outlier roofs,
+              NaN outside the scene footprint (like the Landsat exports)
+  NDVI        -0.2 .. 0.9, low where LST is high, negative over water
+  LULC        ESA WorldCover codes (10 tree, 30 grass, 40 crop, 50 built-up,
+              60 bare, 80 water), at LULC_FACTOR x the LST resolution
+  Population  people per 100 m pixel (log-normal, concentrated in the core),
+              on a coarser 100 m grid
+
+Usage:
+    python benchmarks/synthetic.py 2000 --out benchmarks/data/2000
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from scipy.ndimage import gaussian_filter, map_coordinates
+
+# ========== CONFIG ==========
+ORIGIN = (77.30, 13.25)          # top-left lon / lat
+RES_DEG = 0.00027                # ~30 m pixels, like the Phase2 grid
+LULC_FACTOR = 2                  # LULC pixels per LST pixel (the real LULC is 10 m)
+POP_RES_M = 100                  # population grid
+COARSE_PIXELS = 64               # LST pixels per cell of the smooth base fields
+BLOCK_ROWS = 1024
+HOT_OUTLIER_FRACTION = 1e-4      # share of pixels with +8..15 deg C (roofs, industry)
+WATER_FRACTION = 0.03
+GENERATOR_VERSION = 1            # bump when the generated data changes
+PROFILE = dict(driver="GTiff", crs="EPSG:4326", tiled=True, blockxsize=512, blockysize=512,
+               compress="lzw", count=1)
+
+class Fields:
+    """Smooth base fields on a coarse grid, sampled bilinearly at any resolution."""
+
+    def __init__(self, size, seed):
+        self.size = size
+        n = size // COARSE_PIXELS + 4
+        rng = np.random.default_rng(seed)
+        self.noise = {k: gaussian_filter(rng.standard_normal((n, n)), 1.5) for k in ("urban", "water", "green")}
+        for k, v in self.noise.items():
+            self.noise[k] = (v - v.mean()) / v.std()
+        self.rng = np.random.default_rng(seed + 1)
+
+    def sample(self, key, rows, cols):
+        """Field `key` at fractional LST-pixel coordinates (rows, cols are 1D)."""
+        rr, cc = np.meshgrid(rows / COARSE_PIXELS + 1, cols / COARSE_PIXELS + 1, indexing="ij")
+        return map_coordinates(self.noise[key], [rr, cc], order=1, mode="nearest").astype("float32")
+
+    def urban(self, rows, cols):
+        """0-1 urbanness: a radial city core plus smooth noise."""
+        rr, cc = np.meshgrid(rows / self.size - 0.5, cols / self.size - 0.5, indexing="ij")
+        core = np.exp(-(rr**2 + cc**2) / 0.08)
+        z = 2.5 * core - 1.0 + 0.6 * self.sample("urban", rows, cols)
+        return (1.0 / (1.0 + np.exp(-2.5 * z))).astype("float32")
+
+    def water(self, rows, cols):
+        w = self.sample("water", rows, cols)
+        return w > np.quantile(self.noise["water"], 1.0 - WATER_FRACTION)
+
+def _write(path, height, width, dtype, transform, nodata, block_fn):
+    profile = dict(PROFILE, height=height, width=width, dtype=dtype, transform=transform, nodata=nodata)
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, height, BLOCK_ROWS):
+            r1 = min(r0 + BLOCK_ROWS, height)
+            dst.write(block_fn(r0, r1).astype(dtype), 1, window=((r0, r1), (0, width)))
+
+def make_inputs(out_dir, size, seed=0):
+    """Write LST / NDVI / LULC / population rasters of `size` x `size` LST pixels; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {"size": size, "seed": seed, "version": GENERATOR_VERSION, "lulc_factor": LULC_FACTOR}
+    paths = {k: os.path.join(out_dir, f) for k, f in
+             [("lst", "Synthetic_LST.tif"), ("ndvi", "Synthetic_NDVI.tif"),
+              ("lulc", "Synthetic_LULC.tif"), ("pop", "Synthetic_Pop_100m.tif")]}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f).get("inputs") == manifest and all(os.path.exists(p) for p in paths.values()):
+                return paths
+
+    fields = Fields(size, seed)
+    cols = np.arange(size, dtype="float32")
+    transform = from_origin(ORIGIN[0], ORIGIN[1], RES_DEG, RES_DEG)
+
+    def footprint(rows):
+        # Scene footprint: a slightly rotated square, NaN outside (Landsat-style edges)
+        rr, cc = np.meshgrid(rows / size - 0.5, cols / size - 0.5, indexing="ij")
+        return (np.abs(rr * 0.98 + cc * 0.2) < 0.5) & (np.abs(cc * 0.98 - rr * 0.2) < 0.5)
+
+    def lst_block(r0, r1):
+        rows = np.arange(r0, r1, dtype="float32")
+        u = fields.urban(rows, cols)
+        lst = 30.0 + 11.0 * u + 1.5 * fields.sample("green", rows, cols) * (1 - u)
+        lst += fields.rng.normal(0.0, 0.6, lst.shape)
+        lst[fields.water(rows, cols)] -= 4.0
+        hot = fields.rng.random(lst.shape) < HOT_OUTLIER_FRACTION
+        lst[hot] += fields.rng.uniform(8.0, 15.0, int(hot.sum()))
+        lst[~footprint(rows)] = np.nan
+        return lst
+
+    def ndvi_block(r0, r1):
+        rows = np.arange(r0, r1, dtype="float32")
+        u = fields.urban(rows, cols)
+        ndvi = 0.65 - 0.55 * u + 0.12 * fields.sample("green", rows, cols) + fields.rng.normal(0, 0.05, u.shape)
+        water = fields.water(rows, cols)
+        ndvi[water] = fields.rng.uniform(-0.2, -0.02, int(water.sum()))
+        ndvi = np.clip(ndvi, -0.2, 0.9)
+        ndvi[~footprint(rows)] = np.nan
+        return ndvi
+
+    lulc_cols = np.arange(size * LULC_FACTOR, dtype="float32") / LULC_FACTOR
+
+    def lulc_block(r0, r1):
+        rows = np.arange(r0, r1, dtype="float32") / LULC_FACTOR
+        u = fields.urban(rows, lulc_cols) + fields.rng.normal(0, 0.08, (len(rows), len(lulc_cols)))
+        g = fields.sample("green", rows, lulc_cols)
+        lulc = np.full(u.shape, 30, dtype="uint8")           # grassland
+        lulc[g > 0.5] = 10                                   # tree cover
+        lulc[(g < -0.8) & (u < 0.3)] = 40                    # cropland
+        lulc[(g < -1.5) & (u < 0.5)] = 60                    # bare
+        lulc[u > 0.55] = 50                                  # built-up
+        lulc[fields.water(rows, lulc_cols)] = 80             # water
+        return lulc
+
+    pop_factor = POP_RES_M / 30.0
+    pop_size = max(1, int(round(size / pop_factor)))
+    pop_cols = np.arange(pop_size, dtype="float32") * pop_factor
+
+    def pop_block(r0, r1):
+        rows = np.arange(r0, r1, dtype="float32") * pop_factor
+        u = fields.urban(rows, pop_cols)
+        pop = np.exp(1.0 + 4.0 * u + fields.rng.normal(0, 0.7, u.shape))
+        pop[u < 0.15] = 0.0
+        pop[fields.water(rows, pop_cols)] = 0.0
+        return pop
+
+    print(f"🧪 Generating {size}x{size} synthetic inputs in {out_dir}...")
+    _write(paths["lst"], size, size, "float32", transform, None, lst_block)
+    _write(paths["ndvi"], size, size, "float32", transform, None, ndvi_block)
+    _write(paths["lulc"], size * LULC_FACTOR, size * LULC_FACTOR, "uint8",
+           from_origin(ORIGIN[0], ORIGIN[1], RES_DEG / LULC_FACTOR, RES_DEG / LULC_FACTOR), 0, lulc_block)
+    _write(paths["pop"], pop_size, pop_size, "float32",
+           from_origin(ORIGIN[0], ORIGIN[1], RES_DEG * pop_factor, RES_DEG * pop_factor), None, pop_block)
+    with open(manifest_path, "w") as f:
+        json.dump({"inputs": manifest, "paths": paths}, f, indent=2)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic LST / NDVI / LULC / population rasters")
+    parser.add_argument("size", type=int, help="LST grid size in pixels (size x size)")
+    parser.add_argument("--out", default=None, help="output directory (default benchmarks/data/<size>)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", str(args.size))
+    for key, path in make_inputs(out, args.size, args.seed).items():
+        print(f"✅ {key}: {path}")
@@ -0,0 +1,8 @@
+"""Kept for old commands; the code lives in uhi/hotspots.py (same as `python -m uhi hotspots`)."""
+import sys
+from uhi import hotspots as _module
+
+if __name__ == "__main__":
+    _module.main()
+else:
+    sys.modules[__name__] = _module
@@ -0,0 +1,8 @@
+"""Gi* / local Moran hotspot statistics; the code lives in uhi/spatial_stats.py (same as `python -m uhi spatial`)."""
+import sys
+from uhi import spatial_stats as _module
+
+if __name__ == "__main__":
+    _module.main()
+else:
+    sys.modules[__name__] = _module
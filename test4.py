@@ -1,3 +1,8 @@
+import folium
+
+# Raster overlays come from the local tile server (python tile_server.py)
+TILE_SERVER = "http://127.0.0.1:8765"
+
 # Define sites based on Mitigation Priority
 sites = [
     # --- HIGH PRIORITY (Hot, Dense, Industrial/Commercial) ---
@@ -36,6 +41,20 @@ for s in sites:
         icon=folium.Icon(color=s["Color"], icon="info-sign")
     ).add_to(m)
 
+# Overlay the rasters as XYZ tiles rendered on demand by tile_server.py
+for layer, title, show in [("priority", "UHI Priority Score", True),
+                           ("classes", "UHI Priority Classes", False),
+                           ("std", "Ensemble Uncertainty (std)", False)]:
+    folium.raster_layers.TileLayer(
+        tiles=f"{TILE_SERVER}/tiles/{layer}/{{z}}/{{x}}/{{y}}.png",
+        attr="UHI tile server",
+        name=title,
+        overlay=True,
+        opacity=0.7,
+        show=show,
+    ).add_to(m)
+folium.LayerControl(collapsed=False).add_to(m)
+
 # Add a Legend (HTML overlay)
 legend_html = '''
      <div style="position: fixed; 
@@ -0,0 +1,151 @@
+import numpy as np
+import pytest
+
+from uhi import ensemble as E
+from uhi.normalize import SOFT_MASK_VALUE
+
+KERNELS = ["numpy", pytest.param("numba", marks=pytest.mark.skipif(not E.HAVE_NUMBA, reason="numba not installed"))]
+THRESHOLDS = (4.0, 6.0)
+
+
+# In-memory stand-in for CriteriaStack: run_ensemble only needs these members
+class ArrayStack:
+    def __init__(self, data, mask=None):
+        self.data = data
+        self.mask = mask
+        self.names = [f"c{i}" for i in range(data.shape[0])]
+        self.height, self.width = data.shape[1:]
+
+    def read_tile(self, r0, r1, names=None):
+        idx = [self.names.index(n) for n in (self.names if names is None else names)]
+        return self.data[idx, r0:r1].astype("float32")
+
+    def read_mask_tile(self, r0, r1):
+        return None if self.mask is None else self.mask[r0:r1]
+
+
+def synthetic_stack(seed=0, shape=(37, 23)):
+    rng = np.random.default_rng(seed)
+    data = rng.uniform(1, 10, (3,) + shape).astype("float32")
+    mask = np.where(rng.random(shape) < 0.2, SOFT_MASK_VALUE, 1.0)
+    return ArrayStack(data, mask.astype("float32"))
+
+
+def collect(cstack, draws, **kwargs):
+    parts = {}
+
+    def on_tile(r0, r1, products):
+        for key, arr in products.items():
+            parts.setdefault(key, {})[r0] = np.array(arr)
+
+    E.run_ensemble(cstack, draws, on_tile, verbose=False, thresholds=THRESHOLDS, **kwargs)
+    return {key: np.concatenate([tiles[r0] for r0 in sorted(tiles)], axis=-2) for key, tiles in parts.items()}
+
+
+def reference_scores(cstack, draws):
+    # One full-map overlay per draw, the way Phase4 computed it before the fused kernel
+    return np.stack([E.overlay_weighted(cstack.data, w) * cstack.mask for w in draws])
+
+
+@pytest.mark.parametrize("kernel", KERNELS)
+def test_fused_kernel_matches_reference_overlay(monkeypatch, kernel):
+    monkeypatch.setattr(E, "USE_NUMBA", kernel == "numba")
+    monkeypatch.setattr(E, "OVERLAY_CHUNK_PIXELS", 100)    # several NumPy chunks per tile
+    cstack = synthetic_stack()
+    draws = np.random.default_rng(1).dirichlet([5, 3, 4], size=40)
+    scores = reference_scores(cstack, draws)
+
+    products = collect(cstack, draws, tile_rows=16)
+
+    np.testing.assert_allclose(products["mean"], scores.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(products["std"], scores.std(axis=0), rtol=1e-3, atol=1e-4)
+    expected = np.stack([(scores >= thr).mean(axis=0) for thr in THRESHOLDS])
+    np.testing.assert_allclose(products["exceedance"], expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("kernel", KERNELS)
+def test_fused_kernel_weighted_draws(monkeypatch, kernel):
+    monkeypatch.setattr(E, "USE_NUMBA", kernel == "numba")
+    cstack = synthetic_stack(seed=2)
+    draws = np.random.default_rng(3).dirichlet([5, 3, 4], size=30)
+    sample_weights = np.random.default_rng(4).uniform(0.1, 1.0, size=30)
+    scores = reference_scores(cstack, draws)
+
+    products = collect(cstack, draws, tile_rows=16, sample_weights=sample_weights)
+
+    mean = np.average(scores, axis=0, weights=sample_weights)
+    std = np.sqrt(np.average((scores - mean) ** 2, axis=0, weights=sample_weights))
+    np.testing.assert_allclose(products["mean"], mean, rtol=1e-5)
+    np.testing.assert_allclose(products["std"], std, rtol=1e-3, atol=1e-4)
+
+
+class Interrupted(Exception):
+    pass
+
+
+# Checkpoint that saves on every check and stops the run after `stop_after` saves
+class InterruptingCheckpoint(E.MonteCarloCheckpoint):
+    def __init__(self, path, fingerprint, stop_after):
+        super().__init__(path, fingerprint, every_seconds=0)
+        self.stop_after = stop_after
+        self.saves = 0
+
+    def save(self, partial=None):
+        super().save(partial)
+        self.saves += 1
+        if self.saves > self.stop_after:
+            raise Interrupted
+
+
+def test_resumed_run_matches_uninterrupted_run(monkeypatch, tmp_path):
+    monkeypatch.setattr(E, "CHECKPOINT_SAMPLES", 7)     # several saves inside every tile
+    cstack = synthetic_stack(seed=5)
+    draws = np.random.default_rng(6).dirichlet([5, 3, 4], size=25)
+    full = collect(cstack, draws, tile_rows=16)
+
+    path = str(tmp_path / "checkpoint.npz")
+    fingerprint = {"run": 1}
+    parts = {}
+
+    def on_tile(r0, r1, products):
+        for key, arr in products.items():
+            parts.setdefault(key, {})[r0] = np.array(arr)
+
+    # Stop in the middle of the second tile, with the first one written
+    checkpoint = InterruptingCheckpoint(path, fingerprint, stop_after=6)
+    checkpoint.start({"samples": len(draws)}, draws=draws)
+    with pytest.raises(Interrupted):
+        E.run_ensemble(cstack, draws, on_tile, tile_rows=16, verbose=False, thresholds=THRESHOLDS,
+                       checkpoint=checkpoint)
+    assert list(parts["mean"]) == [0]
+
+    resumed = E.MonteCarloCheckpoint(path, fingerprint, every_seconds=None)
+    assert resumed.load()
+    assert resumed.done == [(0, 16)] and resumed.partial[:2] == (16, 32) and resumed.partial[2] > 0
+    E.run_ensemble(cstack, resumed.run["draws"], on_tile, tile_rows=16, verbose=False, thresholds=THRESHOLDS,
+                   checkpoint=resumed)
+
+    for key, arr in full.items():
+        stitched = np.concatenate([parts[key][r0] for r0 in sorted(parts[key])], axis=-2)
+        np.testing.assert_allclose(stitched, arr, rtol=1e-6, atol=1e-6, err_msg=key)
+
+
+def test_checkpoint_of_other_inputs_is_not_resumed(tmp_path):
+    path = str(tmp_path / "checkpoint.npz")
+    saved = E.MonteCarloCheckpoint(path, {"run": 1, "inputs": {"LST": ["LST_norm.tif", 100, 1]}})
+    saved.start({"samples": 1}, draws=np.ones((1, 3)))
+
+    assert E.MonteCarloCheckpoint(path, {"run": 1, "inputs": {"LST": ["LST_norm.tif", 100, 1]}}).load()
+    assert not E.MonteCarloCheckpoint(path, {"run": 1, "inputs": {"LST": ["LST_norm.tif", 100, 2]}}).load()
+
+
+def test_input_identity_changes_with_the_file(tmp_path):
+    path = tmp_path / "LST_norm.tif"
+    path.write_bytes(b"0" * 10)
+    cstack = ArrayStack(np.zeros((1, 2, 2)))
+    cstack.registry = {"c0": {"path": str(path)}}
+    cstack.mask_path = None
+
+    before = E.input_identity(cstack, template_path=str(path))
+    path.write_bytes(b"0" * 11)
+    assert E.input_identity(cstack, template_path=str(path)) != before
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from rasterio.transform import from_origin
+
+pytest.importorskip("scipy")
+from uhi.normalize import grid_edges, overlap_matrix, extent_coverage, conserve_regrid
+
+# 97 m source cells over a 30 m target grid whose extent cuts through source cells on every side
+SRC_TRANSFORM = from_origin(0, 1000, 97, 97)
+DST_TRANSFORM = from_origin(50, 950, 30, 30)
+DST_SHAPE = (25, 27)
+
+
+def regrid_setup(seed=0):
+    pop = np.random.default_rng(seed).uniform(0, 100, (12, 12))
+    row_edges, col_edges = grid_edges(SRC_TRANSFORM, pop.shape, DST_TRANSFORM)
+    fx = overlap_matrix(col_edges, DST_SHAPE[1])
+    # People of the source inside the target extent, edge cells pro rata
+    inside = extent_coverage(row_edges, DST_SHAPE[0]) @ pop @ extent_coverage(col_edges, DST_SHAPE[1])
+    return pop, row_edges, fx, inside
+
+
+def test_extent_cuts_source_cells():
+    pop, row_edges, fx, inside = regrid_setup()
+    assert 0 < inside < pop.sum()
+    assert np.any((extent_coverage(row_edges, DST_SHAPE[0]) > 0) & (extent_coverage(row_edges, DST_SHAPE[0]) < 1))
+
+
+@pytest.mark.parametrize("block_rows", [1, 4, 1000])
+def test_conserve_keeps_population(block_rows):
+    pop, row_edges, fx, inside = regrid_setup()
+    out = conserve_regrid(pop, row_edges, fx, DST_SHAPE, block_rows=block_rows)
+    assert out.sum() == pytest.approx(inside, rel=1e-12)
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 1000])
+def test_dasymetric_keeps_population_with_partial_edge_cells(block_rows):
+    pop, row_edges, fx, inside = regrid_setup(seed=1)
+    density = np.random.default_rng(2).choice([0.0, 0.1, 1.0], DST_SHAPE)
+    density[:3] = 0.0      # some source cells have no weighted pixels inside and fall back to area weights
+
+    out = conserve_regrid(pop, row_edges, fx, DST_SHAPE, density, block_rows=block_rows)
+
+    assert out.sum() == pytest.approx(inside, rel=1e-12)
+    assert out.min() >= 0
+
+
+def test_dasymetric_blocks_match_single_block():
+    pop, row_edges, fx, _ = regrid_setup(seed=3)
+    density = np.random.default_rng(4).choice([0.0, 0.1, 1.0], DST_SHAPE)
+    np.testing.assert_allclose(conserve_regrid(pop, row_edges, fx, DST_SHAPE, density, block_rows=3),
+                               conserve_regrid(pop, row_edges, fx, DST_SHAPE, density, block_rows=1000))
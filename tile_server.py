@@ -0,0 +1,8 @@
+"""Kept for old commands; the code lives in uhi/tiles.py (same as `python -m uhi tiles`)."""
+import sys
+from uhi import tiles as _module
+
+if __name__ == "__main__":
+    _module.main()
+else:
+    sys.modules[__name__] = _module
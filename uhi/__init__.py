@@ -0,0 +1,24 @@
+"""
+Bengaluru UHI mitigation pipeline as an importable package.
+
+Submodules are imported on first use (`uhi.ensemble`, `uhi.query`, ...), so
+`import uhi` itself costs nothing and the CLI (`python -m uhi`, see cli.py)
+only loads what a command needs.
+"""
+
+import importlib
+
+__version__ = "0.1.0"
+
+SUBMODULES = (
+    "bounds", "calibrate", "classify", "cli", "clip", "dask_backend", "ensemble", "hotspots", "locations", "normalize",
+    "preprocess", "profiling", "query", "service", "shared_stack", "spatial_stats", "stats", "tiles",
+)
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES))
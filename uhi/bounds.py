@@ -0,0 +1,286 @@
+"""
+Normalisation bounds service
+----------------------------
+Phase 3 used the raw min/max of each raster to scale it to 1-10, so a single
+hot outlier pixel squeezed the rest of the city into a narrow band. It also
+needed the whole array in memory just to find those two numbers.
+
+This module builds one fixed-bin histogram per raster in a single
+block-streaming pass. Blocks are scanned in parallel and their partial
+histograms are merged. Three kinds of bounds are derived from the histogram:
+
+  minmax      exact raw min / max (the old Phase3 behaviour)
+  percentile  PERCENTILES of the valid pixels (default 1 % - 99 %)
+  zscore      mean +/- ZSCORE_CLIP standard deviations (kept inside min / max)
+
+The histogram has 2**HIST_BITS bins over the float32 bit pattern, so it needs
+no prior knowledge of the value range. With 20 bits a bin is about 0.05 % of
+the value wide, and values inside a bin are interpolated.
+
+Summary stats and a percentile table are cached in a sidecar file next to the
+raster (<raster>.bounds.json). Later runs (Phase 4 tiled / incremental runs)
+reuse the cached bounds without rescanning until the raster file changes.
+
+Usage:
+python -m uhi bounds Bengaluru_LST_2024_CRS_Clean.tif --mode percentile --lower 1 --upper 99
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from .profiling import profiled, count_read
+
+# ========== CONFIG ==========
+DEFAULT_MODE = "percentile"      # "minmax", "percentile" or "zscore"
+PERCENTILES = (1.0, 99.0)        # lower / upper percentile of the "percentile" mode
+ZSCORE_CLIP = 3.0                # "zscore" bounds = mean -/+ ZSCORE_CLIP * std
+HIST_BITS = 20                   # histogram bins = 2**HIST_BITS over the float32 bit pattern
+BLOCK_ROWS = 512                 # rows read per block
+WORKERS = 4                      # blocks scanned in parallel
+SIDECAR_SUFFIX = ".bounds.json"
+QUANTILE_STEP = 0.1              # percent resolution of the cached percentile table
+MODES = ("minmax", "percentile", "zscore")
+
+# float32 values -> uint32 keys with the same ordering (negative values flipped)
+def float_keys(values):
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    return np.where(bits & np.uint32(0x80000000), ~bits, bits | np.uint32(0x80000000))
+
+def keys_to_float(keys):
+    keys = np.asarray(keys, dtype=np.uint32)
+    bits = np.where(keys & np.uint32(0x80000000), keys & np.uint32(0x7FFFFFFF), ~keys)
+    return bits.astype(np.uint32).view(np.float32).astype(float)
+
+class BoundsHistogram:
+    """
+    Mergeable one-pass summary of a raster: fixed-bin histogram, exact min/max,
+    and count / mean / M2 (for the standard deviation, merged with Chan's formula).
+    """
+
+    def __init__(self, bits=HIST_BITS):
+        self.bits = bits
+        self.shift = 32 - bits
+        self.counts = np.zeros(2**bits, dtype=np.int64)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float32).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.counts += np.bincount(float_keys(values) >> self.shift, minlength=self.counts.size)
+        v = values.astype(float)
+        part = BoundsHistogram.__new__(BoundsHistogram)
+        part.n, part.mean = v.size, float(v.mean())
+        part.m2 = float(((v - part.mean) ** 2).sum())
+        part.min, part.max = float(v.min()), float(v.max())
+        self._merge_moments(part)
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        self._merge_moments(other)
+        return self
+
+    def _merge_moments(self, other):
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.n)) if self.n else 0.0
+
+    def quantiles(self, q):
+        """Values at fractions `q` (0-1), interpolated linearly inside a bin."""
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        nz = np.nonzero(self.counts)[0]
+        if nz.size == 0:
+            return np.full(q.shape, np.nan)
+        c = self.counts[nz]
+        cum = np.cumsum(c)
+        target = np.clip(q, 0.0, 1.0) * self.n
+        i = np.minimum(np.searchsorted(cum, target, side="left"), nz.size - 1)
+        prev = cum[i] - c[i]
+        frac = np.clip((target - prev) / c[i], 0.0, 1.0)
+        b = nz[i].astype(np.uint64)
+        lo = keys_to_float((b << self.shift).astype(np.uint32))
+        hi = keys_to_float((((b + 1) << self.shift) - 1).astype(np.uint32))
+        return np.clip(lo + frac * (hi - lo), self.min, self.max)
+
+    def count_below(self, values):
+        """Number of values below each of `values`, interpolated linearly inside a bin."""
+        t = np.atleast_1d(np.asarray(values, dtype=np.float32))
+        b = (float_keys(t) >> self.shift).astype(np.uint64)
+        lo = np.maximum(keys_to_float((b << self.shift).astype(np.uint32)), self.min)
+        hi = np.minimum(keys_to_float((((b + 1) << self.shift) - 1).astype(np.uint32)), self.max)
+        t = t.astype(float)
+        frac = np.where(t > hi, 1.0, np.clip((t - lo) / np.where(hi > lo, hi - lo, 1.0), 0.0, 1.0))
+        b = b.astype(np.intp)
+        return np.cumsum(self.counts)[b] - self.counts[b] * (1.0 - frac)
+
+    def summary(self):
+        grid = np.round(np.arange(0.0, 100.0 + QUANTILE_STEP / 2, QUANTILE_STEP), 6)
+        return {
+            "count": int(self.n),
+            "min": float(self.min) if self.n else None,
+            "max": float(self.max) if self.n else None,
+            "mean": float(self.mean),
+            "std": self.std,
+            "hist_bits": self.bits,
+            "percentile_step": QUANTILE_STEP,
+            "percentiles": self.quantiles(grid / 100.0).tolist(),
+        }
+
+# (lo, hi) scaling bounds from a summary dict
+def bounds_from_summary(summary, mode=DEFAULT_MODE, percentiles=PERCENTILES, zclip=ZSCORE_CLIP):
+    if mode not in MODES:
+        raise ValueError(f"unknown bounds mode {mode!r} (expected one of {MODES})")
+    if not summary["count"]:
+        raise ValueError("raster has no valid pixels")
+    mn, mx = summary["min"], summary["max"]
+    if mode == "minmax":
+        return mn, mx
+    if mode == "percentile":
+        table = np.asarray(summary["percentiles"])
+        grid = np.arange(table.size) * summary["percentile_step"]
+        lo, hi = np.interp(percentiles, grid, table)
+        return float(lo), float(hi)
+    lo = max(mn, summary["mean"] - zclip * summary["std"])
+    hi = min(mx, summary["mean"] + zclip * summary["std"])
+    return float(lo), float(hi)
+
+# Open `path` directly, or warped onto a target grid (dict with crs, transform,
+# width, height and optional resampling / nodata)
+def _open(path, grid=None):
+    src = rasterio.open(path)
+    if grid is None:
+        return src, src
+    vrt = WarpedVRT(src, crs=grid["crs"], transform=grid["transform"],
+                    width=grid["width"], height=grid["height"],
+                    resampling=Resampling[grid.get("resampling", "bilinear")],
+                    nodata=grid.get("nodata"))
+    return src, vrt
+
+def _scan_block(path, band, grid, r0, r1, positive_only, min_value, bits):
+    src, ds = _open(path, grid)
+    try:
+        arr = ds.read(band, window=Window(0, r0, ds.width, r1 - r0), masked=True)
+    finally:
+        if ds is not src:
+            ds.close()
+        src.close()
+    count_read(path, arr.data.nbytes)
+    vals = arr.compressed()
+    if positive_only:
+        vals = vals[vals > 0]
+    if min_value is not None:
+        vals = vals[vals >= min_value]
+    return BoundsHistogram(bits).add(vals)
+
+# One streaming pass over a raster, blocks scanned in parallel
+@profiled("bounds_scan")
+def scan_raster(path, band=1, grid=None, positive_only=False, min_value=None, bits=HIST_BITS,
+                block_rows=BLOCK_ROWS, workers=WORKERS):
+    if grid:
+        height = grid["height"]
+    else:
+        with rasterio.open(path) as src:
+            height = src.height
+    blocks = [(r0, min(r0 + block_rows, height)) for r0 in range(0, height, block_rows)]
+    hist = BoundsHistogram(bits)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for part in pool.map(lambda b: _scan_block(path, band, grid, b[0], b[1], positive_only, min_value, bits), blocks):
+            hist.merge(part)
+    return hist
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+def _source_id(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _entry_key(band, grid, positive_only, min_value):
+    if grid is None:
+        grid_key = None
+    else:
+        grid_key = [str(grid["crs"]), list(grid["transform"])[:6], grid["width"], grid["height"],
+                    grid.get("resampling", "bilinear"), grid.get("nodata")]
+    return json.dumps({"band": band, "grid": grid_key, "positive_only": positive_only,
+                       "min_value": min_value, "bits": HIST_BITS})
+
+# Summary of a raster, from its sidecar when the raster is unchanged
+def raster_summary(path, band=1, grid=None, positive_only=False, min_value=None, refresh=False):
+    meta_path = sidecar_path(path)
+    key = _entry_key(band, grid, positive_only, min_value)
+    source = _source_id(path)
+    cache = {"source": source, "entries": {}}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            stored = json.load(f)
+        if stored.get("source") == source:
+            cache = stored
+    if key in cache["entries"] and not refresh:
+        return cache["entries"][key]
+    summary = scan_raster(path, band, grid, positive_only, min_value).summary()
+    cache["entries"][key] = summary
+    try:
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, meta_path)
+    except OSError as e:
+        print(f"⚠️ Could not write bounds metadata {meta_path}: {e}")
+    return summary
+
+def raster_bounds(path, mode=DEFAULT_MODE, band=1, grid=None, positive_only=False, min_value=None,
+                  percentiles=PERCENTILES, zclip=ZSCORE_CLIP, refresh=False):
+    """(lo, hi) normalisation bounds of a raster (cached in <raster>.bounds.json).
+    positive_only / min_value drop values <= 0 / below min_value (e.g. soft-masked scores)."""
+    summary = raster_summary(path, band, grid, positive_only, min_value, refresh)
+    return bounds_from_summary(summary, mode, percentiles, zclip)
+
+def array_bounds(arr, mode=DEFAULT_MODE, positive_only=False, percentiles=PERCENTILES, zclip=ZSCORE_CLIP):
+    """(lo, hi) bounds of an in-memory array (NaN ignored, nothing cached)."""
+    vals = np.ma.compressed(np.ma.asarray(arr))
+    if positive_only:
+        vals = vals[vals > 0]
+    return bounds_from_summary(BoundsHistogram().add(vals).summary(), mode, percentiles, zclip)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Histogram-based normalisation bounds of a raster")
+    parser.add_argument("rasters", nargs="+")
+    parser.add_argument("--mode", choices=MODES, default=DEFAULT_MODE)
+    parser.add_argument("--lower", type=float, default=PERCENTILES[0], help="lower percentile")
+    parser.add_argument("--upper", type=float, default=PERCENTILES[1], help="upper percentile")
+    parser.add_argument("--zclip", type=float, default=ZSCORE_CLIP)
+    parser.add_argument("--positive-only", action="store_true", help="ignore values <= 0 (population)")
+    parser.add_argument("--refresh", action="store_true", help="rescan even if cached bounds exist")
+    args = parser.parse_args(argv)
+    for path in args.rasters:
+        s = raster_summary(path, positive_only=args.positive_only, refresh=args.refresh)
+        lo, hi = bounds_from_summary(s, args.mode, (args.lower, args.upper), args.zclip)
+        print(f"📊 {path}: {s['count']} pixels, min {s['min']:.4f}, max {s['max']:.4f}, "
+              f"mean {s['mean']:.4f}, std {s['std']:.4f}")
+        print(f"   {args.mode} bounds: {lo:.4f} .. {hi:.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Phase 6 calibration from a persisted histogram
+----------------------------------------------
+calThreshold.py printed p90 / p95 / p99 and the numbers were copied by hand
+into phase6, which then re-read the whole map to classify it. Here the final
+map is scanned once (uhi/bounds.py histogram, blocks in parallel) and the
+non-empty bins are kept next to it in <map>.hist.npz, a few hundred kB.
+Afterwards, without touching the raster:
+
+- thresholds for any scheme: percentile (default 90 / 95 / 99, as
+  calThreshold), quantile (k equal-count classes), equal (equal intervals),
+  jenks (natural breaks: Fisher's exact DP over the histogram bins, so it
+  costs milliseconds whatever the map size) or fixed (the classify.py constants)
+- pixels and area per class from the cumulative bins (values inside a bin
+  are interpolated, like the bounds percentiles)
+- --save writes the thresholds to uhi_thresholds.json, which classify.py
+  (phase6, `uhi classify`) uses instead of its constants
+
+The class raster is only written when asked for (`calibrate classify`). The
+histogram is rebuilt automatically when the map file changes.
+
+Usage:
+    python -m uhi calibrate build [MAP]
+    python -m uhi calibrate thresholds --scheme percentile --percentiles 90 95 99 --save
+    python -m uhi calibrate thresholds --scheme quantile --classes 4
+    python -m uhi calibrate thresholds --scheme jenks --classes 4 --save
+    python -m uhi calibrate classify [--out UHI_Priority_Classes.tif]
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from .bounds import BoundsHistogram, scan_raster, keys_to_float, HIST_BITS
+from .classify import class_labels
+
+# === Configuration ===
+INPUT_MAP = "Final_Map_Clipped.tif"       # phase6 input
+HIST_SUFFIX = ".hist.npz"
+MIN_SCORE = 0.1                  # classify.py masks scores below this (soft-masked buildings, nodata)
+PIXEL_AREA_SQM = 30 * 30         # same 30 m pixel estimate as phase6
+PERCENTILES = (90.0, 95.0, 99.0)  # calThreshold: High / Critical / Extreme
+SCHEMES = ("percentile", "quantile", "equal", "jenks", "fixed")
+JENKS_GROUPS = 1024              # jenks: histogram bins are merged into at most this many groups for the DP
+JENKS_BLOCK = 1 << 22            # jenks: DP cells evaluated per numpy call
+
+def hist_path(map_path):
+    return map_path + HIST_SUFFIX
+
+def _source_id(path):
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+def save_histogram(hist, path, source, min_value):
+    nz = np.flatnonzero(hist.counts)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, bins=nz.astype(np.uint32), counts=hist.counts[nz], bits=hist.bits, n=hist.n,
+                 mean=hist.mean, m2=hist.m2, min=hist.min, max=hist.max, source=source, min_value=min_value)
+    os.replace(tmp, path)
+
+def load_histogram(path):
+    with np.load(path) as z:
+        hist = BoundsHistogram(int(z["bits"]))
+        hist.counts[z["bins"]] = z["counts"]
+        hist.n, hist.mean, hist.m2 = int(z["n"]), float(z["mean"]), float(z["m2"])
+        hist.min, hist.max = float(z["min"]), float(z["max"])
+        return hist, z["source"], float(z["min_value"])
+
+# Histogram of the valid scores of a map: from <map>.hist.npz while the map is
+# unchanged, otherwise one streaming scan that is then persisted
+def map_histogram(map_path=INPUT_MAP, min_score=MIN_SCORE, refresh=False):
+    path = hist_path(map_path)
+    source = _source_id(map_path)
+    if os.path.exists(path) and not refresh:
+        hist, stored, stored_min = load_histogram(path)
+        if np.array_equal(stored, source) and stored_min == min_score and hist.bits == HIST_BITS:
+            return hist
+    print(f"Scanning {map_path}...")
+    hist = scan_raster(map_path, min_value=min_score)
+    save_histogram(hist, path, source, min_score)
+    print(f"✅ Histogram of {hist.n} valid pixels ({np.count_nonzero(hist.counts)} bins) → {path}")
+    return hist
+
+# Fisher's exact optimal partition (natural breaks): the n_classes classes of
+# consecutive histogram bins with the least within-class sum of squares.  Bins
+# are merged into at most `max_groups` groups whose count / sum / sum of squares
+# stay exact, so the DP is O(n_classes * groups²) whatever the number of pixels;
+# each break is then moved to its best bin between its neighbours until none
+# moves.  Breaks are lower bin edges, so class areas from the histogram are exact.
+def jenks_breaks(hist, n_classes=4, max_groups=JENKS_GROUPS):
+    nz = np.flatnonzero(hist.counts)
+    b = nz.astype(np.uint64)
+    lo = np.maximum(keys_to_float((b << hist.shift).astype(np.uint32)), hist.min)
+    hi = np.minimum(keys_to_float((((b + 1) << hist.shift) - 1).astype(np.uint32)), hist.max)
+    c = hist.counts[nz].astype(float)
+    v = (lo + hi) / 2 - hist.mean                  # bin centres, centred for precision
+    Wb, Sb, SSb = (np.concatenate([[0.0], np.cumsum(a)]) for a in (c, c * v, c * v * v))
+    starts = np.unique(np.linspace(0, nz.size, min(nz.size, max_groups) + 1).astype(int)[:-1])
+    W, S, SS = Wb[np.append(starts, nz.size)], Sb[np.append(starts, nz.size)], SSb[np.append(starts, nz.size)]
+    m = starts.size
+    k = min(n_classes, m)
+
+    # cost[j]: least within-class SS of groups 0..j-1 in `level` classes; back[level][j]: start of the last class
+    j_all = np.arange(1, m + 1)
+    cost = SS[1:] - S[1:] ** 2 / W[1:]
+    back = np.zeros((k, m + 1), dtype=np.int64)
+    i = np.arange(m)
+    rows = max(1, JENKS_BLOCK // m)
+    for level in range(1, k):
+        prev = np.concatenate([[np.inf], cost])    # prev[i] = cost of groups 0..i-1 in `level` classes
+        new = np.full(m, np.inf)
+        for j0 in range(level, m, rows):
+            j = j_all[j0:j0 + rows][:, None]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                total = prev[i] + (SS[j] - SS[i]) - (S[j] - S[i]) ** 2 / (W[j] - W[i])
+            total[(i >= j) | (i < level)] = np.inf
+            best = np.argmin(total, axis=1)
+            new[j0:j0 + rows] = total[np.arange(len(best)), best]
+            back[level, j0 + 1:j0 + 1 + len(best)] = best
+        cost = new
+    splits = []
+    j = m
+    for level in range(k - 1, 0, -1):
+        j = back[level, j]
+        splits.append(starts[j])
+
+    # Bin-level refinement: class r spans bins p[r]..p[r+1]-1
+    p = np.array([0] + splits[::-1] + [nz.size])
+    def ssd(a, b):
+        return (SSb[b] - SSb[a]) - (Sb[b] - Sb[a]) ** 2 / (Wb[b] - Wb[a])
+    for _ in range(100):
+        moved = False
+        for r in range(1, k):
+            q = np.arange(p[r - 1] + 1, p[r + 1])
+            best = q[np.argmin(ssd(p[r - 1], q) + ssd(q, p[r + 1]))]
+            moved |= best != p[r]
+            p[r] = best
+        if not moved:
+            break
+    return lo[p[1:-1]]
+
+def scheme_thresholds(hist, scheme="percentile", percentiles=PERCENTILES, n_classes=4):
+    """Class breaks (ascending) of one scheme; n_classes - 1 of them except for percentile / fixed."""
+    if scheme == "percentile":
+        return hist.quantiles(np.asarray(percentiles) / 100.0)
+    if scheme == "quantile":
+        return hist.quantiles(np.arange(1, n_classes) / n_classes)
+    if scheme == "equal":
+        return hist.min + (hist.max - hist.min) * np.arange(1, n_classes) / n_classes
+    if scheme == "jenks":
+        return jenks_breaks(hist, n_classes)
+    if scheme == "fixed":
+        from .classify import DEFAULT_THRESHOLDS
+        return np.array(DEFAULT_THRESHOLDS)
+    raise ValueError(f"unknown scheme {scheme!r} (expected one of {SCHEMES})")
+
+# Thresholds of `scheme` for a map, from its (persisted) histogram
+def map_thresholds(map_path=INPUT_MAP, scheme="jenks", n_classes=4, percentiles=PERCENTILES):
+    thresholds = scheme_thresholds(map_histogram(map_path), scheme, percentiles, n_classes)
+    print(f"📊 {scheme} thresholds: " + ", ".join(f"{t:.2f}" for t in thresholds))
+    return tuple(float(t) for t in thresholds)
+
+def class_areas(hist, thresholds, pixel_area_sqm=PIXEL_AREA_SQM):
+    """Pixels and km² per class 1..len(thresholds)+1 from the cumulative bins."""
+    below = np.concatenate([[0.0], hist.count_below(thresholds), [hist.n]])
+    pixels = np.maximum(np.diff(below), 0.0)
+    labels = class_labels(thresholds)
+    return [{"class": c, "label": labels[c], "pixels": int(round(p)),
+             "area_km2": p * pixel_area_sqm / 1_000_000} for c, p in enumerate(pixels, start=1)]
+
+def print_calibration(thresholds, areas, scheme):
+    print("-" * 30)
+    print(f"📊 {scheme} thresholds: " + ", ".join(f"{t:.2f}" for t in thresholds))
+    for a in areas:
+        name = f" ({a['label']})" if a["label"] != f"Class {a['class']}" else ""
+        print(f"Class {a['class']}{name}: {a['pixels']} pixels | {a['area_km2']:.2f} km²")
+    print("-" * 30)
+
+def save_thresholds(path, thresholds, scheme, map_path, areas):
+    with open(path, "w") as f:
+        json.dump({"scheme": scheme, "map": map_path, "thresholds": [float(t) for t in thresholds],
+                   "classes": areas}, f, indent=2)
+    print(f"✅ Thresholds saved → {path} (used by phase6 / `uhi classify`)")
+
+def main(argv=None):
+    from .classify import THRESHOLDS_FILE, OUTPUT_MAP, classify_map, load_thresholds
+    parser = argparse.ArgumentParser(description="Class thresholds and areas from a persisted map histogram")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="scan the map once and persist its histogram")
+    t = sub.add_parser("thresholds", help="thresholds + area per class from the histogram (no raster read)")
+    t.add_argument("--scheme", choices=SCHEMES, default="percentile")
+    t.add_argument("--percentiles", type=float, nargs="+", default=list(PERCENTILES))
+    t.add_argument("--classes", type=int, default=4, help="classes of the quantile / equal / jenks schemes")
+    t.add_argument("--save", action="store_true", help=f"write {THRESHOLDS_FILE} for phase6")
+    c = sub.add_parser("classify", help="write the class raster with the saved thresholds")
+    c.add_argument("--out", default=OUTPUT_MAP)
+    for p in (b, t, c):
+        p.add_argument("map", nargs="?", default=INPUT_MAP)
+    for p in (b, t):
+        p.add_argument("--min-score", type=float, default=MIN_SCORE)
+    b.add_argument("--refresh", action="store_true", help="rescan even if the histogram is up to date")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        hist = map_histogram(args.map, args.min_score, refresh=args.refresh)
+        print(f"📊 {hist.n} pixels, min {hist.min:.4f}, max {hist.max:.4f}, mean {hist.mean:.4f}, std {hist.std:.4f}")
+    elif args.command == "thresholds":
+        hist = map_histogram(args.map, args.min_score)
+        thresholds = scheme_thresholds(hist, args.scheme, args.percentiles, args.classes)
+        areas = class_areas(hist, thresholds)
+        print_calibration(thresholds, areas, args.scheme)
+        if args.save:
+            save_thresholds(THRESHOLDS_FILE, thresholds, args.scheme, args.map, areas)
+    else:
+        classify_map(args.map, args.out, thresholds=load_thresholds())
+
+if __name__ == "__main__":
+    main()
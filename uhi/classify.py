@@ -0,0 +1,115 @@
+"""
+Phase 6 step: classify the priority map into Safe / High / Critical / Extreme
+and report the area of each class.  phase6.py runs it on the project map.
+Thresholds saved by `uhi calibrate thresholds --save` (uhi_thresholds.json)
+replace the constants below; any number of them gives len(thresholds) + 1
+classes.  The class raster keeps the thresholds it was made with in its
+THRESHOLDS tag, so the tile server and the hotspot index know its classes.
+"""
+
+import json
+import os
+
+import numpy as np
+import rasterio
+
+from .profiling import profiled, count_read, count_write
+
+INPUT_MAP = "Final_Map_Clipped.tif"
+OUTPUT_MAP = "UHI_Priority_Classes.tif"
+
+# Your specific thresholds
+THRESH_HIGH = 5.70
+THRESH_CRIT = 5.83
+THRESH_EXTR = 6.40
+DEFAULT_THRESHOLDS = (THRESH_HIGH, THRESH_CRIT, THRESH_EXTR)
+THRESHOLDS_FILE = "uhi_thresholds.json"    # written by `uhi calibrate thresholds --save`
+PIXEL_AREA_SQM = 30 * 30
+CLASS_LABELS = {0: "No Data", 1: "Safe/Low", 2: "High Priority", 3: "Critical", 4: "EXTREME"}
+
+# Calibrated thresholds if they were saved, else the constants above
+def load_thresholds(path=THRESHOLDS_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        print(f"Using {saved['scheme']} thresholds from {path}")
+        return tuple(saved["thresholds"])
+    return DEFAULT_THRESHOLDS
+
+# Labels of classes 0 .. len(thresholds) + 1: the names above for three
+# thresholds, plain "Class k" for any other scheme
+def class_labels(thresholds):
+    n_classes = len(thresholds) + 1
+    if n_classes == len(CLASS_LABELS) - 1:
+        return dict(CLASS_LABELS)
+    return {0: CLASS_LABELS[0], **{c: f"Class {c}" for c in range(1, n_classes + 1)}}
+
+# Thresholds a class raster was written with, else the current ones
+def raster_thresholds(src):
+    tag = src.tags().get("THRESHOLDS")
+    return tuple(json.loads(tag)) if tag else load_thresholds()
+
+# The class rule, shared by phase6, the update report and the dask backend:
+# 0 = no data / soft-masked, 1 = Safe, then one class per threshold reached
+def classify_array(data, thresholds):
+    classified = np.zeros(data.shape, dtype=np.uint8)
+
+    # Apply logic (Order matters! Apply lower tiers first)
+    classified[data > 0.001] = 1          # Everything valid is at least Safe
+    for c, thr in enumerate(thresholds, start=2):
+        classified[data >= thr] = c       # Overwrite High / Critical / Extreme
+
+    # Mask out the "Soft Mask" areas (buildings 0.0001) if they fell into Safe
+    classified[data < 0.1] = 0
+    return classified
+
+def print_class_areas(counts, labels, pixel_area_sqm=PIXEL_AREA_SQM):
+    for val, count in enumerate(counts):
+        if val == 0 or count == 0: continue
+        area_sqkm = count * pixel_area_sqm / 1_000_000  # Convert to sq km
+        name = f" ({labels[val]})" if labels.get(val, f"Class {val}") != f"Class {val}" else ""
+        print(f"Class {val}{name}: {count} pixels | {area_sqkm:.2f} km²")
+
+@profiled("classify")
+def classify_map(input_map=INPUT_MAP, output_map=OUTPUT_MAP, thresholds=None):
+    if thresholds is None:
+        thresholds = load_thresholds()
+    print(f"Reading {input_map}...")
+    with rasterio.open(input_map) as src:
+        data = src.read(1)
+        profile = src.profile.copy()
+        count_read(input_map, data.nbytes)
+
+        # Pixel resolution (approx 30m x 30m = 900 sq meters)
+        # We check the transform to be precise
+        res_x = src.res[0]
+        res_y = src.res[1]
+        # Note: If CRS is degrees (EPSG:4326), area calc is tricky. 
+        # We assume approx 30m for Landsat, or 0.00027 degrees.
+        # For accurate sq km, we usually need a projected CRS (UTM).
+        # Here we will estimate using 30m x 30m = 900 sqm per pixel.
+        pixel_area_sqm = PIXEL_AREA_SQM
+
+        # Create Classification Array
+        # 0 = No Data / Masked
+        # 1 = Safe (< 5.77)
+        # 2 = High (5.77 - 5.90)
+        # 3 = Critical (5.90 - 6.76)
+        # 4 = Extreme (> 6.76)
+
+        classified = classify_array(data, thresholds)
+
+        # Calculate Areas
+        print("\n--- 📊 AREA STATISTICS (Estimated) ---")
+        counts = np.bincount(classified.ravel(), minlength=len(thresholds) + 2)
+        print_class_areas(counts, class_labels(thresholds), pixel_area_sqm)
+
+        # Save the classified map
+        profile.update(dtype=rasterio.uint8, nodata=0)
+        with rasterio.open(output_map, 'w', **profile) as dst:
+            dst.write(classified, 1)
+            dst.update_tags(THRESHOLDS=json.dumps([float(t) for t in thresholds]))
+        count_write(output_map, classified.nbytes)
+
+    print(f"\n✅ Saved classified map to {output_map}")
+    return classified
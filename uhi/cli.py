@@ -0,0 +1,206 @@
+"""
+Command line interface
+----------------------
+    python -m uhi run [sensitivity|batch FILE|update]   # Phase 4 ensemble (uhi/ensemble.py)
+    python -m uhi preprocess LST NDVI LULC              # Phase 2
+    python -m uhi normalize --lst .. --ndvi .. --lulc .. [--pop .. --pop-resampling dasymetric] [--soft-mask]
+    python -m uhi clip MAP AOI OUT                      # Phase 5
+    python -m uhi classify [MAP] [--out UHI_Priority_Classes.tif] [--scheme jenks --classes 4]
+    python -m uhi stats [MAP] [--info] [--json]         # phase 6 thresholds / raster info
+    python -m uhi query --lat 12.9719 --lon 77.5772 [--radius 500] [--json]
+    python -m uhi locations locations.txt [--out UHI_Analysis_Results.csv]
+    python -m uhi dask [--scheduler processes] [--aoi AOI]   # Phase 3-6 on dask
+    python -m uhi spatial [MAP] [--radius 3]            # Gi* / local Moran z-score rasters
+    python -m uhi calibrate build|thresholds|classify   # phase 6 thresholds from a stored histogram
+    python -m uhi hotspots|bounds|tiles|service ...     # the module's own CLI
+
+(`uhi ...` once the package is installed with `pip install -e .`.)
+
+Only the standard library is imported here; every command imports what it
+needs when it runs, so query / stats / classify start without paying for
+pandas, scipy or geopandas.  --profile[=PREFIX] works on every command.
+"""
+
+import argparse
+import importlib
+import json
+import sys
+
+DEFAULT_MAP = "Final_Map_Clipped.tif"
+
+# Commands handed straight to an existing module CLI: name -> (module, function, help)
+PASSTHROUGH = {
+    "run": ("ensemble", "cli", "Phase 4: hybrid AHP + entropy weights and the Monte Carlo ensemble"),
+    "dask": ("dask_backend", "main", "Phase 3-6 as one dask graph (chunked, out-of-core, multi-core)"),
+    "hotspots": ("hotspots", "main", "hotspot cluster index: build / nearest / within / clusters"),
+    "calibrate": ("calibrate", "main", "phase 6 thresholds and class areas from a persisted map histogram"),
+    "spatial": ("spatial_stats", "main", "Getis-Ord Gi* / local Moran's I z-score and p-value rasters"),
+    "bounds": ("bounds", "main", "normalization bounds of rasters (histogram service)"),
+    "tiles": ("tiles", "main", "XYZ PNG tile server for the output maps"),
+    "service": ("service", "main", "asyncio point-query service: serve / client"),
+}
+
+def cmd_preprocess(args):
+    from .preprocess import assign_crs, resample_raster, clean_nodata, check_stats
+    lst_crs, ndvi_crs = args.lst.replace(".tif", "_CRS.tif"), args.ndvi.replace(".tif", "_CRS.tif")
+    lulc_res = args.lulc.replace(".tif", "_Resampled.tif")
+    assign_crs(args.lst, lst_crs, args.crs)
+    assign_crs(args.ndvi, ndvi_crs, args.crs)
+    resample_raster(args.lulc, lst_crs, lulc_res)
+    cleaned = []
+    for f in (lst_crs, ndvi_crs, lulc_res):
+        cleaned.append(f.replace(".tif", "_Clean.tif"))
+        clean_nodata(f, cleaned[-1])
+    check_stats(cleaned)
+    print("\n🎯 All files aligned and cleaned successfully.")
+
+def cmd_normalize(args):
+    from .normalize import normalize_raster, create_constraint_mask, normalize_population, soften_mask
+    normalize_raster(args.lst, "LST_norm.tif", mode=args.mode)
+    print("✅ LST normalized → LST_norm.tif")
+    normalize_raster(args.ndvi, "NDVI_norm.tif", inverse=True, mode=args.mode)
+    print("✅ NDVI normalized (inverse) → NDVI_norm.tif")
+    if args.pop:
+        normalize_population(args.pop, "LST_norm.tif", "Population_norm.tif", mode=args.mode,
+                             resampling=args.pop_resampling, lulc_path=args.lulc, counts_path=args.pop_counts)
+        print("✅ Population normalized → Population_norm.tif")
+    create_constraint_mask(args.lulc, "Constraint_Mask.tif")
+    if args.soft_mask:
+        soften_mask("Constraint_Mask.tif")
+    print(f"✅ Constraint mask created → Constraint_Mask.tif{' (soft)' if args.soft_mask else ''}")
+
+def cmd_clip(args):
+    from .clip import load_aoi, clip_raster
+    clip_raster(args.map, load_aoi(args.aoi), args.out)
+    print(f"✅ Clipped map saved to {args.out}")
+
+def cmd_classify(args):
+    from . import classify
+    thresholds = None
+    if args.scheme:
+        from .calibrate import map_thresholds
+        thresholds = map_thresholds(args.map, args.scheme, args.classes)
+    classify.classify_map(args.map, args.out, thresholds=thresholds)
+
+def cmd_stats(args):
+    from . import stats
+    if args.json:
+        result = stats.raster_info(args.map) if args.info else stats.threshold_stats(args.map)
+        print(json.dumps(result, indent=2, default=lambda v: v.item() if hasattr(v, "item") else str(v)))
+    elif args.info:
+        stats.print_info(args.map)
+    else:
+        stats.print_thresholds(args.map)
+
+def cmd_query(args):
+    import rasterio
+    from .query import location_window, check_data
+    with rasterio.open(args.map) as src:
+        window = location_window(src, args.lat, args.lon, args.radius)
+        data = src.read(1, window=window) if window is not None else None
+    result = check_data(args.lat, args.lon, args.radius, data, args.threshold)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"--- {args.lat}, {args.lon} (Radius: {args.radius}m) ---")
+    if result["Status"] != "Success":
+        print(f"⚠️ {result['Status']}")
+        return
+    print(f"   Max Score Found: {result['Max_Score']:.2f}")
+    print(f"   Avg Score in Radius: {result['Avg_Score']:.2f}")
+    print(f"   Pixels above {args.threshold}: {result['High_Priority_Pixels']} of {result['Valid_Pixels']}")
+
+def cmd_locations(args):
+    from .query import analyze_file
+    print(f"📂 Reading locations from {args.file}...")
+    n_done, _ = analyze_file(args.map, args.file, args.out, fmt=args.format, preview_rows=0)
+    if n_done == 0:
+        print("❌ No valid locations found to process.")
+        return
+    print(f"✅ {n_done} locations → {args.out}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="uhi", description="Bengaluru UHI mitigation pipeline",
+                                     epilog="--profile[=PREFIX] on any command writes a time / memory / I/O report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, (_, _, help_text) in PASSTHROUGH.items():
+        sub.add_parser(name, help=help_text, add_help=False)
+
+    p = sub.add_parser("preprocess", help="Phase 2: assign CRS, resample LULC to the LST grid, clean no-data")
+    p.add_argument("lst")
+    p.add_argument("ndvi")
+    p.add_argument("lulc")
+    p.add_argument("--crs", default="EPSG:4326")
+    p.set_defaults(func=cmd_preprocess)
+
+    p = sub.add_parser("normalize", help="Phase 3: 1-10 normalization and the LULC constraint mask")
+    p.add_argument("--lst", required=True)
+    p.add_argument("--ndvi", required=True)
+    p.add_argument("--lulc", required=True)
+    p.add_argument("--pop", default=None, help="population raster (resampled onto the LST grid)")
+    p.add_argument("--pop-resampling", choices=["bilinear", "conserve", "dasymetric"], default="bilinear",
+                   help="conserve / dasymetric keep the population total (dasymetric spreads it by --lulc class)")
+    p.add_argument("--pop-counts", default=None, help="also save the resampled people per pixel here")
+    p.add_argument("--mode", choices=["minmax", "percentile", "zscore"], default="percentile")
+    p.add_argument("--soft-mask", action="store_true", help="unsuitable land -> 0.0001 instead of 0 (phase 3b)")
+    p.set_defaults(func=cmd_normalize)
+
+    p = sub.add_parser("clip", help="Phase 5: clip a map to the AOI")
+    p.add_argument("map")
+    p.add_argument("aoi", help=".geojson (read directly) or any vector file geopandas can open")
+    p.add_argument("out")
+    p.set_defaults(func=cmd_clip)
+
+    p = sub.add_parser("classify", help="Phase 6: priority classes and their areas")
+    p.add_argument("map", nargs="?", default=DEFAULT_MAP)
+    p.add_argument("--out", default="UHI_Priority_Classes.tif")
+    p.add_argument("--scheme", choices=["percentile", "quantile", "equal", "jenks", "fixed"], default=None,
+                   help="thresholds from the map histogram (uhi calibrate) instead of the saved / fixed ones")
+    p.add_argument("--classes", type=int, default=4, help="classes of the quantile / equal / jenks schemes")
+    p.set_defaults(func=cmd_classify)
+
+    p = sub.add_parser("stats", help="percentile thresholds (or --info: raster information) of a map")
+    p.add_argument("map", nargs="?", default=DEFAULT_MAP)
+    p.add_argument("--info", action="store_true")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("query", help="score statistics within a radius of one point")
+    p.add_argument("--lat", type=float, required=True)
+    p.add_argument("--lon", type=float, required=True)
+    p.add_argument("--radius", type=float, default=500.0, help="metres")
+    p.add_argument("--threshold", type=float, default=6.0, help="count pixels above this score")
+    p.add_argument("--map", default=DEFAULT_MAP)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("locations", help="batch query of a locations file into a CSV")
+    p.add_argument("file", help=".txt chat log / .jsonl / .csv / .geojson / .parquet")
+    p.add_argument("--map", default=DEFAULT_MAP)
+    p.add_argument("--out", default="UHI_Analysis_Results.csv")
+    p.add_argument("--format", default=None, help="override the format detected from the extension")
+    p.set_defaults(func=cmd_locations)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in PASSTHROUGH:
+        module, func, _ = PASSTHROUGH[argv[0]]
+        rest = argv[1:]
+        if argv[0] != "run":          # the ensemble CLI handles --profile itself
+            from .profiling import profile_from_argv
+            rest = ["uhi"] + rest
+            profile_from_argv(f"uhi_{argv[0]}", rest)
+            rest = rest[1:]
+        sys.argv = [f"uhi {argv[0]}"] + rest
+        return getattr(importlib.import_module(f".{module}", __package__), func)(rest)
+
+    argv = ["uhi"] + argv
+    if any(a.startswith("--profile") for a in argv):
+        from .profiling import profile_from_argv
+        profile_from_argv(f"uhi_{argv[1]}" if len(argv) > 1 else "uhi", argv)
+    args = build_parser().parse_args(argv[1:])
+    return args.func(args)
+
+if __name__ == "__main__":
+    main()
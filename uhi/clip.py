@@ -0,0 +1,44 @@
+"""
+Phase 5 step: clip a map to the Bengaluru AOI.  Phase5.py runs it on the
+project files.  GeoJSON AOIs are read directly; other vector formats
+(shapefile, GeoPackage) go through geopandas, imported only when needed.
+"""
+
+import json
+
+import rasterio
+from rasterio.mask import mask
+
+from .profiling import profiled, count_read, count_write
+
+# 1. Load the Shapefile ("The Cookie Cutter")
+def load_aoi(path):
+    """AOI geometries: GeoJSON-like dicts for .geojson / .json, a GeoSeries otherwise."""
+    if path.lower().endswith((".geojson", ".json")):
+        with open(path) as f:
+            gj = json.load(f)
+        if gj.get("type") == "FeatureCollection":
+            return [feat["geometry"] for feat in gj["features"] if feat.get("geometry")]
+        return [gj["geometry"] if gj.get("type") == "Feature" else gj]
+    import geopandas as gpd
+    return gpd.read_file(path).geometry
+
+# 2. Open the Map & Clip It (geometries: GeoSeries or GeoJSON-like dicts)
+@profiled("clip")
+def clip_raster(src_path, geometries, out_path):
+    with rasterio.open(src_path) as src:
+        # This one line does the actual clipping!
+        out_image, out_transform = mask(src, geometries, crop=True)
+        out_meta = src.meta.copy()
+    count_read(src_path, out_image.nbytes)
+
+    # 3. Save the Result
+    out_meta.update({
+        "height": out_image.shape[1],
+        "width": out_image.shape[2],
+        "transform": out_transform
+    })
+
+    with rasterio.open(out_path, "w", **out_meta) as dest:
+        dest.write(out_image)
+    count_write(out_path, out_image.nbytes)
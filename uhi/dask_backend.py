@@ -0,0 +1,422 @@
+"""
+Dask / xarray execution backend
+-------------------------------
+The Phase3 -> phase6 chain as one lazy chunked array graph, for grids that do
+not fit the hand-rolled tiling on one machine (all of Karnataka instead of
+Bengaluru Urban):
+
+  criteria   every registered criterion (ensemble.CRITERIA_REGISTRY) read chunk
+             by chunk through a WarpedVRT onto the template grid, exactly as
+             CriteriaStack does (rioxarray's reproject_match is eager, so the
+             reads stay in rasterio)
+  Phase3     normalize=True criteria scaled to 1-10 with bounds from a merged
+             histogram reduction (bounds.BoundsHistogram, same modes)
+  Phase4     entropy column sums as a reduction -> weight draws -> per-chunk
+             ensemble (ensemble.run_ensemble on the chunk): baseline, mean, std,
+             quantile and exceedance maps
+  Phase5     baseline map cropped to the AOI window and masked outside it
+  phase6     priority classes and the pixel count per class (a reduction)
+
+One dask.compute() runs everything: the global reductions and the per-pixel
+maps share a single optimised execution, and the GeoTIFF writes are part of the
+graph (da.store).  Passes that need a global result first (bounds, entropy)
+read their chunks separately, so no chunk has to wait in memory for a
+reduction to finish; memory stays bounded by the chunks in flight.
+
+Schedulers: "threads" (default, rasterio and the numpy / numba kernels release
+the GIL), "processes" or "sync" (debugging).  The maps match the tiled
+`python -m uhi run` engine for the same inputs and settings.
+
+Usage:
+    python -m uhi dask --scheduler threads --workers 8 --chunk 2048
+    python -m uhi dask --aoi Bengaluru_AOI.geojson     # + Final_Map_Clipped.tif
+
+Requirements: pip install "dask[array]"   (optional: xarray + rioxarray, for
+as_dataset() with coordinates and CRS)
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rasterio.mask import geometry_window
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+from . import ensemble as E
+from .bounds import BoundsHistogram, bounds_from_summary
+from .classify import load_thresholds, class_labels, classify_array, print_class_areas
+from .profiling import stage, count_read, count_write, profile_from_argv
+
+try:
+    import dask
+    import dask.array as da
+    HAVE_DASK = True
+except ImportError:
+    HAVE_DASK = False
+
+# ========== CONFIG ==========
+CHUNK = 1024                # chunk rows and columns (multiple of GTIFF_BLOCK)
+GTIFF_BLOCK = 256           # outputs are tiled GeoTIFFs with this block size, aligned to the chunks
+SCHEDULER = "threads"       # "threads", "processes" or "sync"
+WORKERS = None              # None = one per core
+AOI_PATH = None             # Phase5 AOI; None = no clipping (classes from the full baseline map)
+CLIPPED_MAP = "Final_Map_Clipped.tif"
+CLASSES_MAP = "UHI_Priority_Classes.tif"
+HIST_FAN_IN = 8             # histogram partials merged per reduction step
+
+class RasterChunkReader:
+    """
+    Array-like view of a raster warped onto the template grid, for
+    da.from_array().  Every read opens its own handle, so chunks can be read
+    from any thread or process.  masked=True returns NaN for nodata pixels.
+    """
+    ndim = 2
+    dtype = np.dtype("float32")
+
+    def __init__(self, path, grid, resampling="bilinear", masked=False):
+        self.path = path
+        self.grid = grid
+        self.resampling = resampling
+        self.masked = masked
+        self.shape = (grid["height"], grid["width"])
+
+    def __getitem__(self, key):
+        r0, r1, _ = key[0].indices(self.shape[0])
+        c0, c1, _ = key[1].indices(self.shape[1])
+        if r1 <= r0 or c1 <= c0:
+            return np.empty((max(r1 - r0, 0), max(c1 - c0, 0)), dtype="float32")
+        g = self.grid
+        with rasterio.open(self.path) as src, \
+                WarpedVRT(src, crs=g["crs"], transform=g["transform"], width=g["width"], height=g["height"],
+                          resampling=Resampling[self.resampling], nodata=0) as vrt:
+            arr = vrt.read(1, window=Window(c0, r0, c1 - c0, r1 - r0), out_dtype="float32", masked=self.masked)
+        count_read(self.path, np.ma.getdata(arr).nbytes)
+        return arr.filled(np.nan) if self.masked else arr
+
+class WindowWriter:
+    """da.store() target: writes every chunk into an existing GeoTIFF (opened per write)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __setitem__(self, key, value):
+        rows, cols = key[-2], key[-1]
+        r0, c0 = rows.start or 0, cols.start or 0
+        with rasterio.open(self.path, "r+") as dst:
+            arr = np.asarray(value).astype(dst.dtypes[0])
+            window = Window(c0, r0, arr.shape[-1], arr.shape[-2])
+            if arr.ndim == 2:
+                dst.write(arr, 1, window=window)
+            else:
+                dst.write(arr, window=window)
+        count_write(self.path, arr.nbytes)
+
+# Chunk adaptor for ensemble.run_ensemble: criteria are addressed by index
+class _BlockStack:
+    def __init__(self, block, mask):
+        self.block = block
+        self.mask = mask
+        self.names = list(range(block.shape[0]))
+        self.height, self.width = block.shape[1:]
+
+    def read_tile(self, r0, r1, names=None):
+        names = self.names if names is None else names
+        return self.block[names, r0:r1]
+
+    def read_mask_tile(self, r0, r1):
+        return None if self.mask is None else self.mask[r0:r1]
+
+# ---------- Block functions (module level, so the process scheduler can pickle them) ----------
+def _block_histogram(block):
+    return BoundsHistogram().add(block)
+
+def _merge_histograms(*parts):
+    hist = parts[0]
+    for part in parts[1:]:
+        hist.merge(part)
+    return hist
+
+def _bounds(hist, mode):
+    return bounds_from_summary(hist.summary(), mode)
+
+def _normalize_block(block, bounds, inverse):
+    lo, hi = bounds
+    return E.normalize_with_bounds(np.nan_to_num(block, nan=lo), lo, hi, inverse=inverse)
+
+def _add_sums(*parts):
+    S = sum(p[0] for p in parts)
+    T = sum(p[1] for p in parts)
+    return S, T, sum(p[2] for p in parts)
+
+def _entropy_weights(sums):
+    return E.entropy_weights_from_sums(*sums)
+
+def _combined_weights(w_ahp, ent_w, alpha):
+    combined = alpha * w_ahp + (1.0 - alpha) * ent_w
+    return combined / combined.sum()
+
+def _ensemble_block(draws, sample_weights, baseline, block, mask, thresholds):
+    products = {}
+    E.run_ensemble(_BlockStack(block, mask), draws, lambda r0, r1, p: products.update(p),
+                   tile_rows=block.shape[1], thresholds=thresholds, baseline_weights=baseline, verbose=False,
+                   sample_weights=sample_weights)
+    bands = [products["baseline"][None], products["mean"][None], products["std"][None]]
+    if "quantiles" in products:
+        bands.append(products["quantiles"])
+    bands.append(products["exceedance"])
+    return np.concatenate(bands).astype("float32")
+
+def _clip_block(block, geometries, transform, nodata, block_info=None):
+    (r0, _), (c0, _) = block_info[0]["array-location"]
+    outside = geometry_mask(geometries, out_shape=block.shape, transform=transform * Affine.translation(c0, r0))
+    return np.where(outside, np.float32(nodata), block)
+
+def _class_counts(block, n_classes):
+    return np.bincount(block.ravel(), minlength=n_classes)
+
+def _add_counts(*parts):
+    return sum(parts)
+
+def _tree_reduce(parts, func, fan_in=HIST_FAN_IN):
+    """Delayed tree reduction, so at most `fan_in` partials wait in memory per step."""
+    parts = list(parts)
+    while len(parts) > 1:
+        parts = [dask.delayed(func)(*parts[i:i + fan_in]) for i in range(0, len(parts), fan_in)]
+    return parts[0]
+
+def _delayed_blocks(arr):
+    # optimize_graph=False keeps the chunk keys shared with the rest of the graph
+    return arr.to_delayed(optimize_graph=False).ravel().tolist()
+
+# ---------- Graph ----------
+def build_graph(chunk=CHUNK, aoi_geometries=None, lock=None, criteria=None, registry=None,
+                template_path=None, mask_path=None, output_dir=None):
+    """
+    Lazy graph of one full run.  Returns a dict with the dask arrays
+    ("products", "clipped", "classes"), the delayed reductions ("bounds",
+    "entropy_weights", "combined", "draws", "class_counts"), the delayed
+    GeoTIFF writes ("stores") and the output paths.  Output files are created
+    here (empty); nothing is read until run_graph().
+    """
+    if not HAVE_DASK:
+        raise ImportError('the dask backend needs dask: pip install "dask[array]"')
+    if chunk % GTIFF_BLOCK:
+        raise ValueError(f"chunk must be a multiple of {GTIFF_BLOCK}")
+    criteria = E.CRITERIA if criteria is None else list(criteria)
+    registry = E.CRITERIA_REGISTRY if registry is None else registry
+    template_path = E.TEMPLATE_PATH if template_path is None else template_path
+    mask_path = E.MASK_PATH if mask_path is None else mask_path
+    output_dir = E.OUTPUT_DIR if output_dir is None else output_dir
+    with rasterio.open(template_path) as t:
+        meta = t.meta.copy()
+        grid = {"crs": t.crs, "transform": t.transform, "width": t.width, "height": t.height}
+        crop = geometry_window(t, aoi_geometries) if aoi_geometries is not None else None
+    meta.update(tiled=True, blockxsize=GTIFF_BLOCK, blockysize=GTIFF_BLOCK)
+    has_mask = bool(mask_path) and os.path.exists(mask_path)
+
+    def read(path, resampling, pass_name, masked=False):
+        reader = RasterChunkReader(path, grid, resampling, masked)
+        name = f"read-{pass_name}-" + dask.base.tokenize(path, resampling, masked, chunk, str(grid["crs"]),
+                                                         tuple(grid["transform"]), reader.shape)
+        return da.from_array(reader, chunks=(chunk, chunk), name=name, lock=False, asarray=False,
+                             meta=np.empty((0, 0), dtype="float32"))
+
+    # Phase3: histogram bounds of the criteria that are normalised here
+    bounds = {}
+    for name in criteria:
+        spec = registry[name]
+        if spec["normalize"]:
+            raw = read(spec["path"], spec["resampling"], "bounds", masked=True)
+            parts = [dask.delayed(_block_histogram)(b) for b in _delayed_blocks(raw)]
+            bounds[name] = dask.delayed(_bounds)(_tree_reduce(parts, _merge_histograms), spec["bounds"])
+
+    def criteria_stack(pass_name):
+        layers = []
+        for name in criteria:
+            spec = registry[name]
+            arr = read(spec["path"], spec["resampling"], pass_name)
+            if spec["normalize"]:
+                arr = da.map_blocks(_normalize_block, arr, bounds[name], spec["inverse"], dtype="float32")
+            layers.append(arr)
+        stack = da.stack(layers).rechunk({0: -1})
+        mask = read(mask_path, "nearest", pass_name) if has_mask else None
+        return stack, mask
+
+    # Phase4: entropy sums -> weights -> draws
+    stack, mask = criteria_stack("entropy")
+    stack_blocks = _delayed_blocks(stack)
+    mask_blocks = _delayed_blocks(mask) if mask is not None else [None] * len(stack_blocks)
+    sums = _tree_reduce([dask.delayed(E.entropy_sums_from_tile)(s, m) for s, m in zip(stack_blocks, mask_blocks)],
+                        _add_sums)
+    ent_w = dask.delayed(_entropy_weights)(sums)
+    base_M = E.build_pairwise_matrix(criteria, E.PAIRWISE)
+    w_ahp, lambda_max = E.ahp_weights_from_matrix(base_M)
+    combined = dask.delayed(_combined_weights)(w_ahp, ent_w, E.ALPHA)
+    draws = dask.delayed(E.draw_weight_ensemble, nout=3)(
+        base_M, ent_w, E.MC_SAMPLES, sigma=E.PERTURB_SIGMA, alpha=E.ALPHA, sampler=E.SAMPLER,
+        seed=E.SEED, tol=E.MC_TOL, min_samples=E.MC_MIN_SAMPLES, return_lambda=True,
+        cr_filter=E.MC_CR_FILTER, cr_max=E.MC_CR_MAX)
+    sample_weights = dask.delayed(E.draw_sample_weights)(draws[1], draws[2], len(criteria))
+
+    # Phase4: per-chunk ensemble, products stacked as bands; the exceedance maps
+    # use the phase6 thresholds the classes below are made with
+    thresholds = load_thresholds()
+    exceedance = E.exceedance_thresholds(thresholds)
+    stack, mask = criteria_stack("overlay")
+    n_q, n_t = len(E.QUANTILES), len(exceedance)
+    n_bands = 3 + n_q + n_t
+    products = da.map_blocks(_ensemble_block, draws[0], sample_weights, combined, stack, mask, exceedance,
+                             chunks=((n_bands,),) + stack.chunks[1:], dtype="float32")
+    baseline = products[0]
+
+    # Phase5: crop to the AOI window, nodata outside the polygons
+    if crop is not None:
+        (r0, r1), (c0, c1) = crop.toranges()
+        clip_transform = rasterio.windows.transform(crop, grid["transform"])
+        nodata = meta["nodata"] if meta.get("nodata") is not None else 0
+        clipped = baseline[r0:r1, c0:c1].rechunk((chunk, chunk))
+        clipped = da.map_blocks(_clip_block, clipped, aoi_geometries, clip_transform, nodata, dtype="float32")
+        clip_meta = dict(meta, height=r1 - r0, width=c1 - c0, transform=clip_transform)
+    else:
+        clipped, clip_meta = baseline, meta
+
+    # phase6: classes + pixel count per class
+    classes = da.map_blocks(classify_array, clipped, thresholds, dtype="uint8")
+    class_counts = _tree_reduce([dask.delayed(_class_counts)(b, len(thresholds) + 2)
+                                 for b in _delayed_blocks(classes)], _add_counts)
+
+    # Outputs: created empty now, filled chunk by chunk by the graph
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {key: os.path.join(output_dir, os.path.basename(path)) for key, path in E.product_paths(exceedance).items()}
+    for dst in E.open_product_writers(paths, meta, thresholds=exceedance).values():
+        dst.close()
+    sources = [baseline, products[1], products[2]]
+    targets = [paths["baseline"], paths["mean"], paths["std"]]
+    if "quantiles" in paths:
+        sources.append(products[3:3 + n_q])
+        targets.append(paths["quantiles"])
+    if "exceedance" in paths:
+        sources.append(products[3 + n_q:])
+        targets.append(paths["exceedance"])
+    if crop is not None:
+        paths["clipped"] = os.path.join(output_dir, CLIPPED_MAP)
+        E.open_raster_writer(paths["clipped"], clip_meta).close()
+        sources.append(clipped)
+        targets.append(paths["clipped"])
+    paths["classes"] = os.path.join(output_dir, CLASSES_MAP)
+    with rasterio.open(paths["classes"], "w", **dict(clip_meta, dtype="uint8", nodata=0, count=1,
+                                                     compress="lzw")) as dst:
+        dst.update_tags(THRESHOLDS=json.dumps([float(t) for t in thresholds]))
+    sources.append(classes)
+    targets.append(paths["classes"])
+    stores = da.store(sources, [WindowWriter(p) for p in targets], lock=lock if lock is not None else False,
+                      compute=False)
+
+    return {
+        "criteria": criteria, "meta": meta, "grid": grid, "clip_meta": clip_meta, "paths": paths,
+        "products": products, "clipped": clipped, "classes": classes, "stores": stores,
+        "ahp": (w_ahp, lambda_max, base_M), "bounds": bounds, "entropy_weights": ent_w,
+        "combined": combined, "draws": draws, "class_counts": class_counts, "thresholds": thresholds,
+        "product_bands": ["baseline", "mean", "std"] + [f"P{q*100:g}" for q in E.QUANTILES]
+                         + [f"P(score >= {t:g})" for t in exceedance],
+    }
+
+def as_dataset(graph):
+    """The lazy per-pixel maps of build_graph() as an xarray.Dataset (CRS attached if rioxarray is installed)."""
+    import xarray as xr
+    t = graph["grid"]["transform"]
+    h, w = graph["grid"]["height"], graph["grid"]["width"]
+    coords = {"y": t.f + t.e * (np.arange(h) + 0.5), "x": t.c + t.a * (np.arange(w) + 0.5)}
+    ds = xr.Dataset({band: (("y", "x"), graph["products"][i]) for i, band in enumerate(graph["product_bands"])},
+                    coords=coords)
+    try:
+        import rioxarray  # noqa: F401  (registers the .rio accessor)
+        ds = ds.rio.write_crs(graph["grid"]["crs"]).rio.write_transform(t)
+    except ImportError:
+        pass
+    return ds
+
+_MANAGER = None
+
+def make_lock(scheduler):
+    """Lock serialising the GeoTIFF writes across the workers of `scheduler`."""
+    global _MANAGER
+    if scheduler == "processes":
+        if _MANAGER is None:
+            _MANAGER = mp.Manager()     # kept alive for the lifetime of the lock
+        return _MANAGER.Lock()
+    return threading.Lock()
+
+def run_graph(graph, scheduler=SCHEDULER, workers=WORKERS):
+    """Write every output and return the reductions (bounds, weights, draws, class counts)."""
+    use_numba = E.USE_NUMBA
+    if scheduler == "threads" and E.HAVE_NUMBA and E.USE_NUMBA:
+        # numba's default (workqueue) threading layer must not be entered from several
+        # threads at once; the chunks already keep every core busy, so they use the NumPy kernel
+        E.USE_NUMBA = False
+    elif scheduler == "processes":
+        os.environ.setdefault("NUMBA_NUM_THREADS", "1")     # one kernel thread per worker process
+    try:
+        with stage("dask_compute"):
+            _, ent_w, combined, (draws, mc_info, draw_lambdas), counts, bounds = dask.compute(
+                graph["stores"], graph["entropy_weights"], graph["combined"], graph["draws"],
+                graph["class_counts"], graph["bounds"], scheduler=scheduler, num_workers=workers)
+    finally:
+        E.USE_NUMBA = use_numba     # only this computation runs without the Numba kernel
+    return {"entropy_weights": ent_w, "combined": combined, "draws": draws, "mc_info": mc_info,
+            "draw_lambdas": draw_lambdas, "class_counts": counts, "bounds": bounds}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phase3-phase6 as one dask graph (out-of-core, multi-core)")
+    parser.add_argument("--scheduler", choices=["threads", "processes", "sync"], default=SCHEDULER)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads / processes (default: one per core)")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help=f"chunk size in pixels (multiple of {GTIFF_BLOCK})")
+    parser.add_argument("--aoi", default=AOI_PATH, help="Phase5 AOI (.geojson, or any vector file geopandas reads)")
+    parser.add_argument("--out-dir", default=None, help="output directory (default: ensemble OUTPUT_DIR)")
+    args = parser.parse_args(argv)
+    if args.out_dir:
+        E.OUTPUT_DIR = args.out_dir
+
+    print("Phase3-6 dask graph started:", datetime.now())
+    aoi = None
+    if args.aoi:
+        from .clip import load_aoi
+        aoi = load_aoi(args.aoi)
+        aoi = [g.__geo_interface__ if hasattr(g, "__geo_interface__") else g for g in aoi]
+    graph = build_graph(chunk=args.chunk, aoi_geometries=aoi, lock=make_lock(args.scheduler))
+    n_chunks = int(np.prod(graph["products"].numblocks))
+    print(f"🧮 {graph['grid']['height']}x{graph['grid']['width']} grid, {n_chunks} chunks of {args.chunk}², "
+          f"{args.scheduler} scheduler")
+    result = run_graph(graph, args.scheduler, args.workers)
+
+    criteria = graph["criteria"]
+    w_ahp, lambda_max, base_M = graph["ahp"]
+    CI, CR = E.consistency_ratio(base_M, lambda_max)
+    for name, (lo, hi) in result["bounds"].items():
+        print(f"   {name} bounds: {lo:.4f} .. {hi:.4f}")
+    print("Entropy weights:", dict(zip(criteria, result["entropy_weights"])))
+    print("Combined (hybrid) weights:", dict(zip(criteria, result["combined"])))
+    print(f"Used {result['mc_info']['samples']} weight draws (converged: {result['mc_info']['converged']})")
+    E.print_cr_filter(result["mc_info"])
+    E.save_weight_outputs(criteria, w_ahp, result["entropy_weights"], result["combined"], lambda_max,
+                          CI, CR, result["draws"], result["mc_info"], result["draw_lambdas"],
+                          E.draw_sample_weights(result["mc_info"], result["draw_lambdas"], len(criteria)))
+
+    print("\n--- 📊 AREA STATISTICS (Estimated) ---")
+    print_class_areas(result["class_counts"], class_labels(graph["thresholds"]), E.PIXEL_AREA_SQM)
+    for key, path in graph["paths"].items():
+        print(f"✅ {key}: {path}")
+    print("Phase3-6 dask graph finished:", datetime.now())
+
+if __name__ == "__main__":
+    profile_from_argv("dask")
+    main()
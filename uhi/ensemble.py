@@ -0,0 +1,1852 @@
+"""
+Phase4_Advanced_AHP.py (Updated for Soft Masking)
+
+Features:
+- Compute AHP weights from pairwise comparisons (numpy eigenvector) + CR
+- Compute Entropy weights from normalized rasters (data-driven, one streaming pass)
+- Any number of criteria via register_criterion(); criteria are aligned lazily per
+  tile and never read when their weight is negligible
+- Combine weights: hybrid = alpha*AHP + (1-alpha)*Entropy
+- Monte Carlo sensitivity analysis (i.i.d., scrambled Sobol' or LHS draws,
+  with convergence-based early stopping)
+- Per-draw consistency check before any raster work: inconsistent perturbed matrices
+  are redrawn (MC_CR_FILTER = "reject") or down-weighted in every product ("weight")
+- UPDATED: Uses direct multiplication for mask (Score * 0.0001) instead of binary exclusion.
+- Fused overlay kernel for the Monte Carlo loop (Numba if installed, chunked NumPy otherwise)
+- Tiled ensemble engine with streaming per-pixel quantiles (P5/P50/P95) and
+  exceedance probabilities, using bounded per-pixel histograms
+- `python -m uhi run --workers N`: the Monte Carlo draws split over N processes
+  that attach to one shared-memory copy of the raster stack (shared_stack.py)
+- Every random number comes from a SeedSequence stream keyed by its tile / draw
+  block, so results do not depend on the worker count; long runs checkpoint their
+  progress and `python -m uhi run --resume` continues an interrupted run
+- `python -m uhi run sensitivity`: Sobol' first/total-order indices over ALPHA,
+  the PAIRWISE entries and PERTURB_SIGMA (global + per-pixel maps) in one raster pass
+- `python -m uhi run batch scenarios.json`: many weighting scenarios evaluated as one
+  (pixels x criteria) @ (criteria x scenarios) product per tile, plus a comparison table
+- `python -m uhi run update`: diff-aware re-run; input tiles are checksummed and only
+  tiles whose inputs changed are recomputed, plus a delta map and per-class area change
+- `--profile` (any command): per-stage time / memory and raster I/O report (profiling.py)
+
+Requirements:
+pip install numpy rasterio pandas scipy
+Optional: pip install numba   (faster Monte Carlo kernel)
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import numpy as np
+import rasterio
+from rasterio.warp import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+import pandas as pd
+from scipy.linalg import eig
+import os
+import sys
+import time
+from datetime import datetime
+from .bounds import raster_bounds
+from .classify import DEFAULT_THRESHOLDS, load_thresholds, class_labels, classify_array
+from .profiling import stage, profiled, count_read, count_write, profile_from_argv
+
+# Optional: Numba JIT for the fused Monte Carlo kernel (pure NumPy fallback below)
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    numba = None
+    HAVE_NUMBA = False
+
+# ========== CRITERION REGISTRY ==========
+# Each criterion declares where it comes from and how to bring it onto the
+# template grid.  Registration order is the order used in PAIRWISE matrices,
+# weight vectors and output tables.
+CRITERIA_REGISTRY = {}
+
+def register_criterion(name, path, inverse=False, resampling="bilinear", normalize=False, bounds="minmax"):
+    """
+    name       -- criterion name used in PAIRWISE and all outputs
+    path       -- source raster (any CRS / resolution; aligned on the fly)
+    inverse    -- normalisation direction, as in Phase3 normalize(): True = low raw values score high
+    resampling -- rasterio resampling method name used to align it ("bilinear", "nearest", ...)
+    normalize  -- True if `path` holds raw values that must be scaled to 1-10 here
+                  (False for the *_norm.tif outputs of Phase3, already scaled and flipped)
+    bounds     -- normalisation bounds mode when normalize=True: "minmax", "percentile"
+                  or "zscore" (see normalization_bounds.py)
+    """
+    CRITERIA_REGISTRY[name] = {
+        "path": path,
+        "inverse": inverse,
+        "resampling": resampling,
+        "normalize": normalize,
+        "bounds": bounds,
+    }
+
+# ========== CONFIG ==========
+register_criterion("LST", "finalNormalizedData(afterPhase3)/LST_norm.tif")
+register_criterion("NDVI", "finalNormalizedData(afterPhase3)/NDVI_norm.tif")     # inverted in Phase3
+register_criterion("Population", "finalNormalizedData(afterPhase3)/Population_norm.tif")
+# More criteria need no code changes, e.g. a raw layer normalised here:
+# register_criterion("BuildingDensity", "ppdData(afterPhase2)/Building_Density.tif", normalize=True)
+# register_criterion("DistanceToWater", "ppdData(afterPhase2)/Water_Distance.tif", normalize=True, inverse=False)
+CRITERIA = list(CRITERIA_REGISTRY)
+# Pairwise comparisons dictionary: (i,j) -> value meaning i/j = value
+# Example for 3 criteria: LST vs NDVI = 3 means LST is 3x more important than NDVI
+PAIRWISE = {
+    ("LST", "NDVI"): 3.0,
+    ("LST", "Population"): 2.0,
+    ("NDVI", "Population"): 0.5
+}
+ALPHA = 0.7   # weight to give to AHP; hybrid = alpha*AHP + (1-alpha)*Entropy
+# file paths (must exist)
+TEMPLATE_PATH = CRITERIA_REGISTRY["LST"]["path"]    # grid (CRS, transform, shape) all criteria are aligned to
+MASK_PATH = "finalNormalizedData(afterPhase3)/Constraint_Mask.tif"   # Now contains 1.0 and 0.0001
+OUTPUT_DIR = "."
+# Monte Carlo settings
+MC_SAMPLES = 150        # maximum number of perturbed AHP matrices to sample
+PERTURB_SIGMA = 0.12    # standard deviation of log-normal multiplicative noise
+SAMPLER = "sobol"       # "iid" (plain lognormal draws), "sobol" (scrambled Sobol') or "lhs" (Latin hypercube)
+SEED = 42               # root seed of every random stream (None = fresh entropy, recorded in the weights JSON)
+RNG_BLOCK = 1024        # iid weight draws per independent random stream
+DRAW_BATCH = 65536      # perturbed AHP matrices eigen-decomposed per numpy call
+DRAWS_FORMAT = "npy"    # weight draws file: "npy" (memory-mappable), "parquet" (needs pyarrow) or "csv"
+MC_CR_FILTER = None     # None (every draw), "reject" (redraw perturbed matrices with CR > MC_CR_MAX)
+                        # or "weight" (importance weights from each draw's CR)
+MC_CR_MAX = 0.1         # consistency limit of a perturbed matrix (Saaty)
+MC_REJECT_LIMIT = 50    # "reject": give up after proposing this many times MC_SAMPLES matrices
+MC_TOL = 0.05           # stop early once weight mean/covariance change less than this between checkpoints (None = always run MC_SAMPLES)
+MC_MIN_SAMPLES = 32     # first convergence checkpoint; checkpoints then double (32, 64, 128, ...)
+ENTROPY_SAMPLE_SIZE = None   # None = use all pixels
+USE_NUMBA = True             # use the Numba kernel when numba is installed
+OVERLAY_CHUNK_PIXELS = 65536 # chunk size of the NumPy fallback kernel (fits in cache)
+ENSEMBLE_TILE_ROWS = 256     # rows per tile; every raster pass holds one tile per criterion
+MC_WORKERS = 1               # >1: Monte Carlo on this many processes sharing one raster stack (shared_stack.py)
+WEIGHT_EPSILON = 1e-4        # criteria whose weight never exceeds this are not read at all
+CHECKPOINT_FILE = "uhi_mc_checkpoint.npz"  # progress of an interrupted run (`python -m uhi run --resume`)
+CHECKPOINT_SECONDS = 120     # save progress at most this often (None = no checkpoints)
+CHECKPOINT_SAMPLES = 256     # draws between progress checks inside a tile
+# Per-pixel ensemble products beyond mean/std (set to () to skip)
+QUANTILES = (0.05, 0.50, 0.95)            # P5 / P50 / P95 score maps
+QUANTILE_BINS = 32                        # histogram bins per pixel (between its min/max reachable score)
+EXCEEDANCE_THRESHOLDS = None    # None = the phase6 thresholds in use (uhi_thresholds.json, else uhi/classify.py);
+                                # or a tuple of scores, () to skip the exceedance maps
+EXCEEDANCE_RULE = "score >= threshold"    # same rule as the phase6 classes; part of the run fingerprint
+# Global sensitivity analysis (`python -m uhi run sensitivity`)
+SA_SAMPLES = 512                # Saltelli base sample size N, a power of 2 (cost: N*(k+2) weight evaluations, no raster work)
+SA_TARGET = "score"             # "score" (baseline hybrid map) or "variance" (Monte Carlo ensemble variance map)
+SA_ALPHA_RANGE = (0.5, 0.9)     # ALPHA sampled uniformly in this range
+SA_PAIRWISE_FACTOR = 2.0        # each PAIRWISE entry sampled log-uniformly in [v/factor, v*factor]
+SA_SIGMA_RANGE = (0.05, 0.25)   # PERTURB_SIGMA sampled uniformly in this range
+SA_MC_DRAWS = 64                # (power of 2) common-random-number draws per parameter set for the "variance" target
+# Scenario batch runner (`python -m uhi run batch scenarios.json`)
+SCENARIO_DIR = "scenarios"      # per-scenario maps go to OUTPUT_DIR/SCENARIO_DIR/<name>.tif
+SCENARIO_WORKERS = 4            # tiles evaluated in parallel (matrix products release the GIL)
+PIXEL_AREA_SQM = 30 * 30        # same 30 m pixel estimate as phase6
+# Diff-aware re-runs (python -m uhi run update)
+RUN_STATE_FILE = "uhi_run_state.json"     # tile checksums + partial sums of the last update run
+UPDATE_WEIGHT_TOL = 1e-3        # keep the previous hybrid weights while the new ones move less than this
+                                # (max score shift ~ 10 * n_criteria * tol); 0 = recompute everything on any change
+# ============================
+
+# Helper: build full pairwise matrix from PAIRWISE dictionary
+def build_pairwise_matrix(criteria, comparisons):
+    n = len(criteria)
+    M = np.ones((n, n), dtype=float)
+    idx = {c: i for i, c in enumerate(criteria)}
+    # fill from comparisons (assume reciprocal if not given)
+    for (a, b), v in comparisons.items():
+        i, j = idx[a], idx[b]
+        M[i, j] = float(v)
+        M[j, i] = 1.0 / float(v)
+    return M
+
+# Compute principal eigenvector (normalized) -> AHP weights
+def ahp_weights_from_matrix(M):
+    vals, vecs = eig(M)
+    eigvals = np.real(vals)
+    eigvecs = np.real(vecs)
+    idx = np.argmax(eigvals)
+    w = eigvecs[:, idx]
+    w = np.abs(w)
+    w = w / np.sum(w)
+    lambda_max = eigvals[idx]
+    return w, float(lambda_max)
+
+# Random consistency index of an n x n matrix
+def random_index(n):
+    RI_table = {1:0.00, 2:0.00, 3:0.58, 4:0.90, 5:1.12, 6:1.24, 7:1.32, 8:1.41, 9:1.45, 10:1.49,
+                11:1.51, 12:1.48, 13:1.56, 14:1.57, 15:1.59}
+    # Beyond Saaty's table: Alonso & Lamata (2006) fit of the mean random lambda_max
+    return RI_table[n] if n in RI_table else (1.7699 * n - 4.3513) / (n - 1)
+
+# Consistency Ratio (CR) calculation
+def consistency_ratio(M, lambda_max):
+    n = M.shape[0]
+    CI = (lambda_max - n) / (n - 1) if n > 1 else 0.0
+    RI = random_index(n)
+    CR = CI / RI if RI != 0 else 0.0
+    return CI, CR
+
+# CR of many n x n matrices from their lambda_max values (e.g. the Monte Carlo draws)
+def consistency_ratios(lambda_max, n):
+    RI = random_index(n)
+    if n < 2 or RI == 0:
+        return np.zeros(len(lambda_max))
+    return (np.asarray(lambda_max, dtype='float64') - n) / (n - 1) / RI
+
+# Importance weight of each Monte Carlo draw from the CR of its perturbed matrix:
+# 1 for a perfectly consistent matrix, falling off as a Gaussian in CR / cr_max
+# (exp(-1/2) at the limit), so inconsistent judgements count less, not zero.
+def cr_importance_weights(lambda_max, n, cr_max=MC_CR_MAX):
+    cr = np.maximum(consistency_ratios(lambda_max, n), 0.0)
+    return np.exp(-0.5 * (cr / cr_max) ** 2)
+
+# Thresholds of the exceedance maps, resolved when a run starts so that they
+# follow the calibrated phase6 classes; `phase6` passes thresholds already loaded
+def exceedance_thresholds(phase6=None):
+    if EXCEEDANCE_THRESHOLDS is not None:
+        return tuple(EXCEEDANCE_THRESHOLDS)
+    return tuple(load_thresholds() if phase6 is None else phase6)
+
+# Row tiles covering a raster of `height` rows
+def iter_tiles(height, tile_rows=ENSEMBLE_TILE_ROWS):
+    for r0 in range(0, height, tile_rows):
+        yield r0, min(r0 + tile_rows, height)
+
+# Scale raw values to 1-10 with given bounds (same formula as Phase3 normalize())
+def normalize_with_bounds(arr, lo, hi, inverse=False):
+    span = (hi - lo) if hi > lo else 1.0
+    norm = (arr - lo) / span * 9 + 1
+    if inverse:
+        norm = 11 - norm
+    return np.clip(norm, 1, 10).astype('float32')
+
+class CriteriaStack:
+    """
+    Registered criteria, aligned lazily on the template grid.
+
+    Nothing is read up front.  A criterion is opened through a WarpedVRT (its
+    registered resampling onto the template CRS/transform) the first time one
+    of its tiles is requested, so a pass over the map holds one tile per
+    criterion instead of every full-size array.
+    """
+
+    def __init__(self, names, template_path, mask_path=None, registry=None):
+        self.registry = CRITERIA_REGISTRY if registry is None else registry
+        self.names = list(names)
+        with rasterio.open(template_path) as t:
+            self.meta = t.meta.copy()
+            self.transform = t.transform
+            self.crs = t.crs
+            self.height, self.width = t.height, t.width
+        self.mask_path = mask_path if mask_path and os.path.exists(mask_path) else None
+        self._sources = {}
+        self._bounds = {}
+
+    @property
+    def shape(self):
+        return (len(self.names), self.height, self.width)
+
+    def _vrt(self, key, path, resampling):
+        if key not in self._sources:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            src = rasterio.open(path)
+            vrt = WarpedVRT(src, crs=self.crs, transform=self.transform,
+                            width=self.width, height=self.height,
+                            resampling=Resampling[resampling], nodata=0)
+            self._sources[key] = (src, vrt)
+        return self._sources[key][1]
+
+    def _window(self, r0, r1):
+        return Window(0, r0, self.width, r1 - r0)
+
+    def read_raw_tile(self, name, r0, r1):
+        """Masked tile of a criterion on the template grid, before any normalisation."""
+        spec = self.registry[name]
+        vrt = self._vrt(name, spec["path"], spec["resampling"])
+        arr = vrt.read(1, window=self._window(r0, r1), masked=True)
+        count_read(spec["path"], arr.data.nbytes)
+        return arr
+
+    def set_bounds(self, name, lo, hi):
+        """Use known raw min/max for `name` instead of scanning the raster."""
+        self._bounds[name] = (float(lo), float(hi))
+
+    def bounds(self, name):
+        """Raw normalisation bounds of a criterion on the template grid (histogram service, cached)."""
+        if name not in self._bounds:
+            spec = self.registry[name]
+            grid = {"crs": self.crs, "transform": self.transform, "width": self.width,
+                    "height": self.height, "resampling": spec["resampling"], "nodata": 0}
+            self._bounds[name] = raster_bounds(spec["path"], mode=spec["bounds"], grid=grid)
+        return self._bounds[name]
+
+    def read_tile(self, r0, r1, names=None):
+        """(len(names), r1-r0, width) float32 tile of the (normalised) criteria."""
+        names = self.names if names is None else names
+        out = np.empty((len(names), r1 - r0, self.width), dtype='float32')
+        for i, name in enumerate(names):
+            spec = self.registry[name]
+            vrt = self._vrt(name, spec["path"], spec["resampling"])
+            arr = vrt.read(1, window=self._window(r0, r1), out_dtype='float32')
+            count_read(spec["path"], arr.nbytes)
+            if spec["normalize"]:
+                lo, hi = self.bounds(name)
+                arr = normalize_with_bounds(np.nan_to_num(arr, nan=lo), lo, hi, inverse=spec["inverse"])
+            out[i] = arr
+        return out
+
+    def read_mask_tile(self, r0, r1):
+        if self.mask_path is None:
+            return None
+        # Nearest keeps strict 1.0 or 0.0001 values, no interpolation
+        vrt = self._vrt("__mask__", self.mask_path, "nearest")
+        arr = vrt.read(1, window=self._window(r0, r1), out_dtype='float32')
+        count_read(self.mask_path, arr.nbytes)
+        return arr
+
+    def close(self):
+        for src, vrt in self._sources.values():
+            vrt.close()
+            src.close()
+        self._sources = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Indices of the criteria whose weight is non-negligible in any row of `weights`
+def active_criteria(weights, eps=WEIGHT_EPSILON):
+    weights = np.atleast_2d(weights)
+    return [i for i in range(weights.shape[1]) if np.max(np.abs(weights[:, i])) > eps]
+
+# Column sums behind the entropy weights for one tile: sum x, sum x ln x and the
+# pixel count over fully suitable pixels.  `keep` < 1 Bernoulli-subsamples them.
+def entropy_tile_sums(cstack, r0, r1, keep=1.0, rng=None):
+    return entropy_sums_from_tile(cstack.read_tile(r0, r1), cstack.read_mask_tile(r0, r1), keep, rng)
+
+# The same sums for an in-memory (n_criteria, rows, cols) tile and its mask (or None)
+def entropy_sums_from_tile(tile, mt, keep=1.0, rng=None):
+    tile = tile.reshape(tile.shape[0], -1)
+    # Only pixels that are fully suitable (mask approx 1.0) define the entropy,
+    # so the 0.0001 pixels cannot skew it
+    valid = mt.reshape(-1) > 0.5 if mt is not None else np.ones(tile.shape[1], dtype=bool)
+    if keep < 1.0:
+        rng = np.random.default_rng() if rng is None else rng
+        valid &= rng.random(valid.shape[0]) < keep
+    data = tile[:, valid].astype(float)
+    data[data < 0] = 0.0
+    S = data.sum(axis=1)
+    T = (data * np.log(np.where(data > 0, data, 1.0))).sum(axis=1)
+    return S, T, data.shape[1]
+
+# Entropy weights from the column sums.  With P = x / S per criterion,
+#   sum(P ln P) = (sum x ln x) / S - ln S,
+# so only the column sums of x and x ln x are needed, never the full arrays.
+def entropy_weights_from_sums(S, T, m):
+    plogp = np.divide(T, S, out=np.zeros(len(S)), where=S > 0) - np.log(np.where(S > 0, S, 1.0))
+    k = 1.0 / math.log(m)
+    e = -k * plogp
+    d = 1 - e
+    return d / np.sum(d)
+
+# Entropy weights in one streaming pass.  The subsample of tile t comes from its
+# own random stream, so it does not depend on which tiles were read before.
+@profiled("entropy")
+def entropy_weights_streaming(cstack, sample_size=None, tile_rows=ENSEMBLE_TILE_ROWS, seed=SEED):
+    n = len(cstack.names)
+    S = np.zeros(n)
+    T = np.zeros(n)
+    m = 0
+    keep = 1.0
+    if sample_size:
+        # Bernoulli subsample of about `sample_size` valid pixels
+        n_valid = 0
+        for r0, r1 in iter_tiles(cstack.height, tile_rows):
+            mt = cstack.read_mask_tile(r0, r1)
+            n_valid += int(np.count_nonzero(mt > 0.5)) if mt is not None else (r1 - r0) * cstack.width
+        keep = min(1.0, sample_size / max(n_valid, 1))
+    seed = run_seed(seed)
+    for t, (r0, r1) in enumerate(iter_tiles(cstack.height, tile_rows)):
+        rng = rng_stream(seed, RNG_ENTROPY, t) if keep < 1.0 else None
+        S_t, T_t, m_t = entropy_tile_sums(cstack, r0, r1, keep, rng)
+        S += S_t
+        T += T_t
+        m += m_t
+    return entropy_weights_from_sums(S, T, m)
+
+# Weighted overlay given weight vector and raster arrays
+def overlay_weighted(arrays, weights):
+    out = np.zeros_like(arrays[0], dtype='float32')
+    tmp = np.empty_like(out)
+    for w, arr in zip(weights, arrays):
+        np.multiply(arr, float(w), out=tmp)
+        out += tmp
+    return out
+
+# Fused Monte Carlo kernel: weighted sum -> mask multiply -> mean / sum-of-squares
+# accumulation, all in one pass over memory.  `stack` is (n_criteria, n_pix),
+# `mask`, `out`, `mean_acc` and `sq_acc` are (n_pix,) views.  Nothing is allocated
+# here, so the caller can keep its buffers alive across the whole MC loop.
+# `sample_weight` scales what this draw adds to the accumulators (importance weights).
+if HAVE_NUMBA:
+    @numba.njit(parallel=True, cache=True)
+    def _overlay_accumulate_numba(stack, weights, mask, use_mask, out, mean_acc, sq_acc, sample_weight):
+        n_crit, n_pix = stack.shape
+        for p in numba.prange(n_pix):
+            v = np.float32(0.0)
+            for i in range(n_crit):
+                v += np.float32(weights[i]) * stack[i, p]
+            if use_mask:
+                v *= mask[p]
+            out[p] = v
+            vv = v * v
+            if sample_weight == 1.0:
+                mean_acc[p] += v
+                sq_acc[p] += vv
+            else:
+                mean_acc[p] += sample_weight * v
+                sq_acc[p] += sample_weight * vv
+
+def _overlay_accumulate_numpy(stack, weights, mask, out, mean_acc, sq_acc, scratch, sample_weight=1.0):
+    n_pix = out.shape[0]
+    chunk = scratch.shape[0]
+    for s in range(0, n_pix, chunk):
+        e = min(s + chunk, n_pix)
+        o = out[s:e]
+        t = scratch[:e - s]
+        np.multiply(stack[0, s:e], float(weights[0]), out=o)
+        for i in range(1, stack.shape[0]):
+            np.multiply(stack[i, s:e], float(weights[i]), out=t)
+            np.add(o, t, out=o)
+        if mask is not None:
+            np.multiply(o, mask[s:e], out=o)
+        if sample_weight == 1.0:
+            np.add(mean_acc[s:e], o, out=mean_acc[s:e])
+            np.multiply(o, o, out=t)
+        else:
+            np.multiply(o, sample_weight, out=t)
+            np.add(mean_acc[s:e], t, out=mean_acc[s:e])
+            np.multiply(t, o, out=t)
+        np.add(sq_acc[s:e], t, out=sq_acc[s:e])
+
+def overlay_accumulate(stack, weights, mask, out, mean_acc, sq_acc, scratch=None, sample_weight=1.0):
+    """Write mask * (weights . stack) into `out` and add it (and its square), times `sample_weight`, to the accumulators."""
+    stack = stack.reshape(stack.shape[0], -1)
+    out = out.reshape(-1)
+    mean_acc = mean_acc.reshape(-1)
+    sq_acc = sq_acc.reshape(-1)
+    if mask is not None:
+        mask = mask.reshape(-1)
+    if HAVE_NUMBA and USE_NUMBA:
+        use_mask = mask is not None
+        if not use_mask:
+            mask = out   # placeholder, never read
+        _overlay_accumulate_numba(stack, np.asarray(weights, dtype='float64'), mask,
+                                  use_mask, out, mean_acc, sq_acc, float(sample_weight))
+    else:
+        if scratch is None:
+            scratch = np.empty(min(OVERLAY_CHUNK_PIXELS, out.shape[0]), dtype='float32')
+        _overlay_accumulate_numpy(stack, weights, mask, out, mean_acc, sq_acc, scratch, sample_weight)
+    return out
+
+# Streaming per-pixel histogram of the ensemble scores.  Every pixel gets its own
+# `n_bins` bins spanning [lo, hi] (the range its score can reach under the sampled
+# weights), so memory is n_bins counters per pixel of the current tile no matter
+# how many MC samples are drawn.  `counts` is (n_bins, n_pix); weighted samples
+# (importance weights) need float counts.
+if HAVE_NUMBA:
+    @numba.njit(parallel=True, cache=True)
+    def _histogram_accumulate_numba(values, lo, scale, counts, increment):
+        n_bins, n_pix = counts.shape
+        for p in numba.prange(n_pix):
+            b = int((values[p] - lo[p]) * scale[p])
+            if b < 0:
+                b = 0
+            elif b >= n_bins:
+                b = n_bins - 1
+            counts[b, p] += increment
+
+def histogram_accumulate(values, lo, scale, counts, idx_buf, tmp_buf, pix_index, sample_weight=1.0):
+    """Add one sample per pixel to the per-pixel histograms (buffers are preallocated by the caller)."""
+    n_bins, n_pix = counts.shape
+    if HAVE_NUMBA and USE_NUMBA:
+        _histogram_accumulate_numba(values, lo, scale, counts, counts.dtype.type(sample_weight))
+        return
+    np.subtract(values, lo, out=tmp_buf)
+    np.multiply(tmp_buf, scale, out=tmp_buf)
+    np.clip(tmp_buf, 0, n_bins - 1, out=tmp_buf)
+    idx_buf[...] = tmp_buf
+    np.multiply(idx_buf, n_pix, out=idx_buf)
+    np.add(idx_buf, pix_index, out=idx_buf)
+    counts.reshape(-1)[idx_buf] += counts.dtype.type(sample_weight)
+
+# Read quantiles off the per-pixel histograms (linear interpolation inside the bin)
+def quantiles_from_histogram(counts, lo, width, n_total, quantiles):
+    cum = np.cumsum(counts, axis=0, dtype='float64')
+    pix = np.arange(counts.shape[1])
+    out = np.empty((len(quantiles), counts.shape[1]), dtype='float32')
+    for i, q in enumerate(quantiles):
+        target = q * n_total
+        b = np.argmax(cum >= target, axis=0)
+        prev = np.where(b > 0, cum[np.maximum(b - 1, 0), pix], 0.0)
+        c = counts[b, pix].astype('float64')
+        frac = np.divide(target - prev, c, out=np.zeros_like(c), where=c > 0)
+        out[i] = lo + (b + np.clip(frac, 0.0, 1.0)) * width
+    return out
+
+# Per-pixel histogram range of a tile: scores are mask * sum(w_i * x_i) with x_i >= 0,
+# so each pixel stays between the overlays of the smallest and largest sampled
+# weight per criterion.  Returns (lo, span, scale) for histogram_accumulate().
+def histogram_range(tile, m_tile, w_lo, w_hi, n_bins):
+    lo = np.tensordot(w_lo, tile, axes=1).astype('float32')
+    hi = np.tensordot(w_hi, tile, axes=1).astype('float32')
+    if m_tile is not None:
+        lo *= m_tile
+        hi *= m_tile
+    span = hi - lo
+    scale = np.divide(n_bins, span, out=np.zeros_like(span), where=span > 0)
+    return lo, span, scale
+
+# Per-pixel products of one tile from the accumulated sums over `n_samples` draws
+# (sum, sum of squares, exceedance counts and, with quantiles, the histograms).
+# For importance-weighted draws `n_samples` is the total sample weight.
+def tile_products(sum_t, sq_t, exc_t, n_samples, shape2d, quantiles=(), counts=None, lo=None, span=None):
+    mean_t = sum_t / float(n_samples)
+    var_t = (sq_t / float(n_samples)) - (mean_t*mean_t)
+    products = {
+        "mean": mean_t.reshape(shape2d).astype('float32'),
+        "std": np.sqrt(np.maximum(var_t, 0.0)).reshape(shape2d).astype('float32'),
+        "exceedance": (exc_t / float(n_samples)).reshape((exc_t.shape[0],) + shape2d),
+    }
+    if quantiles:
+        n_bins = counts.shape[0]
+        q_tile = quantiles_from_histogram(counts, lo, span / n_bins, n_samples, quantiles)
+        products["quantiles"] = q_tile.reshape((len(quantiles),) + shape2d)
+    return products
+
+# Counter type of the per-pixel histograms
+def histogram_count_dtype(n_samples, sample_weights=None):
+    if sample_weights is not None:
+        return 'float32'
+    return 'uint16' if n_samples < 2**16 else 'uint32'
+
+# Inner Monte Carlo loop over one tile: overlay every draw and add it to the sum /
+# sum-of-squares / exceedance accumulators and, if `hist` = (lo, scale, counts,
+# idx_buf, tmp_buf, pix_index) is given, to the per-pixel histograms.  With
+# `sample_weights`, draw k counts sample_weights[k] times everywhere.
+def accumulate_samples(tile, m_tile, weight_draws, out, sum_t, sq_t, exc_t, thresholds, scratch, bool_buf,
+                       hist=None, sample_weights=None):
+    for k in range(weight_draws.shape[0]):
+        sw = 1.0 if sample_weights is None else float(sample_weights[k])
+        overlay_accumulate(tile, weight_draws[k], m_tile, out, sum_t, sq_t, scratch, sw)
+        if hist is not None:
+            histogram_accumulate(out, *hist, sample_weight=sw)
+        for j, thr in enumerate(thresholds):
+            np.greater_equal(out, thr, out=bool_buf)      # EXCEEDANCE_RULE
+            if sample_weights is None:
+                np.add(exc_t[j], bool_buf, out=exc_t[j])
+            else:
+                np.add(exc_t[j], np.float32(sw), out=exc_t[j], where=bool_buf)
+
+# Tiled Monte Carlo ensemble engine
+@profiled("ensemble")
+def run_ensemble(cstack, weight_draws, on_tile, tile_rows=ENSEMBLE_TILE_ROWS,
+                 quantiles=QUANTILES, thresholds=None, n_bins=QUANTILE_BINS,
+                 baseline_weights=None, tiles=None, verbose=True, checkpoint=None, sample_weights=None):
+    """
+    Overlay every weight draw (rows of `weight_draws`) tile by tile and hand
+    per-pixel mean, std, quantile maps (P5/P50/P95 ...), exceedance
+    probabilities P(score >= threshold) and, if `baseline_weights` is given, the
+    baseline map of each tile to `on_tile(r0, r1, products)`.
+
+    Tiles are the outer loop and samples the inner one: only criteria with a
+    non-negligible weight are read, one tile at a time, and the per-pixel
+    histograms behind the quantiles only ever exist for one tile.  `tiles`
+    optionally restricts the pass to a list of (r0, r1) row ranges.
+    `cstack` only needs names / height / width / read_tile / read_mask_tile.
+    With a MonteCarloCheckpoint, tiles already written are skipped, the tile in
+    progress continues from its saved accumulators, and progress is saved
+    every CHECKPOINT_SAMPLES draws once CHECKPOINT_SECONDS have passed.
+    `sample_weights` (one per draw, e.g. cr_importance_weights) turns every
+    product into its weighted counterpart.  `thresholds` None resolves
+    exceedance_thresholds(); () skips the exceedance maps.
+    """
+    height, width = cstack.height, cstack.width
+    active = active_criteria(weight_draws)
+    names = [cstack.names[i] for i in active]
+    weight_draws = weight_draws[:, active]
+    if baseline_weights is not None:
+        baseline_weights = np.asarray(baseline_weights)[active]
+    n_crit = len(active)
+    n_samples = weight_draws.shape[0]
+    total = n_samples if sample_weights is None else float(np.sum(sample_weights))
+    quantiles = tuple(quantiles or ())
+    thresholds = exceedance_thresholds() if thresholds is None else tuple(thresholds)
+
+    # Per-pixel histogram ranges come from the extreme sampled weights (histogram_range)
+    w_lo = weight_draws.min(axis=0)
+    w_hi = weight_draws.max(axis=0)
+
+    # All buffers are allocated once; the sample loop only writes into them.
+    max_pix = min(tile_rows, height) * width
+    out_buf = np.empty(max_pix, dtype='float32')
+    mean_buf = np.empty(max_pix, dtype='float64')
+    sq_buf = np.empty(max_pix, dtype='float64')
+    exc_buf = np.empty(len(thresholds) * max_pix, dtype='float32')
+    scratch = np.empty(min(OVERLAY_CHUNK_PIXELS, max_pix), dtype='float32')
+    bool_buf = np.empty(max_pix, dtype=bool)
+    if quantiles:
+        count_dtype = histogram_count_dtype(n_samples, sample_weights)
+        counts_buf = np.empty(n_bins * max_pix, dtype=count_dtype)
+        idx_buf = np.empty(max_pix, dtype=np.intp)
+        tmp_buf = np.empty(max_pix, dtype='float32')
+        pix_index = np.arange(max_pix, dtype=np.intp)
+
+    tiles = list(iter_tiles(height, tile_rows)) if tiles is None else list(tiles)
+    if checkpoint is not None:
+        tiles = checkpoint.pending(tiles)
+    n_tiles = len(tiles)
+    step = CHECKPOINT_SAMPLES if checkpoint is not None else max(n_samples, 1)
+    for t, (r0, r1) in enumerate(tiles):
+        n_pix = (r1 - r0) * width
+        with stage("read_tile"):
+            tile = cstack.read_tile(r0, r1, names).reshape(n_crit, n_pix)
+            m_tile = cstack.read_mask_tile(r0, r1)
+        if m_tile is not None:
+            m_tile = m_tile.reshape(n_pix)
+        out = out_buf[:n_pix]
+        mean_t = mean_buf[:n_pix]
+        sq_t = sq_buf[:n_pix]
+        mean_t.fill(0.0)
+        sq_t.fill(0.0)
+        exc_t = exc_buf[:len(thresholds) * n_pix].reshape(len(thresholds), n_pix)
+        exc_t.fill(0.0)
+
+        lo = span = counts = None
+        if quantiles:
+            lo, span, scale = histogram_range(tile, m_tile, w_lo, w_hi, n_bins)
+            counts = counts_buf[:n_bins * n_pix].reshape(n_bins, n_pix)
+            counts.fill(0)
+
+        start = 0
+        if checkpoint is not None:
+            start, saved = checkpoint.resume_tile(r0, r1)
+            if saved is not None:
+                mean_t[:] = saved["sum"]
+                sq_t[:] = saved["sq"]
+                exc_t[:] = saved["exc"]
+                if quantiles:
+                    counts[:] = saved["counts"]
+
+        hist = (lo, scale, counts, idx_buf[:n_pix], tmp_buf[:n_pix], pix_index[:n_pix]) if quantiles else None
+        with stage("samples"):
+            for k0 in range(start, n_samples, step):
+                k1 = min(k0 + step, n_samples)
+                accumulate_samples(tile, m_tile, weight_draws[k0:k1], out, mean_t, sq_t, exc_t, thresholds,
+                                   scratch, bool_buf[:n_pix], hist,
+                                   None if sample_weights is None else sample_weights[k0:k1])
+                if checkpoint is not None and k1 < n_samples:
+                    checkpoint.tile_progress(r0, r1, k1, {"sum": mean_t, "sq": sq_t, "exc": exc_t, "counts": counts})
+
+        shape2d = (r1 - r0, width)
+        with stage("products"):
+            products = tile_products(mean_t, sq_t, exc_t, total, shape2d, quantiles, counts, lo, span)
+            if baseline_weights is not None:
+                base = overlay_weighted(tile, baseline_weights)
+                if m_tile is not None:
+                    base *= m_tile
+                products["baseline"] = base.reshape(shape2d)
+        with stage("write"):
+            on_tile(r0, r1, products)
+        if checkpoint is not None:
+            checkpoint.tile_done(r0, r1)
+        if verbose:
+            print(f"Ensemble tile {t+1}/{n_tiles} (rows {r0}-{r1}) done")
+
+# Save raster
+def save_raster(path, arr, meta):
+    out_meta = meta.copy()
+    out_meta.update(dtype='float32', count=1, compress='lzw')
+    with rasterio.open(path, 'w', **out_meta) as dst:
+        dst.write(arr.astype('float32'), 1)
+    count_write(path, arr.size * 4)
+
+# Open a float32 GeoTIFF that is filled tile by tile with write_window()
+def open_raster_writer(path, meta, descriptions=None):
+    out_meta = meta.copy()
+    count = len(descriptions) if descriptions else 1
+    out_meta.update(dtype='float32', count=count, compress='lzw')
+    dst = rasterio.open(path, 'w', **out_meta)
+    for i, desc in enumerate(descriptions or [], start=1):
+        dst.set_band_description(i, desc)
+    return dst
+
+def write_window(dst, r0, arr):
+    arr = arr.astype('float32')
+    count_write(dst.name, arr.nbytes)
+    if arr.ndim == 2:
+        dst.write(arr, 1, window=Window(0, r0, arr.shape[1], arr.shape[0]))
+    else:
+        dst.write(arr, window=Window(0, r0, arr.shape[2], arr.shape[1]))
+
+# Save a multi-band raster with one description per band
+def save_raster_bands(path, bands, meta, descriptions):
+    out_meta = meta.copy()
+    out_meta.update(dtype='float32', count=len(bands), compress='lzw')
+    with rasterio.open(path, 'w', **out_meta) as dst:
+        for i, (band, desc) in enumerate(zip(bands, descriptions), start=1):
+            dst.write(band.astype('float32'), i)
+            dst.set_band_description(i, desc)
+            count_write(path, band.size * 4)
+
+# Monte Carlo: perturb pairwise matrix values multiplicatively
+# `z` optionally supplies the standard-normal deviates for the upper triangle
+# (row by row); without it they are drawn from `rng` (a numpy Generator).
+def perturb_pairwise_matrix(base_matrix, sigma=0.12, z=None, rng=None):
+    n = base_matrix.shape[0]
+    M = base_matrix.copy()
+    t = 0
+    for i in range(n):
+        for j in range(i+1, n):
+            base = M[i,j]
+            if z is None:
+                rng = np.random.default_rng() if rng is None else rng
+                noise = math.exp(rng.normal(loc=0.0, scale=sigma))
+            else:
+                noise = math.exp(sigma * z[t])
+            t += 1
+            new = base * noise
+            M[i,j] = new
+            M[j,i] = 1.0 / new
+    np.fill_diagonal(M, 1.0)
+    return M
+
+# Independent random streams.  Every consumer gets its own SeedSequence child,
+# keyed by (stream, index) under the run's root seed, e.g. (RNG_ENTROPY, tile) or
+# (RNG_DRAWS, block).  The numbers one tile, block or worker sees therefore do
+# not depend on how the work is split or in which order it runs.
+RNG_DRAWS, RNG_ENTROPY = 0, 1
+
+def run_seed(seed=None):
+    """Root seed of a run: `seed` itself, or fresh OS entropy that can be recorded and reused."""
+    return int(np.random.SeedSequence(seed).entropy)
+
+def rng_stream(seed, *key):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=key))
+
+# perturb_pairwise_matrix for a batch of deviates Z (m, n*(n-1)/2) -> (m, n, n) matrices
+def perturb_pairwise_batch(base_matrix, sigma, Z):
+    n = base_matrix.shape[0]
+    iu, ju = np.triu_indices(n, k=1)     # row by row, the order of perturb_pairwise_matrix
+    Ms = np.repeat(base_matrix[None].astype('float64'), Z.shape[0], axis=0)
+    upper = base_matrix[iu, ju] * np.exp(sigma * Z)
+    Ms[:, iu, ju] = upper
+    Ms[:, ju, iu] = 1.0 / upper
+    Ms[:, np.arange(n), np.arange(n)] = 1.0
+    return Ms
+
+# Smallest m with 2**m >= n (Sobol' points are only balanced in blocks of 2**m)
+def base2_exponent(n):
+    return max(int(n) - 1, 0).bit_length()
+
+# Source of standard-normal deviates for the upper-triangle perturbations.
+# Returns a function batch(m) -> (m, dim) array.  iid draw k comes from stream
+# (RNG_DRAWS, k // RNG_BLOCK), so it is the same whatever the batch sizes.  The
+# Sobol' sequence is generated with random_base2, doubling the points so far, and
+# handed out in batches of any size; with `limit`, only the largest power of 2
+# of draws <= limit are Sobol' points and the rest come from LHS.  LHS strata are
+# built per batch.
+def normal_deviate_source(sampler, dim, seed=None, limit=None):
+    seed = run_seed(seed)
+    if sampler == "iid":
+        state = {"k": 0, "rng": None}
+        def batch(m):
+            out = np.empty((m, dim))
+            i = 0
+            while i < m:
+                block, offset = divmod(state["k"], RNG_BLOCK)
+                if offset == 0:
+                    state["rng"] = rng_stream(seed, RNG_DRAWS, block)
+                n = min(m - i, RNG_BLOCK - offset)
+                out[i:i + n] = state["rng"].standard_normal((n, dim))
+                state["k"] += n
+                i += n
+            return out
+        return batch
+    from scipy.stats import norm, qmc
+    eps = 1e-12
+    if sampler == "lhs":
+        engine = qmc.LatinHypercube(d=dim, seed=rng_stream(seed, RNG_DRAWS))
+        return lambda m: norm.ppf(np.clip(engine.random(m), eps, 1.0 - eps))
+    if sampler != "sobol":
+        raise ValueError(f"Unknown sampler: {sampler}")
+    sobol = qmc.Sobol(d=dim, scramble=True, seed=rng_stream(seed, RNG_DRAWS))
+    lhs = qmc.LatinHypercube(d=dim, seed=rng_stream(seed, RNG_DRAWS, 1))
+    n_sobol = None if limit is None else 1 << (max(int(limit), 1).bit_length() - 1)
+    state = {"k": 0, "points": np.empty((0, dim))}
+    def batch(m):
+        k = state["k"]
+        n_sob = m if n_sobol is None else min(m, max(n_sobol - k, 0))
+        while sobol.num_generated < k + n_sob:
+            g = sobol.num_generated
+            more = sobol.random_base2(base2_exponent(g) if g else base2_exponent(k + n_sob))
+            state["points"] = np.concatenate([state["points"], more])
+        u = state["points"][k:k + n_sob]
+        if n_sob < m:
+            u = np.concatenate([u, lhs.random(m - n_sob)])
+        state["k"] = k + m
+        return norm.ppf(np.clip(u, eps, 1.0 - eps))
+    return batch
+
+# Draw the whole weight ensemble up front (cheap) so the raster passes can be tiled.
+# With `tol` set, sampling stops once the mean and covariance of the combined
+# weights settle.  Every pixel score is x . w, so its ensemble std is
+# sqrt(x^T Cov(w) x): once Cov(w) has converged, so has the std map, and no
+# raster work is spent on extra draws.  Draws fill preallocated arrays, DRAW_BATCH
+# matrices per eigen-decomposition; return_lambda=True also returns the
+# lambda_max of every perturbed matrix (its CR: consistency_ratios).
+# This is also the cheap consistency pre-pass: with cr_filter="reject", matrices
+# whose CR exceeds cr_max are dropped and more are drawn until n_samples are
+# accepted, so no raster pass is ever spent on them; with "weight" the
+# convergence check uses the importance weights (cr_importance_weights).
+@profiled("weight_draws")
+def draw_weight_ensemble(base_matrix, ent_w, n_samples, sigma=0.12, alpha=0.7,
+                         sampler="iid", seed=None, tol=None, min_samples=32, return_lambda=False,
+                         cr_filter=None, cr_max=MC_CR_MAX):
+    n = base_matrix.shape[0]
+    dim = n * (n - 1) // 2
+    seed = run_seed(seed)   # recorded in `info`, so an unseeded run can be repeated
+    # Rejection keeps an arbitrary subset of the proposals, so it can use Sobol' points throughout
+    batch = normal_deviate_source(sampler, dim, seed, limit=None if cr_filter == "reject" else n_samples)
+    draws = np.empty((n_samples, n), dtype='float64')
+    lambdas = np.empty(n_samples, dtype='float64')
+    done = 0
+    proposed = 0
+    step = min(min_samples, n_samples) if tol else n_samples
+    if sampler == "sobol" and tol:
+        step = min(1 << base2_exponent(step), n_samples)   # checkpoints at powers of 2
+    prev = None
+    change = None
+    converged = False
+    while done < n_samples:
+        m = min(step, n_samples - done)
+        end = done + m
+        while done < end:
+            Z = batch(end - done)
+            proposed += len(Z)
+            for s in range(0, len(Z), DRAW_BATCH):
+                w_k, lam = ahp_weights_batch(perturb_pairwise_batch(base_matrix, sigma, Z[s:s + DRAW_BATCH]))
+                if cr_filter == "reject":
+                    ok = consistency_ratios(lam, n) <= cr_max
+                    w_k, lam = w_k[ok], lam[ok]
+                comb_k = alpha * w_k + (1.0 - alpha) * ent_w
+                draws[done:done + len(w_k)] = comb_k / comb_k.sum(axis=1, keepdims=True)
+                lambdas[done:done + len(w_k)] = lam
+                done += len(w_k)
+            if done < end and proposed > MC_REJECT_LIMIT * n_samples:
+                raise RuntimeError(f"only {done} of {proposed} perturbed matrices have CR <= {cr_max}; "
+                                   "lower PERTURB_SIGMA or raise MC_CR_MAX")
+        if tol:
+            aw = cr_importance_weights(lambdas[:done], n, cr_max) if cr_filter == "weight" else None
+            mean = np.average(draws[:done], axis=0, weights=aw)
+            cov = np.cov(draws[:done], rowvar=False, aweights=aw)
+            if prev is not None:
+                std_scale = np.sqrt(np.max(np.diag(cov)))
+                d_mean = np.max(np.abs(mean - prev[0])) / std_scale if std_scale > 0 else 0.0
+                c_norm = np.linalg.norm(cov)
+                d_cov = np.linalg.norm(cov - prev[1]) / c_norm if c_norm > 0 else 0.0
+                change = float(max(d_mean, d_cov))
+                print(f"MC checkpoint {done} samples: relative change {change:.4f}")
+                if change < tol:
+                    converged = True
+                    break
+            prev = (mean, cov)
+            step = done   # double the sample count at every checkpoint
+    info = {
+        "sampler": sampler,
+        "seed": seed,
+        "samples": done,
+        "max_samples": n_samples,
+        "tol": tol,
+        "converged": converged,
+        "last_change": change,
+    }
+    if cr_filter:
+        info.update(cr_filter=cr_filter, cr_max=cr_max, proposed=proposed,
+                    acceptance_rate=done / proposed if proposed else None)
+    if cr_filter == "weight":
+        aw = cr_importance_weights(lambdas[:done], n, cr_max)
+        info["effective_samples"] = float(aw.sum() ** 2 / np.sum(aw * aw)) if done else 0.0
+    if return_lambda:
+        return draws[:done], info, lambdas[:done]
+    return draws[:done], info
+
+# Per-draw sample weights of a run (None unless its draws are importance-weighted)
+def draw_sample_weights(mc_info, draw_lambdas, n):
+    if mc_info.get("cr_filter") != "weight":
+        return None
+    return cr_importance_weights(draw_lambdas, n, mc_info["cr_max"])
+
+def print_cr_filter(mc_info):
+    if mc_info.get("cr_filter") == "reject":
+        print(f"CR filter: kept {mc_info['samples']} of {mc_info['proposed']} perturbed matrices "
+              f"(CR <= {mc_info['cr_max']})")
+    elif mc_info.get("cr_filter") == "weight":
+        print(f"CR importance weights: {mc_info['effective_samples']:.1f} effective samples "
+              f"of {mc_info['samples']}")
+
+# Checkpoint / resume of long Monte Carlo runs
+class MonteCarloCheckpoint:
+    """
+    Progress of a run on disk (CHECKPOINT_FILE): the weights and weight draws
+    of the run, the row ranges whose products are already written, and the
+    sum / sum-of-squares / exceedance / histogram accumulators of the tile in
+    progress.  Saved atomically at most every `every_seconds`; `flush` is
+    called first so the products of finished tiles are on disk before they
+    are recorded as done.  A checkpoint only resumes a run of the same
+    configuration and inputs (`fingerprint`).
+    """
+
+    def __init__(self, path, fingerprint, every_seconds=CHECKPOINT_SECONDS, flush=None):
+        self.path = path
+        self.fingerprint = json.dumps(fingerprint, sort_keys=True)
+        self.every_seconds = every_seconds
+        self.flush = flush
+        self.run = {}
+        self.done = []
+        self.partial = None
+        self._last = time.monotonic()
+
+    def load(self):
+        """Restore the saved progress; False if there is none for this configuration."""
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as z:
+            if str(z["fingerprint"]) != self.fingerprint:
+                saved, current = json.loads(str(z["fingerprint"])), json.loads(self.fingerprint)
+                changed = [k for k, v in current.get("inputs", {}).items() if saved.get("inputs", {}).get(k) != v]
+                if changed:
+                    print(f"⚠️ Inputs changed since the checkpoint was saved ({', '.join(changed)}), not resuming")
+                return False
+            self.run = {key[4:]: z[key] for key in z.files if key.startswith("run_")}
+            self.run["mc_info"] = json.loads(str(z["mc_info"]))
+            self.done = [tuple(int(v) for v in rows) for rows in z["done"]]
+            if "partial_rows" in z.files:
+                r0, r1, k = (int(v) for v in z["partial_rows"])
+                self.partial = (r0, r1, k, {key[4:]: z[key] for key in z.files if key.startswith("acc_")})
+        return True
+
+    def start(self, mc_info, **arrays):
+        """Record the weights / draws of a fresh run."""
+        self.run = dict(arrays, mc_info=mc_info)
+        self.done = []
+        self.save()
+
+    def pending(self, tiles):
+        """The tiles of `tiles` not yet covered by written rows."""
+        covered = set()
+        for r0, r1 in self.done:
+            covered.update(range(r0, r1))
+        return [(r0, r1) for r0, r1 in tiles if not covered.issuperset(range(r0, r1))]
+
+    def resume_tile(self, r0, r1):
+        """(samples done, accumulators) saved for the tile r0:r1, or (0, None)."""
+        if self.partial is not None and self.partial[:2] == (r0, r1):
+            return self.partial[2], self.partial[3]
+        return 0, None
+
+    def due(self):
+        return self.every_seconds is not None and time.monotonic() - self._last >= self.every_seconds
+
+    def tile_progress(self, r0, r1, k, accumulators):
+        if self.due():
+            self.save((r0, r1, k, accumulators))
+
+    def tile_done(self, r0, r1):
+        self.done.append((r0, r1))
+        self.partial = None
+        if self.due():
+            self.save()
+
+    def save(self, partial=None):
+        if self.flush is not None:
+            self.flush()
+        arrays = {f"run_{key}": np.asarray(v) for key, v in self.run.items() if key != "mc_info"}
+        arrays["fingerprint"] = np.array(self.fingerprint)
+        arrays["mc_info"] = np.array(json.dumps(self.run.get("mc_info", {})))
+        arrays["done"] = np.array(self.done, dtype=np.int64).reshape(-1, 2)
+        if partial is not None:
+            r0, r1, k, accumulators = partial
+            arrays["partial_rows"] = np.array([r0, r1, k], dtype=np.int64)
+            arrays.update({f"acc_{key}": v for key, v in accumulators.items() if v is not None})
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.path)
+        self._last = time.monotonic()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Main run
+# Output paths of the per-pixel products of a run
+def product_paths(thresholds=()):
+    paths = {
+        "baseline": os.path.join(OUTPUT_DIR, "Final_UHI_Mitigation_Map_Hybrid.tif"),
+        "mean": os.path.join(OUTPUT_DIR, "Final_UHI_Ensemble_mean.tif"),
+        "std": os.path.join(OUTPUT_DIR, "Final_UHI_Ensemble_std.tif"),
+    }
+    if len(QUANTILES):
+        paths["quantiles"] = os.path.join(OUTPUT_DIR, "Final_UHI_Ensemble_quantiles.tif")
+    if len(thresholds):
+        paths["exceedance"] = os.path.join(OUTPUT_DIR, "Final_UHI_Ensemble_exceedance.tif")
+    return paths
+
+# Open the product GeoTIFFs (mode "r+" rewrites windows of an existing run in place);
+# the exceedance bands are described with the thresholds they use
+def open_product_writers(paths, meta, mode="w", thresholds=()):
+    if mode == "r+":
+        return {key: rasterio.open(path, "r+") for key, path in paths.items()}
+    descriptions = {
+        "quantiles": [f"P{q*100:g}" for q in QUANTILES],
+        "exceedance": [f"P(score >= {t:g})" for t in thresholds],
+    }
+    return {key: open_raster_writer(path, meta, descriptions.get(key)) for key, path in paths.items()}
+
+# Weight draws as columns: one per criterion, plus lambda_max and CR of every
+# perturbed matrix when known, and the importance weight of each draw if any.  "npy" is a structured array that
+# np.load(mmap_mode="r") / load_draws() maps without parsing; "parquet" keeps
+# `meta` in the schema metadata.  Returns the path written.
+@profiled("save_draws")
+def save_draws(path_base, criteria, weight_draws, lambda_max=None, cr=None, meta=None, fmt=None,
+               sample_weights=None):
+    fmt = fmt or DRAWS_FORMAT
+    columns = dict(zip(criteria, np.asarray(weight_draws, dtype='float64').T))
+    if lambda_max is not None:
+        columns["lambda_max"] = np.asarray(lambda_max, dtype='float64')
+        columns["CR"] = np.asarray(cr, dtype='float64')
+    if sample_weights is not None:
+        columns["weight"] = np.asarray(sample_weights, dtype='float64')
+    n = len(weight_draws)
+    if fmt == "npy":
+        path = path_base + ".npy"
+        out = np.lib.format.open_memmap(path, mode="w+", shape=(n,),
+                                        dtype=[(name, 'float64') for name in columns])
+        for name, col in columns.items():
+            out[name] = col
+        out.flush()
+        del out
+    elif fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('DRAWS_FORMAT = "parquet" needs pyarrow (pip install pyarrow)')
+        path = path_base + ".parquet"
+        table = pa.table(columns).replace_schema_metadata({"uhi": json.dumps(meta or {}, default=str)})
+        pq.write_table(table, path)
+    elif fmt == "csv":
+        path = path_base + ".csv"
+        np.savetxt(path, np.column_stack(list(columns.values())), delimiter=",",
+                   header=",".join(columns), comments="", fmt="%.17g")
+    else:
+        raise ValueError(f"Unknown draws format: {fmt}")
+    count_write(path, n * len(columns) * 8)
+    return path
+
+# Columns of a draws file written by save_draws(): {name: 1-D array}.  .npy files
+# are memory-mapped, so the columns are views into the file.
+def load_draws(path, mmap=True):
+    if path.endswith(".npy"):
+        arr = np.load(path, mmap_mode="r" if mmap else None)
+        return {name: arr[name] for name in arr.dtype.names}
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=mmap)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    data = np.genfromtxt(path, delimiter=",", names=True)
+    return {name: data[name] for name in data.dtype.names}
+
+# Baseline weights JSON, weight ensemble stats CSV and the draws file
+@profiled("save_weights")
+def save_weight_outputs(criteria, w_ahp, ent_w, combined, lambda_max, CI, CR, weight_draws, mc_info,
+                        draw_lambdas=None, sample_weights=None):
+    draw_cr = consistency_ratios(draw_lambdas, len(criteria)) if draw_lambdas is not None else None
+    draws_path = save_draws(os.path.join(OUTPUT_DIR, "weight_ensemble_draws"), criteria, weight_draws,
+                            draw_lambdas, draw_cr, meta=dict(mc_info, alpha=ALPHA, sigma=PERTURB_SIGMA),
+                            sample_weights=sample_weights)
+    monte_carlo = dict(mc_info, sigma=PERTURB_SIGMA, draws_file=os.path.basename(draws_path))
+    if draw_cr is not None and len(draw_cr):
+        monte_carlo["draw_CR"] = {"mean": float(draw_cr.mean()), "max": float(draw_cr.max()),
+                                  "share_above_0.1": float(np.mean(draw_cr > 0.1))}
+    out_weights = {
+        "AHP_weights": dict(zip(criteria, w_ahp.tolist())),
+        "Entropy_weights": dict(zip(criteria, ent_w.tolist())),
+        "Combined_weights": dict(zip(criteria, combined.tolist())),
+        "consistency": {"lambda_max": lambda_max, "CI": CI, "CR": CR},
+        "meta": {"alpha": ALPHA},
+        "monte_carlo": monte_carlo
+    }
+    with open(os.path.join(OUTPUT_DIR, "uhi_weights_combined.json"), "w") as f:
+        json.dump(out_weights, f, indent=2)
+
+    # Weight ensemble summary (vectorised column reductions, sample std as before;
+    # importance-weighted when the draws carry weights)
+    weight_draws = np.asarray(weight_draws)
+    if sample_weights is None:
+        mean = weight_draws.mean(axis=0)
+        std = weight_draws.std(axis=0, ddof=1) if len(weight_draws) > 1 else np.nan
+    else:
+        mean = np.average(weight_draws, axis=0, weights=sample_weights)
+        std = np.sqrt(np.diag(np.atleast_2d(np.cov(weight_draws, rowvar=False, aweights=sample_weights))))
+    stats = pd.DataFrame({"criterion": criteria, "mean": mean, "std": std})
+    stats.to_csv(os.path.join(OUTPUT_DIR, "weight_ensemble_stats.csv"), index=False)
+
+def main(workers=MC_WORKERS, resume=False):
+    print("Phase4_Advanced_AHP started:", datetime.now())
+    criteria = CRITERIA
+    # 1. Build baseline AHP matrix
+    base_M = build_pairwise_matrix(criteria, PAIRWISE)
+    w_ahp, lambda_max = ahp_weights_from_matrix(base_M)
+    CI, CR = consistency_ratio(base_M, lambda_max)
+    print("Baseline AHP weights:", dict(zip(criteria, w_ahp)))
+    print("Lambda_max:", lambda_max, "CI:", CI, "CR:", CR)
+
+    # 2. Criteria are aligned lazily, one tile at a time
+    cstack = CriteriaStack(criteria, TEMPLATE_PATH, MASK_PATH)
+    meta = cstack.meta
+
+    # Every product is written tile by tile as the engine produces it; a
+    # checkpoint flush closes and reopens the files so finished tiles are on disk
+    exceedance = exceedance_thresholds()
+    paths = product_paths(exceedance)
+    final_map_path = paths["baseline"]
+    writers = {}
+
+    def flush_products():
+        for key in list(writers):
+            writers[key].close()
+            writers[key] = rasterio.open(paths[key], "r+")
+
+    fingerprint = dict(run_fingerprint(cstack, None, exceedance=exceedance), inputs=input_identity(cstack))
+    checkpoint = MonteCarloCheckpoint(os.path.join(OUTPUT_DIR, CHECKPOINT_FILE), fingerprint,
+                                      every_seconds=CHECKPOINT_SECONDS, flush=flush_products)
+    resumed = resume and all(os.path.exists(p) for p in paths.values()) and checkpoint.load()
+    if resume and not resumed:
+        print("No checkpoint of this configuration to resume, starting a fresh run")
+
+    if resumed:
+        ent_w, combined, weight_draws = (checkpoint.run[key] for key in ("ent_w", "combined", "draws"))
+        draw_lambdas = checkpoint.run["lambda_max"]
+        mc_info = checkpoint.run["mc_info"]
+        print(f"Resuming from {checkpoint.path}: {len(checkpoint.done)} tiles already written")
+        print("Combined (hybrid) weights:", dict(zip(criteria, combined)))
+        print(f"Using the run's {mc_info['samples']} weight draws (seed {mc_info['seed']})")
+    else:
+        seed = run_seed(SEED)
+
+        # 3. Entropy weights
+        print("Computing entropy weights...")
+        ent_w = entropy_weights_streaming(cstack, sample_size=ENTROPY_SAMPLE_SIZE, seed=seed)
+        print("Entropy weights:", dict(zip(criteria, ent_w)))
+
+        # 4. Combined baseline weights
+        combined = ALPHA * w_ahp + (1.0 - ALPHA) * ent_w
+        combined = combined / combined.sum()
+        print("Combined (hybrid) weights:", dict(zip(criteria, combined)))
+
+        # 5. Monte Carlo ensemble
+        print(f"Running Monte Carlo with up to {MC_SAMPLES} samples ({SAMPLER} sampler)...")
+        weight_draws, mc_info, draw_lambdas = draw_weight_ensemble(
+            base_M, ent_w, MC_SAMPLES, sigma=PERTURB_SIGMA, alpha=ALPHA, sampler=SAMPLER, seed=seed,
+            tol=MC_TOL, min_samples=MC_MIN_SAMPLES, return_lambda=True, cr_filter=MC_CR_FILTER, cr_max=MC_CR_MAX)
+        print(f"Using {mc_info['samples']} weight draws (converged: {mc_info['converged']})")
+        print_cr_filter(mc_info)
+        checkpoint.start(mc_info, ent_w=ent_w, combined=combined, draws=weight_draws, lambda_max=draw_lambdas)
+    print("Overlay kernel:", "numba" if (HAVE_NUMBA and USE_NUMBA) else "numpy (chunked)")
+    sample_weights = draw_sample_weights(mc_info, draw_lambdas, len(criteria))
+
+    writers.update(open_product_writers(paths, meta, mode="r+" if resumed else "w", thresholds=exceedance))
+
+    def write_products(r0, r1, products):
+        for key, dst in writers.items():
+            write_window(dst, r0, products[key])
+
+    # Weighted sum, soft-mask multiply (1.0 pixels stay the same, 0.0001 pixels
+    # get drastically reduced) and accumulation happen in one fused pass per tile.
+    try:
+        if workers > 1:
+            from .shared_stack import run_ensemble_shared
+            run_ensemble_shared(cstack, weight_draws, write_products, workers, thresholds=exceedance,
+                                baseline_weights=combined, checkpoint=checkpoint, sample_weights=sample_weights)
+        else:
+            run_ensemble(cstack, weight_draws, write_products, thresholds=exceedance, baseline_weights=combined,
+                         checkpoint=checkpoint, sample_weights=sample_weights)
+    finally:
+        for dst in writers.values():
+            dst.close()
+        cstack.close()
+    checkpoint.clear()
+    if "quantiles" in paths:
+        print("Saved ensemble quantile maps:", paths["quantiles"])
+    if "exceedance" in paths:
+        print("Saved exceedance probability maps:", paths["exceedance"])
+
+    save_weight_outputs(criteria, w_ahp, ent_w, combined, lambda_max, CI, CR, weight_draws, mc_info, draw_lambdas,
+                        sample_weights)
+
+    print("Saved baseline hybrid final map:", final_map_path)
+    print("Phase4_Advanced_AHP finished:", datetime.now())
+
+# ---------- Diff-aware runs ----------
+
+def tile_digest(arr):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(np.ma.getdata(arr)).tobytes())
+    h.update(np.ma.getmaskarray(arr).tobytes())
+    return h.hexdigest()
+
+# Checksum every input tile (criteria + mask) and keep the raw min/max of each
+# criterion per tile, so global normalisation bounds can be re-assembled exactly
+# from tile partials when only some tiles are re-read.
+@profiled("checksums")
+def tile_signatures(cstack, tiles):
+    n = len(cstack.names)
+    digests = {name: [] for name in cstack.names}
+    if cstack.mask_path:
+        digests["__mask__"] = []
+    t_lo = np.full((n, len(tiles)), np.inf)
+    t_hi = np.full((n, len(tiles)), -np.inf)
+    for t, (r0, r1) in enumerate(tiles):
+        for i, name in enumerate(cstack.names):
+            arr = cstack.read_raw_tile(name, r0, r1)
+            digests[name].append(tile_digest(arr))
+            vals = arr.compressed()
+            vals = vals[np.isfinite(vals)]
+            if vals.size:
+                t_lo[i, t] = vals.min()
+                t_hi[i, t] = vals.max()
+        if cstack.mask_path:
+            digests["__mask__"].append(tile_digest(cstack.read_mask_tile(r0, r1)))
+    return digests, t_lo, t_hi
+
+# Everything besides the input pixels that changes the products; a different
+# fingerprint means nothing from the previous run can be reused.
+def run_fingerprint(cstack, tiles, thresholds=DEFAULT_THRESHOLDS, exceedance=()):
+    config = {
+        "criteria": {name: cstack.registry[name] for name in cstack.names},
+        "mask": cstack.mask_path,
+        "grid": [cstack.height, cstack.width, list(cstack.transform)[:6], str(cstack.crs)],
+        "tiles": tiles,
+        "pairwise": [[a, b, v] for (a, b), v in PAIRWISE.items()],
+        "alpha": ALPHA,
+        "monte_carlo": [MC_SAMPLES, PERTURB_SIGMA, SAMPLER, SEED, MC_TOL, MC_MIN_SAMPLES, "seedsequence", RNG_BLOCK,
+                        MC_CR_FILTER, MC_CR_MAX],
+        "products": [QUANTILES, QUANTILE_BINS, list(exceedance), EXCEEDANCE_RULE, WEIGHT_EPSILON],
+        "classes": list(thresholds),
+    }
+    return json.loads(json.dumps(config))
+
+# Identity (path, size, mtime) of every raster a run reads, so a checkpoint
+# is not resumed onto a regenerated criterion, mask or template
+def input_identity(cstack, template_path=TEMPLATE_PATH):
+    paths = {name: cstack.registry[name]["path"] for name in cstack.names}
+    paths["_template"] = template_path
+    if cstack.mask_path:
+        paths["_mask"] = cstack.mask_path
+    identity = {}
+    for key, path in paths.items():
+        st = os.stat(path)
+        identity[key] = [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+    return identity
+
+def load_run_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_run_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+# Before/after area per class and the class transition matrix
+def class_change_report(transitions, labels, pixel_area_sqm=PIXEL_AREA_SQM):
+    before = transitions.sum(axis=1)
+    after = transitions.sum(axis=0)
+    to_km2 = pixel_area_sqm / 1_000_000
+    rows = []
+    for c, label in labels.items():
+        rows.append({
+            "class": c, "label": label,
+            "pixels_before": int(before[c]), "pixels_after": int(after[c]),
+            "area_before_km2": before[c] * to_km2, "area_after_km2": after[c] * to_km2,
+            "change_km2": (after[c] - before[c]) * to_km2,
+        })
+    names = [labels[c] for c in sorted(labels)]
+    matrix = pd.DataFrame(transitions, index=[f"before: {l}" for l in names],
+                          columns=[f"after: {l}" for l in names])
+    return pd.DataFrame(rows), matrix
+
+def update_main():
+    """
+    Diff-aware re-run.  Input tiles are checksummed against the previous update
+    run (RUN_STATE_FILE); global quantities (normalisation bounds, entropy sums)
+    are re-assembled from cached per-tile partials, and only tiles whose inputs
+    changed go through the ensemble again.  All tiles are recomputed when a
+    global quantity moves enough to change every pixel.
+    """
+    print("Phase4 diff-aware run started:", datetime.now())
+    criteria = CRITERIA
+    thresholds = load_thresholds()
+    labels = class_labels(thresholds)
+    n_classes = len(labels)
+    exceedance = exceedance_thresholds(thresholds)
+    base_M = build_pairwise_matrix(criteria, PAIRWISE)
+    w_ahp, lambda_max = ahp_weights_from_matrix(base_M)
+    CI, CR = consistency_ratio(base_M, lambda_max)
+
+    cstack = CriteriaStack(criteria, TEMPLATE_PATH, MASK_PATH)
+    meta = cstack.meta
+    tiles = [[r0, r1] for r0, r1 in iter_tiles(cstack.height)]
+    n_tiles = len(tiles)
+    state_path = os.path.join(OUTPUT_DIR, RUN_STATE_FILE)
+    paths = product_paths(exceedance)
+    final_map_path = paths["baseline"]
+    prev = load_run_state(state_path)
+    config = run_fingerprint(cstack, tiles, thresholds, exceedance)
+    if ENTROPY_SAMPLE_SIZE:
+        print("Note: update mode computes entropy weights from all pixels (ENTROPY_SAMPLE_SIZE ignored)")
+
+    # 1. Which tiles changed?
+    print(f"Checksumming {n_tiles} input tiles...")
+    digests, t_lo, t_hi = tile_signatures(cstack, tiles)
+    reason = None
+    if prev is None:
+        reason = "no previous update state"
+    elif prev["config"] != config:
+        reason = "settings or input grid changed"
+    elif SEED is None:
+        reason = "SEED is None, ensemble tiles are not reproducible"
+    elif not all(os.path.exists(p) for p in paths.values()):
+        reason = "previous products missing"
+    if reason is None:
+        changed = [t for t in range(n_tiles)
+                   if any(digests[k][t] != prev["digests"][k][t] for k in digests)]
+        print(f"{len(changed)} of {n_tiles} tiles have changed inputs")
+    else:
+        changed = list(range(n_tiles))
+        print(f"Full run ({reason})")
+
+    # 2. Global normalisation bounds (min/max re-assembled from the per-tile partials)
+    bounds = {}
+    for i, name in enumerate(criteria):
+        spec = cstack.registry[name]
+        if spec["normalize"] and spec["bounds"] == "minmax":
+            bounds[name] = [float(t_lo[i].min()), float(t_hi[i].max())]
+            cstack.set_bounds(name, *bounds[name])
+        elif spec["normalize"]:
+            # Percentile / z-score bounds come from the histogram service,
+            # which rescans a criterion only when its file changed
+            bounds[name] = [float(b) for b in cstack.bounds(name)]
+
+    # 3. Entropy sums; every tile is redone once a normalisation bound moved
+    if reason is None and prev["bounds"] == bounds:
+        S = np.array(prev["entropy_sums"]["S"])
+        T = np.array(prev["entropy_sums"]["T"])
+        m = np.array(prev["entropy_sums"]["m"], dtype=np.int64)
+        redo = changed
+    else:
+        if reason is None:
+            print("Normalisation bounds moved: entropy sums recomputed for every tile")
+        S = np.zeros((len(criteria), n_tiles))
+        T = np.zeros((len(criteria), n_tiles))
+        m = np.zeros(n_tiles, dtype=np.int64)
+        redo = range(n_tiles)
+    with stage("entropy"):
+        for t in redo:
+            S[:, t], T[:, t], m[t] = entropy_tile_sums(cstack, *tiles[t])
+    ent_w = entropy_weights_from_sums(S.sum(axis=1), T.sum(axis=1), int(m.sum()))
+    print("Entropy weights:", dict(zip(criteria, ent_w)))
+
+    # 4. Weights: the previous run's weights are kept while the new hybrid weights
+    # stay within UPDATE_WEIGHT_TOL of them, otherwise every pixel is recomputed
+    combined = ALPHA * w_ahp + (1.0 - ALPHA) * ent_w
+    combined = combined / combined.sum()
+    recompute = changed
+    if reason is None:
+        prev_combined = np.array(prev["weights"]["combined"])
+        drift = float(np.max(np.abs(combined - prev_combined)))
+        bounds_moved = any(prev["bounds"][name] != bounds[name] for name in bounds
+                           if criteria.index(name) in active_criteria(prev_combined))
+        if bounds_moved or drift > UPDATE_WEIGHT_TOL:
+            print(f"Global inputs moved (weight drift {drift:.2e}, bounds moved: {bounds_moved}): "
+                  "recomputing every tile")
+            recompute = list(range(n_tiles))
+        else:
+            print(f"Weight drift {drift:.2e} <= {UPDATE_WEIGHT_TOL:g}: keeping the previous weights")
+            ent_w = np.array(prev["weights"]["entropy"])
+            combined = prev_combined
+    print("Combined (hybrid) weights:", dict(zip(criteria, combined)))
+    weight_draws, mc_info, draw_lambdas = draw_weight_ensemble(
+        base_M, ent_w, MC_SAMPLES, sigma=PERTURB_SIGMA, alpha=ALPHA, sampler=SAMPLER, seed=SEED,
+        tol=MC_TOL, min_samples=MC_MIN_SAMPLES, return_lambda=True, cr_filter=MC_CR_FILTER, cr_max=MC_CR_MAX)
+    print_cr_filter(mc_info)
+    sample_weights = draw_sample_weights(mc_info, draw_lambdas, len(criteria))
+
+    # 5. Recompute the selected tiles; the previous baseline map is kept for the delta
+    prev_map = None
+    if reason is None:
+        writers = open_product_writers(paths, meta, mode="r+")
+        prev_map = writers["baseline"]
+    else:
+        if os.path.exists(final_map_path):
+            prev_path = os.path.join(OUTPUT_DIR, "Final_UHI_Mitigation_Map_Hybrid_previous.tif")
+            os.replace(final_map_path, prev_path)
+            prev_map = rasterio.open(prev_path)
+            if (prev_map.height, prev_map.width) != (cstack.height, cstack.width):
+                print("Previous map is on a different grid, no delta map written")
+                prev_map.close()
+                prev_map = None
+        writers = open_product_writers(paths, meta, thresholds=exceedance)
+    delta_path = os.path.join(OUTPUT_DIR, "Final_UHI_Delta_Map.tif")
+    delta_dst = open_raster_writer(delta_path, meta) if prev_map is not None else None
+
+    class_counts = (np.array(prev["class_counts"], dtype=np.int64) if reason is None
+                    else np.zeros((n_tiles, n_classes), dtype=np.int64))
+    transitions = np.zeros((n_classes, n_classes), dtype=np.int64)
+    tile_index = {r0: t for t, (r0, r1) in enumerate(tiles)}
+
+    def write_products(r0, r1, products):
+        t = tile_index[r0]
+        new = products["baseline"]
+        new_cls = classify_array(new, thresholds)
+        if prev_map is not None:
+            old = prev_map.read(1, window=Window(0, r0, cstack.width, r1 - r0), out_dtype='float32')
+            write_window(delta_dst, r0, new - old)
+            pair = classify_array(old, thresholds).astype(np.int64) * n_classes + new_cls
+            transitions[...] += np.bincount(pair.ravel(), minlength=n_classes**2).reshape(n_classes, n_classes)
+        class_counts[t] = np.bincount(new_cls.ravel(), minlength=n_classes)
+        for key, dst in writers.items():
+            write_window(dst, r0, products[key])
+
+    try:
+        if recompute:
+            run_ensemble(cstack, weight_draws, write_products, thresholds=exceedance, baseline_weights=combined,
+                         tiles=[tiles[t] for t in recompute], sample_weights=sample_weights)
+        # Unchanged tiles: zero delta, same classes as before
+        skipped = sorted(set(range(n_tiles)) - set(recompute))
+        if delta_dst is not None:
+            for t in skipped:
+                r0, r1 = tiles[t]
+                write_window(delta_dst, r0, np.zeros((r1 - r0, cstack.width), dtype='float32'))
+        for t in skipped:
+            transitions[np.diag_indices(n_classes)] += class_counts[t]
+    finally:
+        for dst in writers.values():
+            dst.close()
+        if delta_dst is not None:
+            delta_dst.close()
+        if prev_map is not None and reason is not None:
+            prev_map.close()
+        cstack.close()
+    print(f"Recomputed {len(recompute)} of {n_tiles} tiles")
+
+    save_weight_outputs(criteria, w_ahp, ent_w, combined, lambda_max, CI, CR, weight_draws, mc_info, draw_lambdas,
+                        sample_weights)
+    save_run_state(state_path, {
+        "config": config,
+        "digests": digests,
+        "bounds": bounds,
+        "entropy_sums": {"S": S.tolist(), "T": T.tolist(), "m": m.tolist()},
+        "weights": {"entropy": ent_w.tolist(), "combined": combined.tolist()},
+        "class_counts": class_counts.tolist(),
+        "updated": datetime.now().isoformat(),
+    })
+
+    if delta_dst is not None:
+        report, matrix = class_change_report(transitions, labels)
+        report.to_csv(os.path.join(OUTPUT_DIR, "uhi_class_area_change.csv"), index=False)
+        matrix.to_csv(os.path.join(OUTPUT_DIR, "uhi_class_transitions.csv"))
+        print("\n--- 📊 AREA CHANGE BY CLASS ---")
+        print(report.to_string(index=False))
+        print("Saved delta map:", delta_path)
+    else:
+        print("No previous Final_UHI_Mitigation_Map_Hybrid.tif, skipping delta map and change report")
+    print("Saved baseline hybrid final map:", final_map_path)
+    print("Phase4 diff-aware run finished:", datetime.now())
+
+# ---------- Global sensitivity analysis ----------
+# Batched AHP weights for a stack of pairwise matrices (B, n, n)
+def ahp_weights_batch(Ms):
+    vals, vecs = np.linalg.eig(Ms)
+    vals = np.real(vals)
+    idx = np.argmax(vals, axis=1)
+    rows = np.arange(Ms.shape[0])
+    w = np.abs(np.real(vecs[rows, :, idx]))
+    w = w / w.sum(axis=1, keepdims=True)
+    return w, vals[rows, idx]
+
+# Map unit-cube samples (B, k) to the factors ALPHA, each PAIRWISE entry and PERTURB_SIGMA
+def sa_factor_names(comparisons):
+    return ["ALPHA"] + [f"PAIRWISE[{a}/{b}]" for a, b in comparisons] + ["PERTURB_SIGMA"]
+
+def sa_scale_factors(U, comparisons):
+    n_pw = len(comparisons)
+    alpha = SA_ALPHA_RANGE[0] + U[:, 0] * (SA_ALPHA_RANGE[1] - SA_ALPHA_RANGE[0])
+    mult = SA_PAIRWISE_FACTOR ** (2.0 * U[:, 1:1 + n_pw] - 1.0)
+    sigma = SA_SIGMA_RANGE[0] + U[:, 1 + n_pw] * (SA_SIGMA_RANGE[1] - SA_SIGMA_RANGE[0])
+    return alpha, mult, sigma
+
+# Model output of one parameter set in "weight space".  Every per-pixel output
+# is linear in this vector g: score = x . w, ensemble variance = x^T Cov(w) x,
+# so Y_p = phi(x_p) . g(theta) and no raster is touched here.
+def sa_weight_space_outputs(U, criteria, comparisons, ent_w, target, Z=None):
+    n = len(criteria)
+    idx = {c: i for i, c in enumerate(criteria)}
+    alpha, mult, sigma = sa_scale_factors(U, comparisons)
+    B = U.shape[0]
+    Ms = np.repeat(build_pairwise_matrix(criteria, comparisons)[None], B, axis=0)
+    for k, (a, b) in enumerate(comparisons):
+        i, j = idx[a], idx[b]
+        Ms[:, i, j] *= mult[:, k]
+        Ms[:, j, i] = 1.0 / Ms[:, i, j]
+    if target == "score":
+        w, _ = ahp_weights_batch(Ms)
+        comb = alpha[:, None] * w + (1.0 - alpha[:, None]) * ent_w
+        return comb / comb.sum(axis=1, keepdims=True)
+    # "variance": perturb every parameter set with the same draws Z (common random numbers)
+    iu, ju = np.triu_indices(n, k=1)
+    n_mc = Z.shape[0]
+    upper = Ms[:, iu, ju][:, None, :] * np.exp(sigma[:, None, None] * Z[None])
+    P = np.ones((B, n_mc, n, n))
+    P[:, :, iu, ju] = upper
+    P[:, :, ju, iu] = 1.0 / upper
+    w, _ = ahp_weights_batch(P.reshape(B * n_mc, n, n))
+    w = w.reshape(B, n_mc, n)
+    comb = alpha[:, None, None] * w + (1.0 - alpha[:, None, None]) * ent_w
+    comb = comb / comb.sum(axis=2, keepdims=True)
+    dev = comb - comb.mean(axis=1, keepdims=True)
+    cov = np.einsum('bka,bkc->bac', dev, dev) / (n_mc - 1)
+    ia, ic = np.triu_indices(n)
+    return cov[:, ia, ic]
+
+# Pixel features phi(x) matching sa_weight_space_outputs (tile is (n_criteria, n_pix))
+def sa_pixel_features(tile, target):
+    if target == "score":
+        return tile.astype('float64')
+    n = tile.shape[0]
+    ia, ic = np.triu_indices(n)
+    coef = np.where(ia == ic, 1.0, 2.0)
+    return coef[:, None] * tile[ia].astype('float64') * tile[ic].astype('float64')
+
+# Saltelli design -> (F x F) matrices whose quadratic forms in phi give the
+# total variance and the first/total-order partial variances of every pixel:
+#   V_i  = mean(f(B) * (f(AB_i) - f(A)))        (Saltelli 2010)
+#   VT_i = mean((f(A) - f(AB_i))^2) / 2         (Jansen)
+def sa_variance_matrices(G_A, G_B, G_AB):
+    N = G_A.shape[0]
+    GAB = np.vstack([G_A, G_B])
+    V = np.cov(GAB, rowvar=False, bias=True)
+    first, total = [], []
+    for G_i in G_AB:
+        Q = G_B.T @ (G_i - G_A) / N
+        first.append(0.5 * (Q + Q.T))
+        D = G_A - G_i
+        total.append(D.T @ D / (2.0 * N))
+    return np.atleast_2d(V), np.array(first), np.array(total)
+
+def quadratic_form(phi, M):
+    return np.einsum('fp,fp->p', phi, M @ phi)
+
+def sensitivity_main(n_samples=SA_SAMPLES, target=SA_TARGET):
+    print("Phase4 sensitivity analysis started:", datetime.now())
+    from scipy.stats import norm, qmc
+    criteria = CRITERIA
+    comparisons = PAIRWISE
+    names = sa_factor_names(comparisons)
+    k = len(names)
+
+    # Criteria and entropy weights are set up once for the whole design
+    cstack = CriteriaStack(criteria, TEMPLATE_PATH, MASK_PATH)
+    meta = cstack.meta
+    ent_w = entropy_weights_streaming(cstack, sample_size=ENTROPY_SAMPLE_SIZE)
+    print("Entropy weights:", dict(zip(criteria, ent_w)))
+
+    # Saltelli design from a 2k-dimensional scrambled Sobol' sequence; N is rounded
+    # up to a power of 2, the block size that keeps the points balanced
+    if n_samples != 1 << base2_exponent(n_samples):
+        n_samples = 1 << base2_exponent(n_samples)
+        print(f"Saltelli base sample size rounded up to {n_samples} (a power of 2)")
+    base = qmc.Sobol(d=2 * k, scramble=True, seed=SEED).random_base2(base2_exponent(n_samples))
+    A, B = base[:, :k], base[:, k:]
+    Z = None
+    if target == "variance":
+        n = len(criteria)
+        Z = norm.ppf(np.clip(qmc.Sobol(d=n * (n - 1) // 2, scramble=True, seed=SEED).random_base2(
+                             base2_exponent(SA_MC_DRAWS)), 1e-12, 1.0 - 1e-12))
+    G_A = sa_weight_space_outputs(A, criteria, comparisons, ent_w, target, Z)
+    G_B = sa_weight_space_outputs(B, criteria, comparisons, ent_w, target, Z)
+    G_AB = []
+    for i in range(k):
+        AB = A.copy()
+        AB[:, i] = B[:, i]
+        G_AB.append(sa_weight_space_outputs(AB, criteria, comparisons, ent_w, target, Z))
+    V, first_M, total_M = sa_variance_matrices(G_A, G_B, G_AB)
+    print(f"Evaluated {n_samples * (k + 2)} parameter sets ({target} target)")
+
+    # One raster pass: per-pixel indices are ratios of quadratic forms in phi(x_p).
+    # The soft mask scales every variance of a pixel by mask^2, so it cancels in
+    # the per-pixel ratios; the global indices weight pixels by it.
+    first_path = os.path.join(OUTPUT_DIR, "Final_UHI_Sensitivity_first_order.tif")
+    total_path = os.path.join(OUTPUT_DIR, "Final_UHI_Sensitivity_total_order.tif")
+    first_dst = open_raster_writer(first_path, meta, names)
+    total_dst = open_raster_writer(total_path, meta, names)
+    height, width = cstack.height, cstack.width
+    n_feat = V.shape[0]
+    Phi = np.zeros((n_feat, n_feat), dtype='float64')
+    try:
+        for r0, r1 in iter_tiles(height):
+            n_pix = (r1 - r0) * width
+            phi = sa_pixel_features(cstack.read_tile(r0, r1).reshape(-1, n_pix), target)
+            v = quadratic_form(phi, V)
+            ok = v > 1e-12
+            first_t = np.zeros((k, n_pix), dtype='float32')
+            total_t = np.zeros((k, n_pix), dtype='float32')
+            for i in range(k):
+                first_t[i] = np.divide(quadratic_form(phi, first_M[i]), v, out=np.zeros(n_pix), where=ok)
+                total_t[i] = np.divide(quadratic_form(phi, total_M[i]), v, out=np.zeros(n_pix), where=ok)
+            write_window(first_dst, r0, first_t.reshape(k, r1 - r0, width))
+            write_window(total_dst, r0, total_t.reshape(k, r1 - r0, width))
+            m_tile = cstack.read_mask_tile(r0, r1)
+            wts = m_tile.reshape(n_pix).astype('float64') ** 2 if m_tile is not None else np.ones(n_pix)
+            Phi += (phi * wts) @ phi.T
+    finally:
+        first_dst.close()
+        total_dst.close()
+        cstack.close()
+
+    # Global (variance-weighted over all pixels) indices: trace(M Phi) / trace(V Phi)
+    v_total = np.trace(V @ Phi)
+    rows = []
+    for i, name in enumerate(names):
+        s1 = float(np.trace(first_M[i] @ Phi) / v_total) if v_total > 0 else 0.0
+        st = float(np.trace(total_M[i] @ Phi) / v_total) if v_total > 0 else 0.0
+        rows.append({"factor": name, "first_order": s1, "total_order": st})
+        print(f"{name:<32} S1 = {s1:.4f}   ST = {st:.4f}")
+
+    pd.DataFrame(rows).to_csv(os.path.join(OUTPUT_DIR, "uhi_sensitivity_indices.csv"), index=False)
+    with open(os.path.join(OUTPUT_DIR, "uhi_sensitivity_indices.json"), "w") as f:
+        json.dump({
+            "target": target,
+            "base_samples": n_samples,
+            "evaluations": n_samples * (k + 2),
+            "seed": SEED,
+            "ranges": {"alpha": SA_ALPHA_RANGE, "pairwise_factor": SA_PAIRWISE_FACTOR,
+                       "sigma": SA_SIGMA_RANGE},
+            "indices": rows,
+        }, f, indent=2)
+    print("Saved per-pixel index maps:", first_path, total_path)
+    print("Phase4 sensitivity analysis finished:", datetime.now())
+
+# ---------- Scenario batch runner ----------
+# Scenario file (JSON, or YAML if PyYAML is installed):
+# {"scenarios": [
+#    {"name": "hybrid"},                                  # defaults: ALPHA, PAIRWISE
+#    {"name": "ahp_only", "method": "ahp"},
+#    {"name": "entropy_only", "method": "entropy"},
+#    {"name": "alpha_0.5", "alpha": 0.5},
+#    {"name": "heat_first", "pairwise": {"LST/NDVI": 5, "LST/Population": 3}},
+#    {"name": "fixed", "weights": {"LST": 0.5, "NDVI": 0.2, "Population": 0.3}}
+# ]}
+def load_scenarios(path, criteria=None):
+    criteria = CRITERIA if criteria is None else criteria
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            import yaml
+            doc = yaml.safe_load(f)
+        else:
+            doc = json.load(f)
+    scenarios = doc["scenarios"] if isinstance(doc, dict) else doc
+    names = [sc["name"] for sc in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique")
+    for sc in scenarios:
+        if "weights" in sc:
+            w = [float(sc["weights"].get(c, 0.0)) for c in criteria]
+            if min(w) < 0 or sum(w) <= 0:
+                raise ValueError(f"Scenario {sc['name']!r}: weights must be >= 0 and not all 0 "
+                                 f"over the criteria {list(criteria)} (got {sc['weights']})")
+    return scenarios
+
+# Weight vector (and AHP consistency) of one scenario
+def scenario_weights(scenario, criteria, ent_w):
+    if "weights" in scenario:
+        w = np.array([float(scenario["weights"].get(c, 0.0)) for c in criteria])
+        return w / w.sum(), None
+    method = scenario.get("method", "hybrid")
+    alpha = {"ahp": 1.0, "entropy": 0.0}.get(method, scenario.get("alpha", ALPHA))
+    comparisons = dict(PAIRWISE)
+    for key, v in scenario.get("pairwise", {}).items():
+        a, b = key.split("/")
+        comparisons.pop((b, a), None)
+        comparisons[(a, b)] = float(v)
+    M = build_pairwise_matrix(criteria, comparisons)
+    w_ahp, lambda_max = ahp_weights_from_matrix(M)
+    CI, CR = consistency_ratio(M, lambda_max)
+    combined = alpha * w_ahp + (1.0 - alpha) * ent_w
+    return combined / combined.sum(), (CR if alpha > 0 else None)
+
+def _scenario_tile(tile, m_tile, W, r0, r1):
+    X = tile.reshape(tile.shape[0], -1).T      # (n_pix, n_criteria)
+    S = X @ W                                  # (n_pix, n_scenarios)
+    if m_tile is not None:
+        S *= m_tile.reshape(-1, 1)
+    return r0, r1, S, m_tile
+
+def batch_main(scenario_path):
+    print("Phase4 scenario batch started:", datetime.now())
+    from concurrent.futures import ThreadPoolExecutor
+    criteria = CRITERIA
+    scenarios = load_scenarios(scenario_path)
+
+    # Criteria are aligned and entropy-weighted once for all scenarios
+    cstack = CriteriaStack(criteria, TEMPLATE_PATH, MASK_PATH)
+    meta = cstack.meta
+    ent_w = entropy_weights_streaming(cstack, sample_size=ENTROPY_SAMPLE_SIZE)
+
+    weights, crs = [], []
+    for sc in scenarios:
+        w, cr = scenario_weights(sc, criteria, ent_w)
+        weights.append(w)
+        crs.append(cr)
+        print(f"Scenario {sc['name']}: {dict(zip(criteria, np.round(w, 4)))}")
+    W = np.array(weights, dtype='float32').T                # (n_criteria, n_scenarios)
+    n_scen = W.shape[1]
+    # Criteria no scenario gives a non-negligible weight are never read
+    active = active_criteria(W.T)
+    names = [criteria[i] for i in active]
+    W_active = W[active]
+
+    out_dir = os.path.join(OUTPUT_DIR, SCENARIO_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    out_meta = meta.copy()
+    out_meta.update(dtype='float32', count=1, compress='lzw')
+    dsts = [rasterio.open(os.path.join(out_dir, f"{sc['name']}.tif"), 'w', **out_meta) for sc in scenarios]
+
+    # Streaming comparison statistics over valid (unmasked) pixels, as in phase6
+    thresholds = exceedance_thresholds()
+    n_valid = np.zeros(n_scen)
+    s1 = np.zeros(n_scen)
+    s2 = np.zeros(n_scen)
+    s_ref = np.zeros(n_scen)
+    vmin = np.full(n_scen, np.inf)
+    vmax = np.full(n_scen, -np.inf)
+    above = np.zeros((len(thresholds), n_scen))
+    cross = np.zeros(n_scen)        # sum of score * score of the first scenario
+    ref_sq = 0.0
+
+    height, width = cstack.height, cstack.width
+    tiles = list(iter_tiles(height))
+    try:
+        with ThreadPoolExecutor(max_workers=SCENARIO_WORKERS) as ex:
+            for b in range(0, len(tiles), SCENARIO_WORKERS):
+                # Reads stay on this thread (dataset handles are not thread-safe)
+                futures = [ex.submit(_scenario_tile, cstack.read_tile(r0, r1, names),
+                                     cstack.read_mask_tile(r0, r1), W_active, r0, r1)
+                           for r0, r1 in tiles[b:b + SCENARIO_WORKERS]]
+                for fut in futures:
+                    r0, r1, S, m_tile = fut.result()
+                    win = Window(0, r0, width, r1 - r0)
+                    for j, dst in enumerate(dsts):
+                        dst.write(S[:, j].reshape(r1 - r0, width), 1, window=win)
+                    valid = S[:, 0] >= 0.1 if m_tile is None else m_tile.reshape(-1) > 0.5
+                    V = S[valid].astype('float64')
+                    if V.shape[0] == 0:
+                        continue
+                    n_valid += V.shape[0]
+                    s1 += V.sum(axis=0)
+                    s2 += (V * V).sum(axis=0)
+                    vmin = np.minimum(vmin, V.min(axis=0))
+                    vmax = np.maximum(vmax, V.max(axis=0))
+                    for t, thr in enumerate(thresholds):
+                        above[t] += (V >= thr).sum(axis=0)
+                    cross += V[:, 0] @ V
+                    s_ref += V[:, 0].sum()
+                    ref_sq += float(V[:, 0] @ V[:, 0])
+    finally:
+        for dst in dsts:
+            dst.close()
+        cstack.close()
+
+    # Comparison table
+    n = np.maximum(n_valid, 1)
+    mean = s1 / n
+    std = np.sqrt(np.maximum(s2 / n - mean * mean, 0.0))
+    cov_ref = cross / n - mean[0] * mean
+    pearson = np.divide(cov_ref, std[0] * std, out=np.zeros(n_scen), where=(std * std[0]) > 0)
+    rows = []
+    for j, sc in enumerate(scenarios):
+        row = {"scenario": sc["name"], "method": "weights" if "weights" in sc else sc.get("method", "hybrid")}
+        row.update({f"w_{c}": float(W[i, j]) for i, c in enumerate(criteria)})
+        row.update({"CR": crs[j], "mean": mean[j], "std": std[j], "min": vmin[j], "max": vmax[j]})
+        for t, thr in enumerate(thresholds):
+            row[f"area_km2_ge_{thr:g}"] = above[t, j] * PIXEL_AREA_SQM / 1_000_000
+        row[f"pearson_vs_{scenarios[0]['name']}"] = pearson[j]
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    table_path = os.path.join(OUTPUT_DIR, "scenario_comparison.csv")
+    table.to_csv(table_path, index=False)
+    print(table.to_string(index=False))
+    print(f"Saved {n_scen} scenario maps to {out_dir} and comparison table {table_path}")
+    print("Phase4 scenario batch finished:", datetime.now())
+
+# Options of the default `run` command.  They are accepted without the command
+# too (`python -m uhi run --workers 4`); on the subparser they default to
+# SUPPRESS so `run` does not reset values given before it.
+def add_run_options(parser, defaults=True):
+    parser.add_argument("--workers", type=int, default=MC_WORKERS if defaults else argparse.SUPPRESS,
+                        help="Monte Carlo worker processes sharing one in-memory raster stack")
+    parser.add_argument("--resume", action="store_true", default=False if defaults else argparse.SUPPRESS,
+                        help=f"continue an interrupted run from {CHECKPOINT_FILE} (same settings and inputs)")
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Phase 4: hybrid AHP + Entropy weighting and Monte Carlo ensemble")
+    add_run_options(parser)
+    sub = parser.add_subparsers(dest="command")
+    rn = sub.add_parser("run", help="baseline map + Monte Carlo ensemble (default)")
+    add_run_options(rn, defaults=False)
+    sa = sub.add_parser("sensitivity", help="Sobol' indices over ALPHA, PAIRWISE entries and PERTURB_SIGMA")
+    sa.add_argument("--samples", type=int, default=SA_SAMPLES, help="Saltelli base sample size N")
+    sa.add_argument("--target", choices=["score", "variance"], default=SA_TARGET,
+                    help="analyse the hybrid score map or the ensemble variance map")
+    bt = sub.add_parser("batch", help="evaluate several weighting scenarios in one pass")
+    bt.add_argument("scenarios", help="scenario file (.json, or .yaml with PyYAML)")
+    sub.add_parser("update", help="diff-aware re-run: only tiles whose inputs changed are recomputed")
+    parser.epilog = ("--profile[=PREFIX] writes a per-stage time / memory and raster I/O report "
+                     "(profile_phase4.json + .folded); --no-tracemalloc skips allocation tracing")
+    argv = ["phase4"] + (sys.argv[1:] if argv is None else list(argv))
+    profile_from_argv("phase4", argv)
+    args = parser.parse_args(argv[1:])
+    if args.command == "sensitivity":
+        sensitivity_main(n_samples=args.samples, target=args.target)
+    elif args.command == "batch":
+        batch_main(args.scenarios)
+    elif args.command == "update":
+        update_main()
+    else:
+        main(workers=args.workers, resume=args.resume)
+
+if __name__ == "__main__":
+    cli()
\ No newline at end of file
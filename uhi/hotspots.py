@@ -0,0 +1,277 @@
+"""
+Phase 6b: Hotspot Index
+-----------------------
+Runs after phase6. It turns the class raster into something you can query:
+
+- Connected clusters of the two highest classes (Critical + Extreme, class >= 3
+  with the default thresholds; the class count follows the scheme the raster
+  was classified with), labelled with scipy.ndimage.label (8-connected by default)
+- Per cluster: polygon, centroid, area (ha), peak / mean score and where the
+  peak is, pixel count of the highest class
+  -> hotspot_clusters.geojson + hotspot_clusters.csv
+- A KD-tree index over the cluster centroids and over every hotspot pixel
+  (hotspot_index.npz). Coordinates are metres on a local equirectangular
+  projection, so distances are in metres. Each query takes logarithmic time:
+    "nearest Extreme pixel to this school"   -> nearest --min-class 4   (the top class)
+    "hotspots within 1 km"                   -> within --radius 1000
+    "clusters larger than 1 ha"              -> clusters --min-ha 1
+
+Usage:
+    python -m uhi hotspots build
+    python -m uhi hotspots nearest --lat 12.9719 --lon 77.5772 --min-class 4
+    python -m uhi hotspots within --lat 12.9719 --lon 77.5772 --radius 1000
+    python -m uhi hotspots clusters --min-ha 1
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+import rasterio
+from rasterio.features import shapes
+from rasterio.transform import xy
+
+from .classify import DEFAULT_THRESHOLDS, class_labels, raster_thresholds
+
+# === Configuration ===
+CLASS_MAP = "UHI_Priority_Classes.tif"     # phase6 output
+SCORE_MAP = "Final_Map_Clipped.tif"        # phase6 input (peak / mean scores)
+INDEX_PATH = "hotspot_index.npz"
+CLUSTERS_GEOJSON = "hotspot_clusters.geojson"
+CLUSTERS_CSV = "hotspot_clusters.csv"
+MIN_CLASS = None              # None = the two highest classes (3 = Critical, 4 = Extreme with 3 thresholds)
+CONNECTIVITY = 8              # 4 or 8 neighbours
+PIXEL_AREA_SQM = 30 * 30      # same 30 m pixel estimate as phase6
+EARTH_RADIUS_M = 6371008.8
+
+# lon/lat degrees -> local metres (equirectangular around lat0; fine at city scale)
+def to_local_xy(lon, lat, lat0):
+    k = math.pi / 180.0 * EARTH_RADIUS_M
+    return np.column_stack([np.asarray(lon, float) * k * math.cos(math.radians(lat0)),
+                            np.asarray(lat, float) * k])
+
+def build_index(class_map=CLASS_MAP, score_map=SCORE_MAP, min_class=MIN_CLASS, connectivity=CONNECTIVITY):
+    import pandas as pd
+    from scipy import ndimage
+    print(f"Reading {class_map}...")
+    with rasterio.open(class_map) as src:
+        classes = src.read(1)
+        transform, crs = src.transform, src.crs
+        thresholds = raster_thresholds(src)
+    top_class = len(thresholds) + 1
+    if min_class is None:
+        min_class = max(top_class - 1, 1)
+    scores = None
+    try:
+        with rasterio.open(score_map) as src:
+            if src.shape == classes.shape:
+                scores = src.read(1).astype("float32")
+            else:
+                print(f"⚠️ {score_map} is on a different grid, peak scores skipped")
+    except rasterio.errors.RasterioIOError:
+        print(f"⚠️ {score_map} not found, peak scores skipped")
+
+    # 1. Connected components of class >= min_class
+    hot = classes >= min_class
+    structure = np.ones((3, 3), dtype=bool) if connectivity == 8 else ndimage.generate_binary_structure(2, 1)
+    labels, n = ndimage.label(hot, structure=structure)
+    print(f"🔥 {n} hotspot clusters ({int(hot.sum())} pixels of class >= {min_class})")
+    if n == 0:
+        # Empty outputs, so queries do not answer from the clusters of an older map
+        pd.DataFrame(columns=["cluster_id", "pixels", "area_ha", "centroid_lat", "centroid_lon",
+                              "extreme_pixels"]).to_csv(CLUSTERS_CSV, index=False)
+        with open(CLUSTERS_GEOJSON, "w") as f:
+            json.dump({"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": str(crs)}},
+                       "features": []}, f)
+        _, lat0 = xy(transform, classes.shape[0] / 2, classes.shape[1] / 2)
+        none_xy = np.empty((0, 2), dtype="float64")
+        np.savez(INDEX_PATH, lat0=float(lat0), thresholds=np.asarray(thresholds, dtype="float64"),
+                 pixel_xy=none_xy, pixel_lonlat=none_xy, pixel_class=np.empty(0, "uint8"),
+                 pixel_cluster=np.empty(0, "int32"), pixel_score=np.empty(0, "float32"),
+                 cluster_id=np.empty(0, "int64"), cluster_xy=none_xy, cluster_area_ha=np.empty(0, "float64"))
+        print(f"Nothing to index: wrote empty {CLUSTERS_CSV}, {CLUSTERS_GEOJSON} and {INDEX_PATH}")
+        return
+    ids = np.arange(1, n + 1)
+
+    # 2. Per-cluster statistics
+    pix = np.bincount(labels.ravel(), minlength=n + 1)[1:]
+    rows, cols = np.nonzero(labels)
+    lab = labels[rows, cols]
+    cy = np.bincount(lab, weights=rows, minlength=n + 1)[1:] / pix
+    cx = np.bincount(lab, weights=cols, minlength=n + 1)[1:] / pix
+    c_lon, c_lat = xy(transform, cy, cx)
+    extreme = np.bincount(lab, weights=(classes[rows, cols] == top_class), minlength=n + 1)[1:].astype(int)
+    table = pd.DataFrame({
+        "cluster_id": ids,
+        "pixels": pix,
+        "area_ha": pix * PIXEL_AREA_SQM / 10_000,
+        "centroid_lat": np.asarray(c_lat),
+        "centroid_lon": np.asarray(c_lon),
+        "extreme_pixels": extreme,
+    })
+    if scores is not None:
+        peak_pos = ndimage.maximum_position(scores, labels, ids)
+        peak_r = np.array([p[0] for p in peak_pos])
+        peak_c = np.array([p[1] for p in peak_pos])
+        p_lon, p_lat = xy(transform, peak_r, peak_c)
+        table["peak_score"] = ndimage.maximum(scores, labels, ids)
+        table["mean_score"] = ndimage.mean(scores, labels, ids)
+        table["peak_lat"], table["peak_lon"] = np.asarray(p_lat), np.asarray(p_lon)
+    table = table.sort_values("area_ha", ascending=False)
+    table.to_csv(CLUSTERS_CSV, index=False)
+
+    # 3. Cluster polygons (one MultiPolygon per label)
+    polys = {}
+    for geom, value in shapes(labels.astype("int32"), mask=hot, transform=transform,
+                              connectivity=4 if connectivity == 4 else 8):
+        polys.setdefault(int(value), []).append(geom["coordinates"])
+    records = table.to_dict("records")
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "MultiPolygon", "coordinates": polys.get(int(r["cluster_id"]), [])},
+        "properties": {k: (v.item() if hasattr(v, "item") else v) for k, v in r.items()},
+    } for r in records]
+    with open(CLUSTERS_GEOJSON, "w") as f:
+        json.dump({"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": str(crs)}},
+                   "features": features}, f)
+
+    # 4. Point sets for the KD-trees: hotspot pixel centres and cluster centroids
+    p_lon, p_lat = xy(transform, rows, cols)
+    lat0 = float(np.mean(c_lat))
+    np.savez(INDEX_PATH,
+             lat0=lat0,
+             thresholds=np.asarray(thresholds, dtype="float64"),
+             pixel_xy=to_local_xy(p_lon, p_lat, lat0).astype("float64"),
+             pixel_lonlat=np.column_stack([p_lon, p_lat]),
+             pixel_class=classes[rows, cols].astype("uint8"),
+             pixel_cluster=lab.astype("int32"),
+             pixel_score=scores[rows, cols] if scores is not None else np.full(rows.size, np.nan, "float32"),
+             cluster_id=table["cluster_id"].to_numpy(),
+             cluster_xy=to_local_xy(table["centroid_lon"], table["centroid_lat"], lat0),
+             cluster_area_ha=table["area_ha"].to_numpy())
+    big = int((table["area_ha"] >= 1).sum())
+    print(f"✅ {len(table)} clusters ({big} larger than 1 ha) → {CLUSTERS_CSV}, {CLUSTERS_GEOJSON}")
+    print(f"✅ KD-tree index over {rows.size} pixels and {n} centroids → {INDEX_PATH}")
+
+class HotspotIndex:
+    """KD-trees over hotspot pixels and cluster centroids (built from hotspot_index.npz)."""
+
+    def __init__(self, path=INDEX_PATH, clusters_csv=CLUSTERS_CSV):
+        import pandas as pd
+        from scipy.spatial import cKDTree
+        data = np.load(path)
+        self.lat0 = float(data["lat0"])
+        thresholds = data["thresholds"] if "thresholds" in data else DEFAULT_THRESHOLDS  # older indexes
+        self.top_class = len(thresholds) + 1
+        self.labels = class_labels(thresholds)
+        self.pixel_lonlat = data["pixel_lonlat"]
+        self.pixel_class = data["pixel_class"]
+        self.pixel_cluster = data["pixel_cluster"]
+        self.pixel_score = data["pixel_score"]
+        self.cluster_id = data["cluster_id"]
+        self.cluster_area_ha = data["cluster_area_ha"]
+        self.clusters = pd.read_csv(clusters_csv).set_index("cluster_id")
+        pixel_xy = data["pixel_xy"]
+        self.cluster_tree = cKDTree(data["cluster_xy"])
+        # One tree per minimum class, so "nearest Extreme pixel" never scans Critical ones
+        self.pixel_trees = {}
+        for c in np.unique(self.pixel_class):
+            sel = np.flatnonzero(self.pixel_class >= c)
+            self.pixel_trees[int(c)] = (cKDTree(pixel_xy[sel]), sel)
+
+    def _tree(self, min_class):
+        if min_class is None:
+            min_class = max(self.top_class - 1, 1)
+        eligible = [c for c in self.pixel_trees if c >= min_class]
+        if not eligible:
+            return None, None
+        return self.pixel_trees[min(eligible)]
+
+    def _pixel_record(self, i, dist):
+        return {"distance_m": round(float(dist), 1),
+                "lat": float(self.pixel_lonlat[i, 1]), "lon": float(self.pixel_lonlat[i, 0]),
+                "class": self.labels.get(int(self.pixel_class[i]), int(self.pixel_class[i])),
+                "score": None if np.isnan(self.pixel_score[i]) else round(float(self.pixel_score[i]), 3),
+                "cluster_id": int(self.pixel_cluster[i])}
+
+    def nearest(self, lat, lon, min_class=MIN_CLASS, k=1):
+        """k nearest hotspot pixels of class >= min_class."""
+        tree, sel = self._tree(min_class)
+        if tree is None:
+            return []
+        k = min(k, tree.n)
+        dist, idx = tree.query(to_local_xy([lon], [lat], self.lat0)[0], k=k)
+        dist, idx = np.atleast_1d(dist), np.atleast_1d(idx)
+        return [self._pixel_record(sel[i], d) for d, i in zip(dist, idx)]
+
+    def within(self, lat, lon, radius_m, min_class=MIN_CLASS, min_area_ha=0.0):
+        """Clusters with a pixel of class >= min_class within radius_m, nearest first."""
+        import pandas as pd
+        tree, sel = self._tree(min_class)
+        if tree is None:
+            return pd.DataFrame()
+        p = to_local_xy([lon], [lat], self.lat0)[0]
+        hits = sel[tree.query_ball_point(p, r=radius_m)]
+        if hits.size == 0:
+            return pd.DataFrame()
+        d = np.hypot(*(tree.data[np.searchsorted(sel, hits)] - p).T)
+        near = pd.DataFrame({"cluster_id": self.pixel_cluster[hits], "distance_m": d})
+        near = near.groupby("cluster_id")["distance_m"].min().round(1)
+        out = self.clusters.loc[near.index].assign(distance_m=near)
+        return out[out["area_ha"] >= min_area_ha].sort_values("distance_m").reset_index()
+
+    def nearest_clusters(self, lat, lon, k=5):
+        """k clusters with the nearest centroids."""
+        k = min(k, self.cluster_tree.n)
+        if k == 0:
+            return self.clusters.iloc[:0].reset_index()
+        dist, idx = self.cluster_tree.query(to_local_xy([lon], [lat], self.lat0)[0], k=k)
+        ids = self.cluster_id[np.atleast_1d(idx)]
+        return self.clusters.loc[ids].assign(centroid_distance_m=np.round(np.atleast_1d(dist), 1)).reset_index()
+
+    def large_clusters(self, min_area_ha=1.0):
+        return self.clusters[self.clusters["area_ha"] >= min_area_ha].reset_index()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hotspot clusters and nearest-hotspot queries")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="label clusters and build the index")
+    b.add_argument("--classes", default=CLASS_MAP)
+    b.add_argument("--scores", default=SCORE_MAP)
+    b.add_argument("--min-class", type=int, default=MIN_CLASS)
+    for name, help_text in [("nearest", "nearest hotspot pixel"), ("within", "hotspot clusters within a radius")]:
+        q = sub.add_parser(name, help=help_text)
+        q.add_argument("--lat", type=float, required=True)
+        q.add_argument("--lon", type=float, required=True)
+        q.add_argument("--min-class", type=int, default=MIN_CLASS, help="default: the two highest classes (3 = Critical or worse, 4 = Extreme with 3 thresholds)")
+    sub.choices["nearest"].add_argument("-k", type=int, default=1)
+    sub.choices["within"].add_argument("--radius", type=float, default=1000, help="metres")
+    sub.choices["within"].add_argument("--min-ha", type=float, default=0.0)
+    c = sub.add_parser("clusters", help="list clusters larger than --min-ha")
+    c.add_argument("--min-ha", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    pd.set_option("display.width", 160)
+    if args.command == "build":
+        build_index(args.classes, args.scores, args.min_class)
+    elif args.command == "nearest":
+        found = HotspotIndex().nearest(args.lat, args.lon, args.min_class, args.k)
+        if not found:
+            print("No hotspot pixels in the index")
+        for r in found:
+            print(f"📍 {r['class']} pixel at {r['lat']:.5f}, {r['lon']:.5f}: {r['distance_m']} m away "
+                  f"(score {r['score']}, cluster {r['cluster_id']})")
+    elif args.command == "within":
+        res = HotspotIndex().within(args.lat, args.lon, args.radius, args.min_class, args.min_ha)
+        print(f"🔥 {len(res)} clusters within {args.radius:g} m")
+        if len(res):
+            print(res.to_string(index=False))
+    else:
+        res = HotspotIndex().large_clusters(args.min_ha)
+        print(f"🔥 {len(res)} clusters of at least {args.min_ha:g} ha, {res['area_ha'].sum():.1f} ha in total")
+        print(res.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Streaming location ingestion
+----------------------------
+Reads point locations lazily, CHUNK_SIZE records at a time, from:
+
+  .txt        the chat-log dumps test.py used to parse ('[Time] Name: {"Name": ..., "Lat": ...}')
+  .jsonl      one JSON object per line (Name / Lat / Lon / radius)
+  .csv        columns Name, Lat, Lon, radius
+  .geojson    FeatureCollection of Points (properties Name / radius)
+  .parquet    GeoParquet with a WKB or native point "geometry" column, or plain Lat / Lon columns
+
+Every chunk comes out as columns (numpy arrays: line, name, lat, lon, radius).
+No per-row dicts are built on our side. Coordinates are validated with
+vectorised checks, and the chunk goes straight to
+uhi.query.analyze_chunk().
+
+Chat-log fields are pulled out with one vectorised regex per field over the
+whole chunk, so the old quote fixes and ast.literal_eval are not needed. JSON
+is decoded once per chunk with orjson if installed (json otherwise). GeoParquet
+needs pyarrow.
+"""
+
+import json
+import os
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+CHUNK_SIZE = 50000
+DEFAULT_RADIUS = 500
+MAX_REPORTED = 20      # invalid records printed per chunk
+FIELD_ALIASES = {
+    "name": ("Name", "name", "NAME"),
+    "lat": ("Lat", "lat", "latitude", "Latitude", "LAT"),
+    "lon": ("Lon", "lon", "lng", "longitude", "Longitude", "LON"),
+    "radius": ("radius", "Radius", "radius_m", "Radius_m"),
+}
+FORMATS = {".txt": "chatlog", ".log": "chatlog", ".jsonl": "jsonl", ".ndjson": "jsonl", ".csv": "csv",
+           ".geojson": "geojson", ".json": "geojson", ".parquet": "geoparquet", ".geoparquet": "geoparquet"}
+
+# Chat-log fields: quoted or unquoted values, tolerant of the broken quotes in our dumps.
+# A name runs to the quote that opened it, so it may contain the other quote character.
+_CHAT_FIELDS = {
+    "name": r'["\']Name["\']\s*:\s*(?P<quote>["\'])(?P<value>.*?)(?P=quote)',
+    "lat": r'["\']Lat["\']\s*:\s*["\']?\s*(?P<value>-?[0-9.]+(?:[eE][-+]?\d+)?)',
+    "lon": r'["\']Lon["\']\s*:\s*["\']?\s*(?P<value>-?[0-9.]+(?:[eE][-+]?\d+)?)',
+    "radius": r'["\']radius["\']\s*:\s*["\']?\s*(?P<value>[0-9.]+)',
+}
+
+def detect_format(path):
+    return FORMATS.get(os.path.splitext(path)[1].lower(), "chatlog")
+
+def _column(frame, field):
+    for key in FIELD_ALIASES[field]:
+        if key in frame:
+            return frame[key]
+    return None
+
+def _make_chunk(line, name, lat, lon, radius):
+    n = len(line)
+    return {
+        "line": np.asarray(line, dtype=np.int64),
+        "name": np.asarray(name if name is not None else ["Unknown"] * n, dtype=object),
+        "lat": pd.to_numeric(pd.Series(lat, dtype=object), errors="coerce").to_numpy(float) if lat is not None else np.full(n, np.nan),
+        "lon": pd.to_numeric(pd.Series(lon, dtype=object), errors="coerce").to_numpy(float) if lon is not None else np.full(n, np.nan),
+        "radius": pd.to_numeric(pd.Series(radius, dtype=object), errors="coerce").to_numpy(float) if radius is not None else np.full(n, np.nan),
+    }
+
+def _frame_chunk(frame, first_line):
+    name = _column(frame, "name")
+    return _make_chunk(np.arange(first_line, first_line + len(frame)),
+                       None if name is None else name.fillna("Unknown").astype(str).to_numpy(),
+                       _column(frame, "lat"), _column(frame, "lon"), _column(frame, "radius"))
+
+def _line_chunks(path, chunk_size):
+    with open(path, "r", encoding="utf-8") as f:
+        first = 1
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            yield first, lines
+            first += len(lines)
+
+def chatlog_fields(lines):
+    r"""
+    Name / Lat / Lon / radius strings of chat-log lines (NaN where missing).
+
+    >>> f = chatlog_fields(['{"Name": "St. Mary\'s Church", "Lat": 12.98, "Lon": 77.6, "radius": "500}',
+    ...                     "{'Name': 'The \"Hub\" Cafe', 'Lat': '13.0', 'Lon': '77.5'}"])
+    >>> f["name"].tolist(), f["lat"].tolist(), f["radius"].tolist()
+    (["St. Mary's Church", 'The "Hub" Cafe'], ['12.98', '13.0'], ['500', nan])
+    """
+    s = pd.Series(lines, dtype=object)
+    return pd.DataFrame({k: s.str.extract(p)["value"] for k, p in _CHAT_FIELDS.items()})
+
+def _chatlog_chunks(path, chunk_size):
+    for first, lines in _line_chunks(path, chunk_size):
+        s = pd.Series(lines)
+        cols = chatlog_fields(lines)
+        has_record = s.str.contains("{", regex=False)
+        keep = has_record.to_numpy()
+        line = np.arange(first, first + len(lines))[keep]
+        yield _make_chunk(line, cols["name"][keep].fillna("Unknown").to_numpy(),
+                          cols["lat"][keep], cols["lon"][keep], cols["radius"][keep])
+
+def _jsonl_chunks(path, chunk_size):
+    for first, lines in _line_chunks(path, chunk_size):
+        nonempty = [i for i, l in enumerate(lines) if l.strip()]
+        try:
+            # One decoder call per chunk
+            records = _loads("[" + ",".join(lines[i] for i in nonempty) + "]")
+            line_no = [first + i for i in nonempty]
+        except ValueError:
+            # A broken line: decode this chunk line by line and drop the bad ones
+            records, line_no = [], []
+            for i in nonempty:
+                try:
+                    records.append(_loads(lines[i]))
+                    line_no.append(first + i)
+                except ValueError:
+                    print(f"⚠️  Skipping Line {first + i} (Syntax Error)")
+        frame = pd.DataFrame.from_records(records) if records else pd.DataFrame()
+        chunk = _frame_chunk(frame, 0)
+        chunk["line"] = np.asarray(line_no, dtype=np.int64)
+        yield chunk
+
+def _csv_chunks(path, chunk_size):
+    first = 2   # line 1 is the header
+    for frame in pd.read_csv(path, chunksize=chunk_size, dtype=str, skipinitialspace=True):
+        yield _frame_chunk(frame, first)
+        first += len(frame)
+
+def _geojson_chunks(path, chunk_size):
+    with open(path, "rb") as f:
+        doc = _loads(f.read())
+    features = doc.get("features", []) if isinstance(doc, dict) else doc
+    for start in range(0, len(features), chunk_size):
+        part = features[start:start + chunk_size]
+        coords = [((f.get("geometry") or {}).get("coordinates") or [np.nan, np.nan])[:2] for f in part]
+        xy = np.array([c if len(c) == 2 else [np.nan, np.nan] for c in coords], dtype=object).reshape(-1, 2)
+        props = pd.DataFrame.from_records([f.get("properties") or {} for f in part])
+        name = _column(props, "name")
+        yield _make_chunk(np.arange(start + 1, start + 1 + len(part)),
+                          None if name is None else name.fillna("Unknown").astype(str).to_numpy(),
+                          xy[:, 1], xy[:, 0], _column(props, "radius"))
+
+# x / y of 2D WKB points, decoded for a whole column at once (anything else -> NaN)
+def wkb_points_xy(offsets, data):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    data = np.frombuffer(data, dtype=np.uint8)
+    start, length = offsets[:-1], np.diff(offsets)
+    ok = length == 21
+    x = np.full(len(start), np.nan)
+    y = np.full(len(start), np.nan)
+    if not ok.any():
+        return x, y
+    s = start[ok]
+    rec = data[s[:, None] + np.arange(21)]
+    little = rec[:, 0] == 1
+    # geometry type (uint32) must be 1 = Point
+    gtype = np.where(little, rec[:, 1:5].copy().view("<u4")[:, 0], rec[:, 1:5].copy().view(">u4")[:, 0])
+    xs = np.where(little, rec[:, 5:13].copy().view("<f8")[:, 0], rec[:, 5:13].copy().view(">f8")[:, 0])
+    ys = np.where(little, rec[:, 13:21].copy().view("<f8")[:, 0], rec[:, 13:21].copy().view(">f8")[:, 0])
+    point = gtype == 1
+    x[np.flatnonzero(ok)[point]] = xs[point]
+    y[np.flatnonzero(ok)[point]] = ys[point]
+    return x, y
+
+def _geoparquet_chunks(path, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("GeoParquet input needs pyarrow (pip install pyarrow)")
+    pf = pq.ParquetFile(path)
+    geo = json.loads((pf.schema_arrow.metadata or {}).get(b"geo", b"{}"))
+    geom_col = geo.get("primary_column", "geometry")
+    first = 1
+    for batch in pf.iter_batches(batch_size=chunk_size):
+        names = batch.schema.names
+        frame_cols = {n: batch.column(n).to_pandas() for n in names if n != geom_col
+                      and not pa.types.is_binary(batch.schema.field(n).type)}
+        frame = pd.DataFrame(frame_cols)
+        chunk = _frame_chunk(frame, first)
+        if geom_col in names:
+            col = batch.column(geom_col)
+            if pa.types.is_struct(col.type):   # GeoParquet native "point" encoding
+                x = col.field("x").to_numpy(zero_copy_only=False)
+                y = col.field("y").to_numpy(zero_copy_only=False)
+            else:
+                col = col.cast(pa.binary())
+                if col.offset or col.null_count:
+                    col = pa.concat_arrays([col.fill_null(b"")])
+                x, y = wkb_points_xy(np.frombuffer(col.buffers()[1], dtype=np.int32)[:len(col) + 1],
+                                     col.buffers()[2] or b"")
+            chunk["lon"], chunk["lat"] = np.asarray(x, float), np.asarray(y, float)
+        yield chunk
+        first += batch.num_rows
+
+READERS = {"chatlog": _chatlog_chunks, "jsonl": _jsonl_chunks, "csv": _csv_chunks,
+           "geojson": _geojson_chunks, "geoparquet": _geoparquet_chunks}
+
+def validate_chunk(chunk, default_radius=DEFAULT_RADIUS):
+    """
+    Vectorised coordinate checks.  Returns (valid_chunk, rejected) where
+    rejected is a DataFrame of line numbers and reasons.
+    """
+    radius = np.where(np.isnan(chunk["radius"]), default_radius, chunk["radius"])
+    reason = np.full(len(chunk["line"]), "", dtype=object)
+    reason[~(np.abs(chunk["lon"]) <= 180)] = "Lon missing or outside -180..180"
+    reason[~(np.abs(chunk["lat"]) <= 90)] = "Lat missing or outside -90..90"
+    reason[~(np.isfinite(radius) & (radius > 0))] = "radius must be a positive number"
+    ok = reason == ""
+    valid = {k: v[ok] for k, v in chunk.items()}
+    valid["radius"] = radius[ok]
+    rejected = pd.DataFrame({"line": chunk["line"][~ok], "reason": reason[~ok]})
+    return valid, rejected
+
+def iter_locations(path, fmt=None, chunk_size=CHUNK_SIZE, default_radius=DEFAULT_RADIUS):
+    """Yield validated column chunks of `path`; rejected records are reported and skipped."""
+    fmt = fmt or detect_format(path)
+    if fmt not in READERS:
+        raise ValueError(f"unknown location format {fmt!r} (expected one of {sorted(READERS)})")
+    for chunk in READERS[fmt](path, chunk_size):
+        valid, rejected = validate_chunk(chunk, default_radius)
+        for line, why in rejected.head(MAX_REPORTED).itertuples(index=False):
+            print(f"⚠️  Skipping Line {line} ({why})")
+        if len(rejected) > MAX_REPORTED:
+            print(f"⚠️  ... and {len(rejected) - MAX_REPORTED} more invalid records in this chunk")
+        if len(valid["line"]):
+            yield valid
@@ -0,0 +1,274 @@
+"""
+Phase 3 steps: 1-10 normalization of the criteria rasters (bounds from
+uhi/bounds.py), the population layer resampled onto the 30 m template
+(bilinear, or mass-conserving: area-weighted or dasymetric by LULC), and
+the LULC constraint mask (hard 0/1, or soft with 0.0001 for unsuitable land).
+Phase3_Normalization.py, Phase3_Pop_Normalize.py and phase3b_updatemask.py
+run them on the project files.
+"""
+
+import numpy as np
+import rasterio
+from rasterio.warp import reproject, Resampling
+from rasterio.windows import Window
+
+from .bounds import raster_bounds, array_bounds
+from .profiling import stage, profiled, count_read, count_write
+
+NORMALIZATION_MODE = "percentile"   # "minmax" (old behaviour), "percentile" (1-99 %) or "zscore"
+BLOCK_ROWS = 512
+SOFT_MASK_VALUE = 0.0001            # unsuitable pixels in the soft mask
+POP_RESAMPLING = "bilinear"         # population -> template grid: "bilinear" (old behaviour), "conserve"
+                                    # (area-weighted, sums to the source total) or "dasymetric" (conserve,
+                                    # spread inside each source cell by LULC class)
+DASYMETRIC_WEIGHTS = {50: 1.0, 80: 0.0}   # ESA WorldCover class -> relative density (50 built-up, 80 water)
+DASYMETRIC_OTHER = 0.1              # relative density of every other class
+
+# 1-10 normalization
+def normalize(array, inverse=False, bounds=None):
+    """Normalize array values to a 1–10 scale (bounds = (lo, hi), default raw min/max)."""
+    arr = array.astype(float)
+    arr_min, arr_max = bounds if bounds is not None else (np.nanmin(arr), np.nanmax(arr))
+    norm = (arr - arr_min) / (arr_max - arr_min) * 9 + 1  # scale to 1–10
+    if inverse:
+        norm = 11 - norm  # flip scale if needed
+    return np.clip(norm, 1, 10)
+
+# Normalize a raster block by block with bounds from the histogram service;
+# the bounds are stored as tags of the output so later runs can reuse them
+@profiled("normalize_raster")
+def normalize_raster(src_path, dst_path, inverse=False, mode=NORMALIZATION_MODE):
+    bounds = raster_bounds(src_path, mode=mode)
+    out_range = [np.inf, -np.inf]
+    with rasterio.open(src_path) as src:
+        profile = src.profile.copy()
+        profile.update(dtype="float32")
+        with rasterio.open(dst_path, "w", **profile) as dst:
+            dst.update_tags(NORM_MODE=mode, NORM_MIN=bounds[0], NORM_MAX=bounds[1], NORM_INVERSE=inverse)
+            for r0 in range(0, src.height, BLOCK_ROWS):
+                win = Window(0, r0, src.width, min(BLOCK_ROWS, src.height - r0))
+                block = src.read(1, window=win)
+                count_read(src_path, block.nbytes)
+                norm = normalize(block, inverse=inverse, bounds=bounds).astype("float32")
+                dst.write(norm, 1, window=win)
+                count_write(dst_path, norm.nbytes)
+                if np.isfinite(norm).any():
+                    out_range[0] = min(out_range[0], np.nanmin(norm))
+                    out_range[1] = max(out_range[1], np.nanmax(norm))
+    print(f"   {mode} bounds: {bounds[0]:.4f} .. {bounds[1]:.4f}")
+    return out_range
+
+# Constraint mask from LULC
+# Rule: Built-up (80) → 0, Water (50) → 0, others → 1
+@profiled("constraint_mask")
+def create_constraint_mask(lulc_path, output_path="Constraint_Mask.tif"):
+    with rasterio.open(lulc_path) as src:
+        lulc = src.read(1)
+        profile = src.profile
+    count_read(lulc_path, lulc.nbytes)
+
+    mask = np.ones_like(lulc, dtype="uint8")
+    mask[(lulc == 50) | (lulc == 80)] = 0  # unsuitable
+    with rasterio.open(output_path, "w", **profile) as dst:
+        dst.write(mask, 1)
+    count_write(output_path, mask.nbytes)
+    return mask
+
+# Share of every source cell (along one axis) that falls in every target cell, as a
+# sparse (n_dst x n_src) matrix.  `edges` are the n_src + 1 source cell edges in
+# target pixel units; a source cell inside the target extent has a column sum of 1.
+def overlap_matrix(edges, n_dst):
+    from scipy import sparse
+    lo, hi = np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+    first = np.floor(lo)
+    span = int(np.ceil((hi - lo).max())) + 1              # target cells one source cell can touch
+    k = first[:, None] + np.arange(span)
+    frac = (np.minimum(hi[:, None], k + 1) - np.maximum(lo[:, None], k)) / (hi - lo)[:, None]
+    keep = (frac > 0) & (k >= 0) & (k < n_dst)
+    src = np.broadcast_to(np.arange(len(lo))[:, None], k.shape)
+    return sparse.csr_matrix((frac[keep], (k[keep].astype(np.int64), src[keep])), shape=(n_dst, len(lo)))
+
+def _regrid(values, fy, fx):
+    # fy @ values @ fx.T with both overlap matrices sparse
+    return (fx @ (fy @ values).T).T
+
+# Share of every source cell (along one axis) that lies inside the n_dst target cells
+def extent_coverage(edges, n_dst):
+    lo, hi = np.minimum(edges[:-1], edges[1:]), np.maximum(edges[:-1], edges[1:])
+    return (np.clip(hi, 0, n_dst) - np.clip(lo, 0, n_dst)) / (hi - lo)
+
+# Source row and column edges of a north-up grid in pixel units of another one (same CRS)
+def grid_edges(src_transform, src_shape, dst_transform):
+    if src_transform.b or src_transform.d or dst_transform.b or dst_transform.d:
+        raise ValueError("mass-conserving resampling needs north-up (unrotated) grids")
+    h, w = src_shape
+    row_edges = (src_transform.f + src_transform.e * np.arange(h + 1) - dst_transform.f) / dst_transform.e
+    col_edges = (src_transform.c + src_transform.a * np.arange(w + 1) - dst_transform.c) / dst_transform.a
+    return row_edges, col_edges
+
+# Row overlap matrix of the target rows r0:r1 only, with the source rows s0:s1 it touches
+def row_block_overlap(row_edges, r0, r1):
+    lo, hi = np.minimum(row_edges[:-1], row_edges[1:]), np.maximum(row_edges[:-1], row_edges[1:])
+    rows = np.flatnonzero((hi > r0) & (lo < r1))
+    if rows.size == 0:
+        return None, 0, 0
+    s0, s1 = int(rows[0]), int(rows[-1]) + 1
+    return overlap_matrix(row_edges[s0:s1 + 1] - r0, r1 - r0), s0, s1
+
+# Mass-conserving regridding: each source cell's value is split over the target
+# cells in proportion to the overlapping area, times the target `density`
+# (dasymetric) if given.  Separable, so it is two sparse products per block of
+# BLOCK_ROWS target rows instead of a per-pixel warp.  A source cell only partly
+# inside the target extent keeps its inside share of the value in both modes.
+def conserve_regrid(values, row_edges, fx, dst_shape, density=None, block_rows=BLOCK_ROWS):
+    values = values.astype("float64")
+    n_rows = dst_shape[0]
+    out = np.zeros(dst_shape, dtype="float64")
+    blocks = [(r0, min(r0 + block_rows, n_rows)) for r0 in range(0, n_rows, block_rows)]
+    if density is None:
+        for r0, r1 in blocks:
+            fy, s0, s1 = row_block_overlap(row_edges, r0, r1)
+            if fy is not None:
+                out[r0:r1] = _regrid(values[s0:s1], fy, fx)
+        return out
+
+    # Weighted target area of every source cell inside the extent, over all row blocks
+    weight = np.zeros_like(values)
+    for r0, r1 in blocks:
+        fy, s0, s1 = row_block_overlap(row_edges, r0, r1)
+        if fy is not None:
+            weight[s0:s1] += (fx.T @ (fy.T @ density[r0:r1].astype("float64")).T).T
+    # Spread the inside share (coverage) of each cell, so partial edge cells match "conserve";
+    # cells with no weight inside (all water) fall back to area weights
+    coverage = np.outer(extent_coverage(row_edges, n_rows), np.asarray(fx.sum(axis=0)).ravel())
+    spread = np.divide(values * coverage, weight, out=np.zeros_like(values), where=weight > 0)
+    fallback = np.where(weight > 0, 0.0, values)
+    for r0, r1 in blocks:
+        fy, s0, s1 = row_block_overlap(row_edges, r0, r1)
+        if fy is not None:
+            out[r0:r1] = density[r0:r1] * _regrid(spread[s0:s1], fy, fx) + _regrid(fallback[s0:s1], fy, fx)
+    return out
+
+# Relative population density of every template pixel from its LULC class
+def dasymetric_density(lulc_path, template, weights=None, other=None):
+    weights = DASYMETRIC_WEIGHTS if weights is None else weights
+    other = DASYMETRIC_OTHER if other is None else other
+    with rasterio.open(lulc_path) as src:
+        if src.crs == template.crs and src.transform == template.transform and src.shape == template.shape:
+            lulc = src.read(1)
+        else:
+            lulc = np.zeros(template.shape, dtype=src.dtypes[0])
+            reproject(rasterio.band(src, 1), lulc, dst_transform=template.transform, dst_crs=template.crs,
+                      resampling=Resampling.nearest)
+    count_read(lulc_path, lulc.nbytes)
+    density = np.full(lulc.shape, other, dtype="float32")
+    for cls, weight in weights.items():
+        density[lulc == cls] = weight
+    return density
+
+# Population: resample onto the template grid, then normalize the populated pixels
+@profiled("normalize_population")
+def normalize_population(pop_path, template_path, output_path, mode=NORMALIZATION_MODE,
+                         resampling=POP_RESAMPLING, lulc_path=None, counts_path=None):
+    """
+    resampling: "bilinear", "conserve" or "dasymetric" (needs lulc_path, the LULC
+    of Phase 2).  counts_path also saves the resampled people per pixel.
+    """
+    # Load template (for CRS, transform, shape)
+    with rasterio.open(template_path) as t:
+        template_meta = t.meta.copy()
+        template_transform = t.transform
+        template_crs = t.crs
+        template_shape = (t.height, t.width)
+        density = None
+        if resampling == "dasymetric":
+            if lulc_path is None:
+                raise ValueError("dasymetric population resampling needs lulc_path")
+            with stage("dasymetric_density"):
+                density = dasymetric_density(lulc_path, t)
+
+    # Read and resample population raster to match template
+    with rasterio.open(pop_path) as src:
+        pop_data = src.read(1)
+        pop_meta = src.meta.copy()
+        count_read(pop_path, pop_data.nbytes)
+
+        if resampling == "bilinear":
+            resampled = np.zeros(template_shape, dtype='float32')
+            with stage("reproject"):
+                reproject(
+                    source=pop_data,
+                    destination=resampled,
+                    src_transform=src.transform,
+                    src_crs=src.crs,
+                    dst_transform=template_transform,
+                    dst_crs=template_crs,
+                    resampling=Resampling.bilinear
+                )
+        elif resampling in ("conserve", "dasymetric"):
+            if src.crs != template_crs:
+                raise ValueError(f"{resampling} resampling needs the population raster in the template CRS "
+                                 f"({src.crs} vs {template_crs})")
+            # Counts only: NoData, NaN and negative cells hold no people
+            pop = pop_data.astype("float64")
+            pop[~np.isfinite(pop) | (pop < 0)] = 0.0
+            if src.nodata is not None:
+                pop[pop_data == src.nodata] = 0.0
+            with stage("conserve_regrid"):
+                row_edges, col_edges = grid_edges(src.transform, pop.shape, template_transform)
+                fx = overlap_matrix(col_edges, template_shape[1])
+                resampled = conserve_regrid(pop, row_edges, fx, template_shape, density)
+            # Source people inside the template extent (partly covered cells count pro rata)
+            inside = float(extent_coverage(row_edges, template_shape[0]) @ pop @ extent_coverage(col_edges, template_shape[1]))
+            print(f"   population: {inside:,.0f} in the source within the template extent "
+                  f"-> {float(resampled.sum()):,.0f} on the template grid ({resampling})")
+        else:
+            raise ValueError(f"unknown population resampling {resampling!r}")
+
+    # Normalize to 1–10 scale
+    arr = resampled.astype(float)
+    arr[arr < 0] = 0  # safety
+    valid = arr[arr > 0]
+
+    if valid.size > 0:
+        # Bounds of the populated pixels from the histogram service (robust to outliers)
+        with stage("bounds"):
+            mn, mx = array_bounds(valid, mode=mode)
+        norm = (arr - mn) / (mx - mn) * 9 + 1
+        norm = np.clip(norm, 1, 10)
+    else:
+        norm = arr
+
+    # Save Population_norm.tif
+    template_meta.update(dtype='float32', compress='lzw')
+
+    with rasterio.open(output_path, 'w', **template_meta) as dst:
+        dst.write(norm.astype('float32'), 1)
+        count_write(output_path, norm.size * 4)
+        dst.update_tags(POP_RESAMPLING=resampling)
+        if valid.size > 0:
+            dst.update_tags(NORM_MODE=mode, NORM_MIN=mn, NORM_MAX=mx)
+    if counts_path:
+        with rasterio.open(counts_path, 'w', **template_meta) as dst:
+            dst.write(resampled.astype('float32'), 1)
+            count_write(counts_path, resampled.size * 4)
+            dst.update_tags(POP_RESAMPLING=resampling)
+
+# Soft mask: 1 (suitable) -> 1.0, 0 (unsuitable) -> SOFT_MASK_VALUE, so buildings still
+# receive a computed score but it is drastically reduced
+@profiled("soften_mask")
+def soften_mask(input_mask, output_mask=None, low=SOFT_MASK_VALUE):
+    output_mask = output_mask or input_mask
+    with rasterio.open(input_mask) as src:
+        mask_data = src.read(1)
+        profile = src.profile.copy()
+    count_read(input_mask, mask_data.nbytes)
+
+    new_mask = mask_data.astype('float32')
+    new_mask[new_mask == 0] = low
+    new_mask[new_mask >= 1] = 1.0
+    profile.update(dtype='float32', nodata=None)
+    with rasterio.open(output_mask, 'w', **profile) as dst:
+        dst.write(new_mask, 1)
+    count_write(output_mask, new_mask.nbytes)
+    return mask_data, new_mask
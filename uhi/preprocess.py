@@ -0,0 +1,80 @@
+"""
+Phase 2 steps: CRS assignment, resampling to the LST grid, no-data cleaning
+and a diagnostic summary.  Phase2_Preprocessing.py runs them on the project files.
+"""
+
+import os
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from .profiling import profiled, count_read, count_write
+
+# === Step 1: Assign CRS to LST and NDVI ===
+@profiled("assign_crs")
+def assign_crs(input_path, output_path, crs_code="EPSG:4326"):
+    with rasterio.open(input_path) as src:
+        profile = src.profile
+        data = src.read(1)
+        profile.update(crs=crs_code)
+    count_read(input_path, data.nbytes)
+
+    with rasterio.open(output_path, "w", **profile) as dst:
+        dst.write(data, 1)
+    count_write(output_path, data.nbytes)
+    print(f"✅ CRS {crs_code} assigned to {output_path}")
+
+# === Step 2: Resample LULC to match LST resolution (30 m) ===
+@profiled("resample")
+def resample_raster(input_path, reference_path, output_path):
+    with rasterio.open(reference_path) as ref:
+        new_transform = ref.transform
+        new_crs = ref.crs
+        new_shape = (ref.height, ref.width)
+
+    with rasterio.open(input_path) as src:
+        data = src.read(
+            out_shape=(src.count, new_shape[0], new_shape[1]),
+            resampling=Resampling.nearest
+        )
+        profile = src.profile
+        profile.update({
+            'transform': new_transform,
+            'crs': new_crs,
+            'height': new_shape[0],
+            'width': new_shape[1]
+        })
+
+    count_read(input_path, data.nbytes)
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        dst.write(data)
+    count_write(output_path, data.nbytes)
+    print(f"✅ Resampled {input_path} → {output_path}")
+
+# === Step 3: Clean NaN / No-Data pixels ===
+@profiled("clean_nodata")
+def clean_nodata(input_path, output_path):
+    with rasterio.open(input_path) as src:
+        data = src.read(1)
+        data = np.nan_to_num(data, nan=0)
+        profile = src.profile
+    count_read(input_path, data.nbytes)
+
+    with rasterio.open(output_path, "w", **profile) as dst:
+        dst.write(data, 1)
+    count_write(output_path, data.nbytes)
+    print(f"✅ Cleaned no-data pixels in {output_path}")
+
+# === Step 4: Diagnostics — Check alignment and stats ===
+@profiled("check_stats")
+def check_stats(files):
+    for f in files:
+        with rasterio.open(f) as src:
+            data = src.read(1, masked=True)
+            print("\n---", os.path.basename(f), "---")
+            print("CRS:", src.crs)
+            print("Resolution:", src.res)
+            print("Shape (rows, cols):", (src.height, src.width))
+            print("Data type:", data.dtype)
+            print("Min:", np.nanmin(data), "Max:", np.nanmax(data))
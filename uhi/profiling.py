@@ -0,0 +1,237 @@
+"""
+Pipeline profiling
+------------------
+Shows where time and memory go in a run: reprojection, entropy, the Monte Carlo
+loop, GeoTIFF writes...
+
+- stage("name") context manager / @profiled("name") decorator: wall and CPU time
+  per stage and call count. Stages nest ("ensemble;samples"), and the time spent
+  in a stage's children is subtracted out as its self time.
+- Memory per stage: process RSS at the end of the stage, the process peak RSS,
+  and the tracemalloc peak inside the stage (numpy buffers included).
+- count_read / count_write: bytes read from / written to each raster (decoded
+  array bytes, i.e. what the pipeline actually moves through memory).
+
+Everything is off until enable() is called, so a disabled stage() costs one
+flag check. Scripts turn it on with a --profile flag:
+
+    python -m uhi run --profile                    # -> profile_phase4.json + profile_phase4.folded
+    python Phase2_Preprocessing.py --profile=run1  # -> run1.json + run1.folded
+
+The .json report has the per-stage table and the I/O counters. The .folded file
+holds one "a;b;c <self microseconds>" line per stage path, ready for
+flamegraph.pl or speedscope.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+_ENABLED = False
+_TRACE_MEMORY = False
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_STAGES = {}      # stage path (tuple) -> totals
+_IO = {}          # raster path -> byte / call counters
+_STARTED = None
+
+def enabled():
+    return _ENABLED
+
+def enable(trace_memory=True):
+    """Start collecting.  trace_memory=False skips tracemalloc (it slows allocations down)."""
+    global _ENABLED, _TRACE_MEMORY, _STARTED
+    _ENABLED = True
+    _TRACE_MEMORY = trace_memory
+    _STARTED = (datetime.now(), time.perf_counter(), time.process_time())
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def reset():
+    with _LOCK:
+        _STAGES.clear()
+        _IO.clear()
+
+# Current / peak resident set size of the process in MB
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10   # bytes on macOS, KB on Linux
+
+def _stack():
+    if not hasattr(_LOCAL, "stack"):
+        _LOCAL.stack = []
+    return _LOCAL.stack
+
+class stage:
+    """Time a block (`with stage("entropy"):`); a no-op unless profiling is enabled."""
+
+    __slots__ = ("name", "active", "path", "t0", "c0", "child_s", "traced_peak")
+
+    def __init__(self, name):
+        self.name = name
+        self.active = False
+
+    def __enter__(self):
+        if not _ENABLED:
+            return self
+        self.active = True
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.path = (parent.path if parent else ()) + (self.name,)
+        self.child_s = 0.0
+        self.traced_peak = 0
+        if _TRACE_MEMORY and tracemalloc.is_tracing():
+            # The peak so far belongs to the parent; restart it for this stage
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.t0 = time.perf_counter()
+        self.c0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.active:
+            return False
+        wall = time.perf_counter() - self.t0
+        cpu = time.process_time() - self.c0
+        stack = _stack()
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if _TRACE_MEMORY and tracemalloc.is_tracing():
+            self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, self.traced_peak)
+        if parent is not None:
+            parent.child_s += wall
+        rss = rss_mb()
+        with _LOCK:
+            s = _STAGES.setdefault(self.path, {"calls": 0, "wall_s": 0.0, "self_s": 0.0, "cpu_s": 0.0,
+                                               "rss_mb": 0.0, "traced_peak_mb": 0.0})
+            s["calls"] += 1
+            s["wall_s"] += wall
+            s["self_s"] += max(wall - self.child_s, 0.0)
+            s["cpu_s"] += cpu
+            s["rss_mb"] = max(s["rss_mb"], rss)
+            s["traced_peak_mb"] = max(s["traced_peak_mb"], self.traced_peak / 2**20)
+        self.active = False
+        return False
+
+def profiled(name=None):
+    """Decorator form of stage(); the stage name defaults to the function name."""
+    def wrap(func):
+        label = name or func.__name__
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with stage(label):
+                return func(*args, **kwargs)
+        return inner
+    return wrap
+
+def _count(path, key, nbytes):
+    if not _ENABLED:
+        return
+    with _LOCK:
+        c = _IO.setdefault(str(path), {"read_bytes": 0, "read_calls": 0, "written_bytes": 0, "write_calls": 0})
+        c[key + "_bytes"] += int(nbytes)
+        c[("read" if key == "read" else "write") + "_calls"] += 1
+
+def count_read(path, nbytes):
+    _count(path, "read", nbytes)
+
+def count_write(path, nbytes):
+    _count(path, "written", nbytes)
+
+def report():
+    """Stages (sorted by stage path) and raster I/O counters as a JSON-ready dict."""
+    with _LOCK:
+        stages = [dict(path=";".join(p), depth=len(p) - 1, **{k: (round(v, 6) if isinstance(v, float) else v)
+                                                              for k, v in s.items()})
+                  for p, s in sorted(_STAGES.items())]
+        io = {k: dict(v) for k, v in _IO.items()}
+    out = {"python": sys.version.split()[0], "argv": sys.argv, "peak_rss_mb": round(peak_rss_mb(), 1),
+           "stages": stages, "io": io}
+    if _STARTED is not None:
+        out.update(started=_STARTED[0].isoformat(timespec="seconds"),
+                   wall_s=round(time.perf_counter() - _STARTED[1], 3),
+                   cpu_s=round(time.process_time() - _STARTED[2], 3))
+    return out
+
+def folded_stacks():
+    """flamegraph.pl / speedscope input: one "a;b;c <self microseconds>" line per stage."""
+    with _LOCK:
+        return [f"{';'.join(p)} {int(round(s['self_s'] * 1e6))}" for p, s in sorted(_STAGES.items())]
+
+def print_summary(rep=None):
+    rep = rep or report()
+    print("\n--- ⏱️ PROFILE ---")
+    print(f"{'stage':<40}{'calls':>7}{'wall s':>10}{'self s':>10}{'cpu s':>10}{'rss MB':>9}{'traced MB':>11}")
+    for s in rep["stages"]:
+        label = "  " * s["depth"] + s["path"].split(";")[-1]
+        print(f"{label[:39]:<40}{s['calls']:>7}{s['wall_s']:>10.3f}{s['self_s']:>10.3f}{s['cpu_s']:>10.3f}"
+              f"{s['rss_mb']:>9.0f}{s['traced_peak_mb']:>11.1f}")
+    for path, c in sorted(rep["io"].items()):
+        parts = []
+        if c["read_calls"]:
+            parts.append(f"read {c['read_bytes'] / 2**20:.1f} MB in {c['read_calls']} calls")
+        if c["write_calls"]:
+            parts.append(f"wrote {c['written_bytes'] / 2**20:.1f} MB in {c['write_calls']} calls")
+        print(f"📦 {os.path.basename(path)}: " + ", ".join(parts))
+    print(f"Peak RSS {rep['peak_rss_mb']:.0f} MB")
+
+def write_report(prefix):
+    rep = report()
+    with open(prefix + ".json", "w") as f:
+        json.dump(rep, f, indent=2)
+    with open(prefix + ".folded", "w") as f:
+        f.write("\n".join(folded_stacks()) + "\n")
+    print_summary(rep)
+    print(f"✅ Profile saved → {prefix}.json, {prefix}.folded")
+
+def start(name, prefix=None, trace_memory=True):
+    """Enable profiling for a script run; the report is written when the process exits."""
+    enable(trace_memory)
+    prefix = prefix or f"profile_{name}"
+    root = stage(name).__enter__()
+    def finish():
+        root.__exit__(None, None, None)
+        write_report(prefix)
+    atexit.register(finish)
+
+def profile_from_argv(name, argv=None):
+    """
+    For the plain scripts: handle (and remove) --profile / --profile=PREFIX in
+    sys.argv and start profiling if it was given.  Add --no-tracemalloc to skip
+    the allocation tracing.
+    """
+    argv = sys.argv if argv is None else argv
+    flags = [a for a in argv[1:] if a == "--profile" or a.startswith("--profile=") or a == "--no-tracemalloc"]
+    if not any(a.startswith("--profile") for a in flags):
+        return False
+    for a in flags:
+        argv.remove(a)
+    prefix = next((a.split("=", 1)[1] for a in flags if a.startswith("--profile=")), None)
+    start(name, prefix, trace_memory="--no-tracemalloc" not in flags)
+    return True
@@ -0,0 +1,184 @@
+"""
+Shared point-query helpers
+--------------------------
+Radius windows and the check_location / analyze_location statistics used
+by Inference/test.py (batch CSV), Inference/test3.py (interactive), service.py
+(server) and `python -m uhi query` / `python -m uhi locations`.
+
+Windows that are close to each other can be coalesced, so a batch of nearby
+locations is served from a few larger reads instead of one read each.
+"""
+
+import numpy as np
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.windows import Window
+
+METERS_PER_DEGREE = 111320
+THRESHOLD_SCORE = 6.0   # check_location: pixels above this count as high priority
+VALID_MIN = 0.001       # NoData / masked pixels are at or below this
+MAX_WASTE = 4.0         # coalesce windows while the union reads at most this many times their own pixels
+
+def radius_pixels(res_x, radius_meters):
+    """Search radius in pixels (at least 1), from the pixel width in degrees."""
+    radius_deg = radius_meters / METERS_PER_DEGREE
+    return max(1, int(radius_deg / res_x))
+
+def location_window(src, lat, lon, radius_meters):
+    """Window of +/- radius around (lat, lon), clamped to the raster; None if the point is outside."""
+    row, col = src.index(lon, lat)
+    if not (0 <= row < src.height and 0 <= col < src.width):
+        return None
+    r = radius_pixels(src.res[0], radius_meters)
+    row_start, row_end = max(0, row - r), min(src.height, row + r + 1)
+    col_start, col_end = max(0, col - r), min(src.width, col + r + 1)
+    return Window.from_slices((row_start, row_end), (col_start, col_end))
+
+def _bounds(w):
+    return (int(w.row_off), int(w.row_off + w.height), int(w.col_off), int(w.col_off + w.width))
+
+def coalesce_windows(windows, max_waste=MAX_WASTE):
+    """
+    Group windows (None entries are skipped) so that each group is read once
+    as the union of its members.  Greedy in row order: a window joins the
+    current group while the union stays within `max_waste` times the summed
+    window areas.  Returns [(union_window, [indices]), ...].
+    """
+    order = sorted((i for i, w in enumerate(windows) if w is not None), key=lambda i: _bounds(windows[i]))
+    groups = []
+    for i in order:
+        r0, r1, c0, c1 = _bounds(windows[i])
+        area = (r1 - r0) * (c1 - c0)
+        if groups:
+            g = groups[-1]
+            u = (min(g["b"][0], r0), max(g["b"][1], r1), min(g["b"][2], c0), max(g["b"][3], c1))
+            if (u[1] - u[0]) * (u[3] - u[2]) <= max_waste * (g["area"] + area):
+                g["b"], g["area"] = u, g["area"] + area
+                g["members"].append(i)
+                continue
+        groups.append({"b": (r0, r1, c0, c1), "area": area, "members": [i]})
+    return [(Window.from_slices((g["b"][0], g["b"][1]), (g["b"][2], g["b"][3])), g["members"])
+            for g in groups]
+
+def read_windows(src, windows, max_waste=MAX_WASTE, groups=None):
+    """Data of every window (None for None), read through coalesced union windows."""
+    out = [None] * len(windows)
+    groups = coalesce_windows(windows, max_waste) if groups is None else groups
+    for union, members in groups:
+        block = src.read(1, window=union)
+        ur, uc = int(union.row_off), int(union.col_off)
+        for i in members:
+            r0, r1, c0, c1 = _bounds(windows[i])
+            out[i] = block[r0 - ur:r1 - ur, c0 - uc:c1 - uc]
+    return out
+
+def analyze_data(name, lat, lon, radius_meters, data):
+    """analyze_location() statistics (max and median) of a window's data."""
+    result = {
+        "Name": name,
+        "Lat": lat,
+        "Lon": lon,
+        "Radius_m": radius_meters,
+        "Max_Score": None,
+        "Avg_Score": None,
+        "Status": "Error"
+    }
+    if data is None:
+        result["Status"] = "Out of Bounds"
+        return result
+    valid_data = data[data > VALID_MIN]  # Filter NoData
+    if valid_data.size == 0:
+        result["Status"] = "No Valid Data"
+        return result
+    result["Max_Score"] = round(float(np.max(valid_data)), 2)
+    result["Avg_Score"] = round(float(np.median(valid_data)), 2)
+    result["Status"] = "Success"
+    return result
+
+def check_data(lat, lon, radius_meters, data, threshold=THRESHOLD_SCORE):
+    """check_location() statistics (max, mean, pixels above threshold) of a window's data."""
+    result = {"Lat": lat, "Lon": lon, "Radius_m": radius_meters, "Status": "Error"}
+    if data is None:
+        result["Status"] = "Out of Bounds"
+        return result
+    valid_data = data[data > VALID_MIN]
+    if valid_data.size == 0:
+        result["Status"] = "No Valid Data"
+        return result
+    result.update({
+        "Max_Score": round(float(np.max(valid_data)), 2),
+        "Avg_Score": round(float(np.mean(valid_data)), 2),
+        "High_Priority_Pixels": int(np.count_nonzero(valid_data > threshold)),
+        "Valid_Pixels": int(valid_data.size),
+        "Status": "Success",
+    })
+    return result
+
+def analyze_location(src, name, lat, lon, radius_meters):
+    """Max and median score within the radius of one location."""
+    window = location_window(src, lat, lon, radius_meters)
+    data = src.read(1, window=window) if window is not None else None
+    return analyze_data(name, lat, lon, radius_meters, data)
+
+def analyze_locations(src, locations):
+    """analyze_location() for many (name, lat, lon, radius) tuples with coalesced reads."""
+    windows = [location_window(src, lat, lon, rad) for _, lat, lon, rad in locations]
+    datas = read_windows(src, windows)
+    return [analyze_data(name, lat, lon, rad, d) for (name, lat, lon, rad), d in zip(locations, datas)]
+
+def chunk_windows(src, lat, lon, radius_meters):
+    """location_window() for arrays of points at once (None where the point is outside)."""
+    rows, cols = rowcol(src.transform, np.asarray(lon, float), np.asarray(lat, float))
+    rows, cols = np.atleast_1d(np.asarray(rows)), np.atleast_1d(np.asarray(cols))
+    inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+    r = np.maximum(1, (np.asarray(radius_meters, float) / METERS_PER_DEGREE / src.res[0]).astype(int))
+    r0, r1 = np.maximum(0, rows - r), np.minimum(src.height, rows + r + 1)
+    c0, c1 = np.maximum(0, cols - r), np.minimum(src.width, cols + r + 1)
+    return [Window.from_slices((int(r0[i]), int(r1[i])), (int(c0[i]), int(c1[i]))) if inside[i] else None
+            for i in range(len(rows))]
+
+def analyze_chunk(src, chunk):
+    """
+    analyze_location() over a column chunk (name, lat, lon, radius arrays, see
+    uhi/locations.py) with coalesced reads.  Returns the result columns.
+    """
+    windows = chunk_windows(src, chunk["lat"], chunk["lon"], chunk["radius"])
+    n = len(windows)
+    max_score = np.full(n, np.nan)
+    avg_score = np.full(n, np.nan)
+    status = np.full(n, "Out of Bounds", dtype=object)
+    for i, data in enumerate(read_windows(src, windows)):
+        if data is None:
+            continue
+        valid_data = data[data > VALID_MIN]
+        if valid_data.size == 0:
+            status[i] = "No Valid Data"
+            continue
+        max_score[i] = round(float(np.max(valid_data)), 2)
+        avg_score[i] = round(float(np.median(valid_data)), 2)
+        status[i] = "Success"
+    return {"Name": chunk["name"], "Lat": chunk["lat"], "Lon": chunk["lon"], "Radius_m": chunk["radius"],
+            "Max_Score": max_score, "Avg_Score": avg_score, "Status": status}
+
+def analyze_file(map_path, locations_path, out_csv, fmt=None, preview_rows=20, progress=print):
+    """
+    Stream a locations file (see locations.py) through analyze_chunk(),
+    appending each chunk to `out_csv` as soon as it is done.  Returns the
+    number of locations and up to `preview_rows` successful result rows.
+    """
+    import pandas as pd
+    from .locations import iter_locations
+
+    n_done = 0
+    preview = []
+    with rasterio.open(map_path) as src:
+        for chunk in iter_locations(locations_path, fmt=fmt):
+            results = pd.DataFrame(analyze_chunk(src, chunk))
+            results.to_csv(out_csv, mode="w" if n_done == 0 else "a", header=(n_done == 0), index=False)
+            n_done += len(results)
+            if len(preview) < preview_rows:
+                preview.extend(results[results["Status"] == "Success"].head(preview_rows - len(preview))
+                               .itertuples(index=False))
+            if progress:
+                progress(f"   -> {n_done} locations checked")
+    return n_done, preview
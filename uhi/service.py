@@ -0,0 +1,272 @@
+"""
+UHI point-query service
+-----------------------
+Serves the check_location (test3.py) and analyze_location (test.py) lookups
+over HTTP. It uses only asyncio and the standard library, plus rasterio.
+
+  GET  /check?lat=12.9716&lon=77.5946&radius=500        max / mean / pixels above THRESHOLD_SCORE
+  GET  /analyze?lat=12.9716&lon=77.5946&radius=500&name=Chickpet   max / median (CSV columns of test.py)
+  POST /analyze   [{"Name": ..., "Lat": ..., "Lon": ..., "radius": ...}, ...]   many locations at once
+  GET  /stats     latency percentiles, batches and raster reads so far
+
+How it works:
+- A fixed pool of worker threads each keeps its own open rasterio handle on
+  the map (handles are not thread-safe and are never re-opened per request).
+- Requests that arrive within BATCH_WINDOW_MS of each other are coalesced.
+  Each batch goes to one worker, and neighbouring search windows are read
+  through one union window (uhi.query.read_windows).
+- Every response carries its server-side latency ("latency_ms").
+
+Usage:
+    python -m uhi service serve --map Final_Map_Clipped.tif
+    python -m uhi service client --lat 12.9719 --lon 77.5772 --radius 1000
+    python -m uhi service client --lat 12.9719 --lon 77.5772 --concurrent 200   # load test
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+import numpy as np
+import rasterio
+
+from .query import location_window, coalesce_windows, read_windows, analyze_data, check_data, THRESHOLD_SCORE
+
+# === Configuration ===
+INPUT_MAP = "Final_Map_Clipped.tif"
+HOST = "127.0.0.1"
+PORT = 8766
+WORKERS = 4              # worker threads, one open dataset handle each
+BATCH_WINDOW_MS = 5      # wait this long for more requests before dispatching a batch
+BATCH_MAX = 256          # largest batch handed to one worker
+DEFAULT_RADIUS = 500
+LATENCY_WINDOW = 10000   # /stats covers the last N requests
+
+class QueryService:
+    def __init__(self, map_path=INPUT_MAP, workers=WORKERS, batch_ms=BATCH_WINDOW_MS, batch_max=BATCH_MAX):
+        self.map_path = map_path
+        self.workers = workers
+        self.batch_s = batch_ms / 1000.0
+        self.batch_max = batch_max
+        self._local = threading.local()
+        self._handles = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, initializer=self._open_handle)
+        self.queue = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"requests": 0, "locations": 0, "batches": 0, "reads": 0}
+
+    def _open_handle(self):
+        self._local.src = rasterio.open(self.map_path)
+        self._handles.append(self._local.src)
+
+    # Runs in a worker thread: one coalesced read pass for the whole batch
+    def _run_batch(self, items):
+        src = self._local.src
+        windows = [location_window(src, it["lat"], it["lon"], it["radius"]) for it in items]
+        groups = coalesce_windows(windows)
+        datas = read_windows(src, windows, groups=groups)
+        results = []
+        for it, data in zip(items, datas):
+            if it["kind"] == "check":
+                results.append(check_data(it["lat"], it["lon"], it["radius"], data, THRESHOLD_SCORE))
+            else:
+                results.append(analyze_data(it["name"], it["lat"], it["lon"], it["radius"], data))
+        return results, len(groups)
+
+    async def submit(self, kind, lat, lon, radius, name=None):
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put({"kind": kind, "lat": lat, "lon": lon, "radius": radius, "name": name, "future": fut})
+        return await fut
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.batch_s
+            while len(items) < self.batch_max:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting, so the next batch is collected meanwhile
+            asyncio.ensure_future(self._dispatch(items))
+
+    async def _dispatch(self, items):
+        loop = asyncio.get_running_loop()
+        self.counters["batches"] += 1
+        self.counters["locations"] += len(items)
+        try:
+            results, n_reads = await loop.run_in_executor(self.executor, self._run_batch, items)
+        except Exception as e:
+            for it in items:
+                if not it["future"].done():
+                    it["future"].set_exception(e)
+            return
+        self.counters["reads"] += n_reads
+        for it, res in zip(items, results):
+            if not it["future"].done():
+                it["future"].set_result(res)
+
+    def stats(self):
+        lat = np.array(self.latencies) if self.latencies else np.zeros(1)
+        batches = max(self.counters["batches"], 1)
+        return dict(self.counters, **{
+            "mean_batch_size": round(self.counters["locations"] / batches, 2),
+            "latency_percentiles_ms": {"p50": round(float(np.percentile(lat, 50)), 3),
+                                       "p95": round(float(np.percentile(lat, 95)), 3),
+                                       "p99": round(float(np.percentile(lat, 99)), 3),
+                                       "max": round(float(lat.max()), 3)},
+        })
+
+    async def route(self, method, target, body):
+        parts = urlsplit(target)
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if parts.path == "/stats":
+            return 200, self.stats()
+        if parts.path not in ("/check", "/analyze"):
+            return 404, {"error": f"unknown path {parts.path}"}
+        kind = parts.path[1:]
+        try:
+            if method == "POST":
+                locs = json.loads(body or b"[]")
+                locs = [locs] if isinstance(locs, dict) else locs
+                jobs = [(float(l["Lat"]), float(l["Lon"]), float(l.get("radius", DEFAULT_RADIUS)),
+                         l.get("Name", "Unknown")) for l in locs]
+            else:
+                jobs = [(float(q["lat"]), float(q["lon"]), float(q.get("radius", DEFAULT_RADIUS)),
+                         q.get("name", "Unknown"))]
+            for lat, lon, rad, _ in jobs:
+                if not np.isfinite([lat, lon, rad]).all():
+                    raise ValueError(f"not finite: lat={lat}, lon={lon}, radius={rad}")
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, {"error": f"Lat/Lon/Radius must be finite numbers ({e})"}
+        results = await asyncio.gather(*(self.submit(kind, lat, lon, rad, name) for lat, lon, rad, name in jobs))
+        return 200, {"results": results} if method == "POST" else results[0]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                t0 = time.perf_counter()
+                try:
+                    method, target, _ = line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                try:
+                    status, payload = await self.route(method, target, body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+                latency_ms = (time.perf_counter() - t0) * 1000.0
+                if status == 200 and not target.startswith("/stats"):
+                    self.counters["requests"] += 1
+                    self.latencies.append(latency_ms)
+                payload = dict(payload, latency_ms=round(latency_ms, 3))
+                data = json.dumps(payload).encode()
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Error")
+                writer.write((f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                              f"Content-Length: {len(data)}\r\nX-Latency-ms: {latency_ms:.3f}\r\n\r\n").encode() + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(self._batcher())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🌍 Query service on http://{host}:{port} ({self.workers} workers, map: {self.map_path})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for src in self._handles:
+            src.close()
+
+# === Local client ===
+def query(path, host=HOST, port=PORT, body=None):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        if body is None:
+            conn.request("GET", path)
+        else:
+            conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+def client_main(args):
+    params = urlencode({"lat": args.lat, "lon": args.lon, "radius": args.radius, "name": args.name})
+    path = f"/{args.mode}?{params}"
+    if args.concurrent <= 1:
+        print(json.dumps(query(path, args.host, args.port), indent=2))
+        return
+    # Fire the same lookup many times at once to exercise request coalescing
+    def timed(_):
+        t0 = time.perf_counter()
+        res = query(path, args.host, args.port)
+        return (time.perf_counter() - t0) * 1000.0, res["latency_ms"]
+    with ThreadPoolExecutor(max_workers=min(args.concurrent, 64)) as pool:
+        timings = np.array(list(pool.map(timed, range(args.concurrent))))
+    print(f"📊 {args.concurrent} requests: client p50 {np.percentile(timings[:, 0], 50):.2f} ms, "
+          f"p95 {np.percentile(timings[:, 0], 95):.2f} ms | server p50 {np.percentile(timings[:, 1], 50):.2f} ms")
+    print(json.dumps(query("/stats", args.host, args.port), indent=2))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Asyncio point-query service for the UHI map")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sv = sub.add_parser("serve", help="run the service")
+    sv.add_argument("--map", default=INPUT_MAP)
+    sv.add_argument("--host", default=HOST)
+    sv.add_argument("--port", type=int, default=PORT)
+    sv.add_argument("--workers", type=int, default=WORKERS)
+    sv.add_argument("--batch-ms", type=float, default=BATCH_WINDOW_MS)
+    cl = sub.add_parser("client", help="query a running service")
+    cl.add_argument("--lat", type=float, required=True)
+    cl.add_argument("--lon", type=float, required=True)
+    cl.add_argument("--radius", type=float, default=DEFAULT_RADIUS)
+    cl.add_argument("--name", default="Unknown")
+    cl.add_argument("--mode", choices=["check", "analyze"], default="analyze")
+    cl.add_argument("--concurrent", type=int, default=1, help="send this many identical requests at once")
+    cl.add_argument("--host", default=HOST)
+    cl.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        service = QueryService(args.map, args.workers, args.batch_ms)
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            print("\nStopped.")
+            print(json.dumps(service.stats(), indent=2))
+        finally:
+            service.close()
+    else:
+        client_main(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Shared-memory raster stack for multi-process Monte Carlo
+--------------------------------------------------------
+Runs the Phase4 Monte Carlo ensemble on several worker processes without
+giving every worker its own copy of the rasters:
+
+  - the aligned (and normalised) criteria stack and the constraint mask are
+    read once, by the parent, into a multiprocessing.shared_memory block (or a
+    memory-mapped file, BACKING = "mmap", for stacks larger than RAM)
+  - workers attach to it by name and read their tiles as zero-copy views;
+    only the weight draws and the block names are sent to them
+  - the draws are split into one contiguous range per worker; per tile every
+    worker accumulates the sum, sum of squares, exceedance counts and
+    per-pixel histograms of its own draws into a shared partial slot
+  - the parent adds the partials up (sums and counts are additive) and builds
+    the same products as ensemble.run_ensemble, double-buffered so the
+    workers already compute the next tile while the parent writes this one
+
+Tiles are ENSEMBLE_TILE_ROWS / workers rows high, so all partial slots
+together take about as much memory as the single-process engine's buffers.
+Results equal run_ensemble's up to float64 summation order, whatever the
+number of workers: the draws are made up front from the run's seed streams.
+
+Usage:
+    python -m uhi run --workers 4        (or MC_WORKERS in uhi/ensemble.py)
+"""
+
+import multiprocessing as mp
+import os
+import tempfile
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import ensemble as E
+from .profiling import stage, profiled
+
+# ========== CONFIG ==========
+BACKING = "shm"          # "shm" (multiprocessing.shared_memory) or "mmap" (file in MMAP_DIR, paged from disk)
+MMAP_DIR = None          # directory of the "mmap" backing files (None = system temp dir)
+START_METHOD = "spawn"   # workers start clean: no inherited numba threads or open raster handles
+
+class SharedArray:
+    """
+    A numpy array in shared memory or a memory-mapped file.  The creating
+    process owns it (close() frees it); other processes attach() to its spec.
+    """
+
+    def __init__(self, spec, owner=False):
+        backing, name, shape, dtype = spec
+        self.spec = spec
+        self.owner = owner
+        if backing == "shm":
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.array = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        else:
+            self._shm = None
+            self.array = np.memmap(name, dtype=dtype, mode="r+", shape=shape)
+
+    @classmethod
+    def create(cls, shape, dtype, backing=None, directory=None):
+        backing = backing or BACKING
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        if backing == "shm":
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            name = shm.name
+            shm.close()
+        elif backing == "mmap":
+            fd, name = tempfile.mkstemp(suffix=".uhi_stack", dir=directory or MMAP_DIR)
+            os.ftruncate(fd, nbytes)
+            os.close(fd)
+        else:
+            raise ValueError(f"unknown backing {backing!r} (expected 'shm' or 'mmap')")
+        return cls((backing, name, shape, dtype.str), owner=True)
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec) if spec is not None else None
+
+    def close(self):
+        self.array = None
+        if self._shm is not None:
+            self._shm.close()
+            if self.owner:
+                self._shm.unlink()
+        elif self.owner:
+            os.remove(self.spec[1])
+
+class SharedRasterStack:
+    """
+    The criteria stack on the template grid, held once for every process.
+
+    Offers the names / height / width / read_tile / read_mask_tile interface
+    of ensemble.CriteriaStack, so run_ensemble can use it too; read_tile()
+    returns views into the shared block instead of reading the rasters.
+    """
+
+    def __init__(self, names, stack, mask=None):
+        self.names = list(names)
+        self._stack = stack
+        self._mask = mask
+        self.height, self.width = stack.array.shape[1:]
+
+    @classmethod
+    @profiled("share_stack")
+    def from_cstack(cls, cstack, names=None, tile_rows=None, backing=None, directory=None):
+        """Read `names` (default: all) and the mask of a CriteriaStack into shared memory, tile by tile."""
+        names = cstack.names if names is None else list(names)
+        stack = SharedArray.create((len(names), cstack.height, cstack.width), "float32", backing, directory)
+        mask = None
+        if cstack.mask_path is not None:
+            mask = SharedArray.create((cstack.height, cstack.width), "float32", backing, directory)
+        for r0, r1 in E.iter_tiles(cstack.height, tile_rows or E.ENSEMBLE_TILE_ROWS):
+            stack.array[:, r0:r1] = cstack.read_tile(r0, r1, names)
+            if mask is not None:
+                mask.array[r0:r1] = cstack.read_mask_tile(r0, r1)
+        return cls(names, stack, mask)
+
+    def spec(self):
+        """Picklable description the workers attach() to."""
+        return (self.names, self._stack.spec, self._mask.spec if self._mask is not None else None)
+
+    @classmethod
+    def attach(cls, spec):
+        names, stack_spec, mask_spec = spec
+        return cls(names, SharedArray.attach(stack_spec), SharedArray.attach(mask_spec))
+
+    @property
+    def nbytes(self):
+        return self._stack.array.nbytes + (self._mask.array.nbytes if self._mask is not None else 0)
+
+    def read_tile(self, r0, r1, names=None):
+        if names is None or list(names) == self.names:
+            return self._stack.array[:, r0:r1]
+        return self._stack.array[[self.names.index(n) for n in names], r0:r1]
+
+    def read_mask_tile(self, r0, r1):
+        return self._mask.array[r0:r1] if self._mask is not None else None
+
+    def close(self):
+        self._stack.close()
+        if self._mask is not None:
+            self._mask.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ---------- Worker side ----------
+
+_WORKER = {}
+
+def _init_worker(stack_spec, partial_specs, weight_draws, sample_ranges, thresholds, quantiles, n_bins, use_numba,
+                 sample_weights=None):
+    E.USE_NUMBA = use_numba
+    if E.HAVE_NUMBA and use_numba:
+        E.numba.set_num_threads(1)   # one process per core already
+    _WORKER.update(
+        stack=SharedRasterStack.attach(stack_spec),
+        partials={key: SharedArray.attach(spec) for key, spec in partial_specs.items()},
+        draws=weight_draws, sample_weights=sample_weights, ranges=sample_ranges, thresholds=thresholds,
+        quantiles=quantiles, n_bins=n_bins,
+        w_lo=weight_draws.min(axis=0), w_hi=weight_draws.max(axis=0),
+    )
+
+# Accumulate draws k0:k1 of worker `w` over rows r0:r1 into partial slot `slot`
+def _tile_partial(task):
+    slot, w, r0, r1 = task
+    st = _WORKER
+    cstack, partials, thresholds = st["stack"], st["partials"], st["thresholds"]
+    k0, k1 = st["ranges"][w]
+    n_pix = (r1 - r0) * cstack.width
+    n_crit = len(cstack.names)
+    tile = cstack.read_tile(r0, r1).reshape(n_crit, n_pix)
+    m_tile = cstack.read_mask_tile(r0, r1)
+    if m_tile is not None:
+        m_tile = m_tile.reshape(n_pix)
+
+    sum_t = partials["sum"].array[slot, w, :n_pix]
+    sq_t = partials["sq"].array[slot, w, :n_pix]
+    exc_t = partials["exc"].array[slot, w, :len(thresholds) * n_pix].reshape(len(thresholds), n_pix)
+    sum_t.fill(0.0)
+    sq_t.fill(0.0)
+    exc_t.fill(0.0)
+    hist = None
+    if st["quantiles"]:
+        n_bins = st["n_bins"]
+        lo, _, scale = E.histogram_range(tile, m_tile, st["w_lo"], st["w_hi"], n_bins)
+        counts = partials["counts"].array[slot, w, :n_bins * n_pix].reshape(n_bins, n_pix)
+        counts.fill(0)
+        hist = (lo, scale, counts, np.empty(n_pix, dtype=np.intp), np.empty(n_pix, dtype='float32'),
+                np.arange(n_pix, dtype=np.intp))
+    out = np.empty(n_pix, dtype='float32')
+    scratch = np.empty(min(E.OVERLAY_CHUNK_PIXELS, n_pix), dtype='float32')
+    sample_weights = st["sample_weights"]
+    E.accumulate_samples(tile, m_tile, st["draws"][k0:k1], out, sum_t, sq_t, exc_t, thresholds,
+                         scratch, np.empty(n_pix, dtype=bool), hist,
+                         None if sample_weights is None else sample_weights[k0:k1])
+    return w
+
+# ---------- Parent side ----------
+
+@profiled("ensemble_shared")
+def run_ensemble_shared(cstack, weight_draws, on_tile, workers, tile_rows=None,
+                        quantiles=E.QUANTILES, thresholds=None, n_bins=E.QUANTILE_BINS,
+                        baseline_weights=None, tiles=None, verbose=True, checkpoint=None, sample_weights=None):
+    """
+    ensemble.run_ensemble on `workers` processes that share one copy of the
+    criteria stack; same `on_tile(r0, r1, products)` contract.  `cstack` is a
+    CriteriaStack (copied into shared memory first) or a SharedRasterStack.
+    A MonteCarloCheckpoint skips the tiles already written and records every
+    finished tile (progress inside a tile is not saved here).  `sample_weights`
+    are per-draw importance weights and `thresholds` the exceedance thresholds
+    (None = E.exceedance_thresholds()), as in run_ensemble.
+    """
+    active = E.active_criteria(weight_draws)
+    names = [cstack.names[i] for i in active]
+    weight_draws = np.ascontiguousarray(weight_draws[:, active])
+    if baseline_weights is not None:
+        baseline_weights = np.asarray(baseline_weights)[active]
+    n_samples = weight_draws.shape[0]
+    total = n_samples
+    if sample_weights is not None:
+        sample_weights = np.asarray(sample_weights, dtype='float64')
+        total = float(sample_weights.sum())
+    workers = max(1, min(int(workers), n_samples))
+    quantiles = tuple(quantiles or ())
+    thresholds = E.exceedance_thresholds() if thresholds is None else tuple(thresholds)
+    n_thr = len(thresholds)
+    height, width = cstack.height, cstack.width
+    tile_rows = tile_rows or max(1, E.ENSEMBLE_TILE_ROWS // workers)
+
+    owned = not isinstance(cstack, SharedRasterStack)
+    shared = SharedRasterStack.from_cstack(cstack, names) if owned else cstack
+    if verbose:
+        print(f"Shared raster stack: {shared.nbytes / 2**20:.1f} MiB ({BACKING}), {workers} worker processes")
+
+    # Two partial slots per worker: the workers fill one while the parent reduces the other
+    max_pix = min(tile_rows, height) * width
+    count_dtype = E.histogram_count_dtype(n_samples, sample_weights)
+    partials = {
+        "sum": SharedArray.create((2, workers, max_pix), 'float64'),
+        "sq": SharedArray.create((2, workers, max_pix), 'float64'),
+        "exc": SharedArray.create((2, workers, n_thr * max_pix), 'float32'),
+    }
+    if quantiles:
+        partials["counts"] = SharedArray.create((2, workers, n_bins * max_pix), count_dtype)
+    bounds = np.linspace(0, n_samples, workers + 1).astype(int)
+    sample_ranges = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    w_lo, w_hi = weight_draws.min(axis=0), weight_draws.max(axis=0)
+
+    def reduce_tile(slot, r0, r1):
+        n_pix = (r1 - r0) * width
+        tile = shared.read_tile(r0, r1, names).reshape(len(names), n_pix)
+        m_tile = shared.read_mask_tile(r0, r1)
+        if m_tile is not None:
+            m_tile = m_tile.reshape(n_pix)
+        sum_t = partials["sum"].array[slot, :, :n_pix].sum(axis=0)
+        sq_t = partials["sq"].array[slot, :, :n_pix].sum(axis=0)
+        exc_t = partials["exc"].array[slot, :, :n_thr * n_pix].sum(axis=0).reshape(n_thr, n_pix)
+        counts = lo = span = None
+        if quantiles:
+            counts = partials["counts"].array[slot, :, :n_bins * n_pix].sum(axis=0, dtype=count_dtype)
+            counts = counts.reshape(n_bins, n_pix)
+            lo, span, _ = E.histogram_range(tile, m_tile, w_lo, w_hi, n_bins)
+        shape2d = (r1 - r0, width)
+        products = E.tile_products(sum_t, sq_t, exc_t, total, shape2d, quantiles, counts, lo, span)
+        if baseline_weights is not None:
+            base = E.overlay_weighted(tile, baseline_weights)
+            if m_tile is not None:
+                base *= m_tile
+            products["baseline"] = base.reshape(shape2d)
+        return products
+
+    tiles = list(E.iter_tiles(height, tile_rows)) if tiles is None else list(tiles)
+    if checkpoint is not None:
+        tiles = checkpoint.pending(tiles)
+    ctx = mp.get_context(START_METHOD)
+    initargs = (shared.spec(), {key: arr.spec for key, arr in partials.items()}, weight_draws,
+                sample_ranges, thresholds, quantiles, n_bins, E.USE_NUMBA, sample_weights)
+    try:
+        with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            pending = None
+            for t, rows in enumerate(tiles + [None]):
+                job = None
+                if rows is not None:
+                    job = pool.map_async(_tile_partial, [(t % 2, w) + rows for w in range(workers)])
+                if pending is not None:
+                    prev_job, prev_t, (r0, r1) = pending
+                    with stage("samples"):
+                        prev_job.get()
+                    with stage("products"):
+                        products = reduce_tile(prev_t % 2, r0, r1)
+                    with stage("write"):
+                        on_tile(r0, r1, products)
+                    if checkpoint is not None:
+                        checkpoint.tile_done(r0, r1)
+                    if verbose:
+                        print(f"Ensemble tile {prev_t+1}/{len(tiles)} (rows {r0}-{r1}) done")
+                pending = (job, t, rows) if job is not None else None
+    finally:
+        for arr in partials.values():
+            arr.close()
+        if owned:
+            shared.close()
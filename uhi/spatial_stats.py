@@ -0,0 +1,220 @@
+"""
+Phase 6c: Spatial Hotspot Statistics
+------------------------------------
+phase6 calls a pixel a hotspot when its score is above a percentile, so one
+noisy pixel counts as much as a whole hot block. This module tests whether a
+pixel sits in a statistically significant cluster instead:
+
+- Getis-Ord Gi*: is the neighbourhood (pixel included) hotter than the map?
+  -> UHI_GiStar.tif, bands: z-score, p-value
+- Local Moran's I: does the pixel look like its neighbours?  (I > 0: a
+  high-high or low-low cluster, I < 0: an outlier)
+  -> UHI_LocalMoran.tif, bands: I, z-score, p-value (analytical moments
+  under randomisation, Anselin 1995)
+
+Neighbours are the pixels within RADIUS pixels: a (2R+1)² square (KERNEL =
+"box") or a disk ("disk"). Neighbourhood sums of the box come from separable
+running sums, O(1) per pixel whatever the radius; the disk is an FFT
+convolution. The map is processed in row tiles with a RADIUS-row halo, so
+memory stays bounded and tiles agree exactly at their seams.
+
+Soft-masked pixels (score < MIN_SCORE, i.e. the 0.0001 built-up pixels),
+NoData and NaN are not observations: they are left out of the global mean /
+variance and out of every neighbourhood, and get NODATA in the outputs.
+p-values are two-sided.
+
+Usage:
+    python -m uhi spatial [MAP] [--radius 3] [--kernel disk] [--stat gi|moran|both]
+    python phase6c_spatial_hotspots.py
+"""
+
+import argparse
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from .profiling import profiled, stage, count_read, count_write
+
+# === Configuration ===
+INPUT_MAP = "Final_Map_Clipped.tif"       # phase6 input
+GI_MAP = "UHI_GiStar.tif"
+MORAN_MAP = "UHI_LocalMoran.tif"
+RADIUS = 3                 # neighbourhood radius in pixels (3 px ~ 90 m on 30 m pixels)
+KERNEL = "box"             # "box" (separable running sums) or "disk" (FFT convolution)
+MIN_SCORE = 0.1            # scores below this are soft-masked (same cut as phase6)
+TILE_ROWS = 512            # output rows per tile (each tile reads RADIUS extra rows above and below)
+NODATA = -9999.0           # written where the statistic is undefined
+Z_LEVELS = {"99%": 2.576, "95%": 1.960, "90%": 1.645}   # two-sided confidence -> |z|
+
+# Valid observations of a tile: True where the score is a real, unmasked value
+def valid_mask(data, nodata=None, min_score=MIN_SCORE):
+    ok = np.isfinite(data) & (data >= min_score)
+    if nodata is not None and not np.isnan(nodata):
+        ok &= data != nodata
+    return ok
+
+# Sum over the (2r+1)² box around every pixel, zero outside the array
+def box_sum(a, r):
+    c = np.cumsum(np.pad(a, ((r + 1, r), (0, 0))), axis=0)
+    a = c[2 * r + 1:] - c[:-2 * r - 1]
+    c = np.cumsum(np.pad(a, ((0, 0), (r + 1, r))), axis=1)
+    return c[:, 2 * r + 1:] - c[:, :-2 * r - 1]
+
+def disk_kernel(r):
+    y, x = np.mgrid[-r:r + 1, -r:r + 1]
+    return (x * x + y * y <= r * r).astype("float64")
+
+# Sum over the neighbourhood of every pixel (pixel itself included)
+def neighbour_sum(a, r, kernel=KERNEL):
+    if r == 0:
+        return a.copy()
+    if kernel == "box":
+        return box_sum(a, r)
+    if kernel == "disk":
+        from scipy.signal import fftconvolve
+        return fftconvolve(a, disk_kernel(r), mode="same")
+    raise ValueError(f"unknown kernel {kernel!r} (use 'box' or 'disk')")
+
+def iter_tiles(height, tile_rows=TILE_ROWS):
+    for r0 in range(0, height, tile_rows):
+        yield r0, min(r0 + tile_rows, height)
+
+def read_rows(src, r0, r1):
+    data = src.read(1, window=Window(0, r0, src.width, r1 - r0)).astype("float64")
+    count_read(src.name, data.nbytes)
+    return data
+
+# Pass 1: count and central moments of the valid scores.  Power sums are taken
+# around a shift (the first tile's mean) so float64 keeps m2 / m4 accurate.
+@profiled("spatial_moments")
+def global_moments(src, min_score=MIN_SCORE, tile_rows=TILE_ROWS):
+    shift = None
+    n = 0
+    s = np.zeros(4)
+    for r0, r1 in iter_tiles(src.height, tile_rows):
+        x = read_rows(src, r0, r1)
+        x = x[valid_mask(x, src.nodata, min_score)]
+        if x.size == 0:
+            continue
+        if shift is None:
+            shift = float(x.mean())
+        d = x - shift
+        d2 = d * d
+        s += [d.sum(), d2.sum(), (d2 * d).sum(), (d2 * d2).sum()]
+        n += x.size
+    if n < 3:
+        return None
+    e1, e2, e3, e4 = s / n
+    m2 = e2 - e1 ** 2
+    m4 = e4 - 4 * e1 * e3 + 6 * e1 ** 2 * e2 - 3 * e1 ** 4
+    return {"n": n, "mean": shift + e1, "m2": m2, "m4": m4}
+
+def two_sided_p(z):
+    from scipy.special import ndtr
+    return 2.0 * ndtr(-np.abs(z))
+
+# Gi* z-scores of one tile from its neighbourhood sums (binary weights, self included)
+def gi_star(sum_x, w, moments):
+    n, mean = moments["n"], moments["mean"]
+    s = np.sqrt(moments["m2"])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sum_x - mean * w) / (s * np.sqrt((n * w - w * w) / (n - 1)))
+
+# Local Moran's I of one tile, with z-scores from its moments under randomisation
+def local_moran(x, sum_x, w, moments):
+    n, mean, m2 = moments["n"], moments["mean"], moments["m2"]
+    b2 = moments["m4"] / (m2 * m2)
+    z = x - mean
+    wi = w - 1.0                                    # neighbours, self excluded
+    lag = (sum_x - x) - mean * wi                   # sum of neighbour deviations
+    I = z * lag / m2
+    expected = -wi / (n - 1)
+    var = (wi * (n - b2) / (n - 1)
+           + (wi * wi - wi) * (2 * b2 - n) / ((n - 1) * (n - 2))
+           - expected ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return I, (I - expected) / np.sqrt(var)
+
+@profiled("spatial_stats")
+def hotspot_statistics(input_map=INPUT_MAP, gi_map=GI_MAP, moran_map=MORAN_MAP, radius=RADIUS,
+                       kernel=KERNEL, min_score=MIN_SCORE, tile_rows=TILE_ROWS):
+    """Write the Gi* and / or local Moran rasters (None skips one); returns the global moments."""
+    print(f"Reading {input_map}...")
+    with rasterio.open(input_map) as src:
+        moments = global_moments(src, min_score, tile_rows)
+        if moments is None or moments["m2"] <= 0:
+            print("Error: fewer than 3 valid pixels or a constant map, nothing to test.")
+            return None
+        print(f"📊 {moments['n']} valid pixels, mean {moments['mean']:.3f}, std {np.sqrt(moments['m2']):.3f}; "
+              f"{kernel} neighbourhood of radius {radius} px")
+
+        profile = src.profile.copy()
+        profile.update(dtype="float32", nodata=NODATA, compress="lzw")
+        outputs = {}
+        if gi_map:
+            outputs["gi"] = rasterio.open(gi_map, "w", **dict(profile, count=2))
+            for i, desc in enumerate(["Gi* z-score", "p-value"], start=1):
+                outputs["gi"].set_band_description(i, desc)
+        if moran_map:
+            outputs["moran"] = rasterio.open(moran_map, "w", **dict(profile, count=3))
+            for i, desc in enumerate(["local Moran I", "z-score", "p-value"], start=1):
+                outputs["moran"].set_band_description(i, desc)
+
+        significant = {key: dict.fromkeys(Z_LEVELS, 0) for key in outputs}
+        try:
+            for r0, r1 in iter_tiles(src.height, tile_rows):
+                # Pass 2: halo read, neighbourhood sums, trim the halo off again
+                h0, h1 = max(0, r0 - radius), min(src.height, r1 + radius)
+                x = read_rows(src, h0, h1)
+                v = valid_mask(x, src.nodata, min_score)
+                x = np.where(v, x, 0.0)
+                with stage("neighbour_sums"):
+                    sum_x = neighbour_sum(x, radius, kernel)[r0 - h0:r1 - h0]
+                    w = np.rint(neighbour_sum(v.astype("float64"), radius, kernel)[r0 - h0:r1 - h0])
+                x, v = x[r0 - h0:r1 - h0], v[r0 - h0:r1 - h0]
+                window = Window(0, r0, src.width, r1 - r0)
+
+                bands = {}
+                if "gi" in outputs:
+                    z = gi_star(sum_x, w, moments)
+                    bands["gi"] = [z, two_sided_p(z)]
+                if "moran" in outputs:
+                    I, z = local_moran(x, sum_x, w, moments)
+                    bands["moran"] = [I, z, two_sided_p(z)]
+                for key, arrays in bands.items():
+                    z = arrays[-2]
+                    ok = v & np.isfinite(z)
+                    for level, z_cut in Z_LEVELS.items():
+                        significant[key][level] += int(np.count_nonzero(ok & (z >= z_cut)))
+                    out = np.stack([np.where(ok, a, NODATA) for a in arrays]).astype("float32")
+                    outputs[key].write(out, window=window)
+                    count_write(outputs[key].name, out.nbytes)
+        finally:
+            for dst in outputs.values():
+                dst.close()
+
+    labels = {"gi": ("Gi* hot spots", gi_map), "moran": ("local Moran clusters (high-high or low-low)", moran_map)}
+    for key, counts in significant.items():
+        name, path = labels[key]
+        print(f"🔥 {name} (z >= cut): " + ", ".join(f"{c} px at {lvl}" for lvl, c in counts.items()))
+        print(f"✅ Saved {path}")
+    return moments
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Getis-Ord Gi* and local Moran's I z-score / p-value rasters")
+    parser.add_argument("map", nargs="?", default=INPUT_MAP)
+    parser.add_argument("--radius", type=int, default=RADIUS, help="neighbourhood radius in pixels")
+    parser.add_argument("--kernel", choices=["box", "disk"], default=KERNEL)
+    parser.add_argument("--stat", choices=["gi", "moran", "both"], default="both")
+    parser.add_argument("--min-score", type=float, default=MIN_SCORE, help="lower scores are soft-masked")
+    parser.add_argument("--gi-out", default=GI_MAP)
+    parser.add_argument("--moran-out", default=MORAN_MAP)
+    args = parser.parse_args(argv)
+    hotspot_statistics(args.map,
+                       args.gi_out if args.stat in ("gi", "both") else None,
+                       args.moran_out if args.stat in ("moran", "both") else None,
+                       radius=args.radius, kernel=args.kernel, min_score=args.min_score)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Quick map statistics: the percentile thresholds used by phase6 (calThreshold.py)
+and basic raster information (infoAboutMap.py).  numpy + rasterio only, so
+`python -m uhi stats` starts fast.
+"""
+
+import numpy as np
+import rasterio
+
+VALID_MIN = 0.0001      # masked / soft-mask pixels are at or below this
+
+def threshold_stats(path):
+    """Min / max / mean and the 90th / 95th / 99th percentiles of the valid pixels (None if there are none)."""
+    with rasterio.open(path) as src:
+        data = src.read(1)
+
+    # We only want to analyze the "Valid" urban pixels
+    valid_pixels = data[data > VALID_MIN]
+    if valid_pixels.size == 0:
+        return None
+    p90, p95, p99 = np.percentile(valid_pixels, [90, 95, 99])
+    return {"min": float(np.min(valid_pixels)), "max": float(np.max(valid_pixels)),
+            "mean": float(np.mean(valid_pixels)), "std": float(np.std(valid_pixels)),
+            "p90": float(p90), "p95": float(p95), "p99": float(p99)}
+
+def print_thresholds(path):
+    stats = threshold_stats(path)
+    if stats is None:
+        print("Error: No valid data found.")
+        return None
+    print("-" * 30)
+    print(f"📊 STATISTICS FOR {path}")
+    print("-" * 30)
+    print(f"Minimum Value: {stats['min']:.2f}")
+    print(f"Maximum Value: {stats['max']:.2f}")
+    print(f"Mean (Average): {stats['mean']:.2f}")
+    print("-" * 30)
+    print("Recommended Hotspot Thresholds:")
+    print(f"🔸 High Priority (>90th percentile):  {stats['p90']:.2f}")
+    print(f"🚨 Critical (>95th percentile):       {stats['p95']:.2f}")
+    print(f"🔥 Extreme (>99th percentile):        {stats['p99']:.2f}")
+    print("-" * 30)
+    return stats
+
+def raster_info(path):
+    """CRS, bounds, size and min / max / mean of the non-NoData pixels."""
+    with rasterio.open(path) as src:
+        band = src.read(1)
+        # Mask out NoData values
+        data = band[band != src.nodata] if src.nodata is not None else band
+        return {"crs": src.crs, "bounds": src.bounds, "width": src.width, "height": src.height,
+                "min": np.min(data), "max": np.max(data), "mean": np.mean(data)}
+
+def print_info(path):
+    info = raster_info(path)
+    print("Raster Information")
+    print("----------------------------")
+    print("CRS:", info["crs"])
+    print("Bounds:", info["bounds"])
+    print("Width x Height:", info["width"], "x", info["height"])
+
+    print("\nPixel Statistics")
+    print("----------------------------")
+    print("Min Pixel Value:", info["min"])
+    print("Max Pixel Value:", info["max"])
+    print("Mean Pixel Value:", info["mean"])
+    return info
@@ -0,0 +1,318 @@
+"""
+Local XYZ tile server for the UHI rasters
+-----------------------------------------
+Serves colourised 256x256 PNG tiles of the priority map, the ensemble std
+and the phase6 classes on demand. A folium / Leaflet map (see test4.py) can
+then overlay the rasters interactively, without pre-rendering the whole map.
+
+  GET /tiles/<layer>/<z>/<x>/<y>.png   web-mercator XYZ tile
+  GET /layers                           layer list, bounds and legends (JSON)
+
+Each tile reads only the source window under the tile. The read is decimated
+to about the tile resolution, so GDAL picks an internal overview when the
+raster has one (gdaladdo helps a lot at low zooms). The window is then warped
+onto the EPSG:3857 tile grid. Rendered tiles are kept in an in-process LRU
+cache and in an on-disk cache. The disk cache is keyed on the source file's
+size and mtime, so re-running Phase 4 / phase6 invalidates it automatically.
+
+Usage:
+python -m uhi tiles                  # http://127.0.0.1:8765/tiles/priority/{z}/{x}/{y}.png
+python -m uhi tiles --port 9000 --no-disk-cache
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from .bounds import raster_bounds
+from .classify import class_labels, raster_thresholds
+
+# ========== CONFIG ==========
+HOST = "127.0.0.1"
+PORT = 8765
+TILE_SIZE = 256
+CACHE_DIR = "tile_cache"      # on-disk PNG cache (None = memory only)
+LRU_TILES = 1024              # tiles kept in memory
+READ_OVERSAMPLE = 2           # source pixels read per tile pixel at most (decimated / overview reads)
+MIN_SCORE = 0.1               # scores below this are soft-masked (same cut as phase6)
+
+# Colour ramps: (position 0-1, (R, G, B)) stops
+RAMP_PRIORITY = [(0.0, (26, 152, 80)), (0.5, (254, 224, 139)), (0.8, (244, 109, 67)), (1.0, (165, 0, 38))]
+RAMP_STD = [(0.0, (247, 251, 255)), (0.5, (107, 174, 214)), (1.0, (8, 48, 107))]
+CLASS_COLORS = {1: (26, 152, 80), 2: (254, 224, 139), 3: (244, 109, 67), 4: (165, 0, 38)}  # the four phase6 classes
+
+# Layers: continuous layers are stretched between percentile bounds of the raster
+LAYERS = {
+    "priority": {"path": "Final_UHI_Mitigation_Map_Hybrid.tif", "kind": "ramp", "ramp": RAMP_PRIORITY,
+                 "stretch": (2.0, 98.0), "min_value": MIN_SCORE, "resampling": "bilinear"},
+    "std": {"path": "Final_UHI_Ensemble_std.tif", "kind": "ramp", "ramp": RAMP_STD,
+            "stretch": (2.0, 98.0), "min_value": None, "resampling": "bilinear"},
+    "classes": {"path": "UHI_Priority_Classes.tif", "kind": "classes", "colors": None,   # None = from the raster
+                "resampling": "nearest"},
+}
+
+WEB_MERCATOR = "EPSG:3857"
+ORIGIN_SHIFT = 20037508.342789244
+
+# Web-mercator bounds (west, south, east, north) of XYZ tile z/x/y
+def tile_bounds(z, x, y):
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    west = -ORIGIN_SHIFT + x * size
+    north = ORIGIN_SHIFT - y * size
+    return west, north - size, west + size, north
+
+# Minimal PNG encoder (8-bit RGBA, no filtering) using only zlib
+def encode_png(rgba):
+    h, w = rgba.shape[:2]
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+            + chunk(b"IEND", b""))
+
+# Values -> RGBA through a ramp of (position, colour) stops
+def apply_ramp(values, vmin, vmax, ramp):
+    span = (vmax - vmin) if vmax > vmin else 1.0
+    t = np.clip((values - vmin) / span, 0.0, 1.0)
+    pos = [p for p, _ in ramp]
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    for c in range(3):
+        rgba[..., c] = np.interp(t, pos, [col[c] for _, col in ramp])
+    rgba[..., 3] = 255
+    return rgba
+
+# Colours and labels of a class raster, for as many classes as its thresholds
+# make: CLASS_COLORS for the four phase6 classes, else RAMP_PRIORITY sampled evenly
+def class_style(src):
+    thresholds = raster_thresholds(src)
+    n_classes = len(thresholds) + 1
+    labels = class_labels(thresholds)
+    if n_classes == len(CLASS_COLORS):
+        return dict(CLASS_COLORS), labels
+    rgba = apply_ramp(np.arange(1, n_classes + 1, dtype="float64"), 1, n_classes, RAMP_PRIORITY)
+    return {c: tuple(int(v) for v in rgba[c - 1, :3]) for c in range(1, n_classes + 1)}, labels
+
+def apply_classes(values, colors):
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    for cls, col in colors.items():
+        sel = values == cls
+        rgba[sel, :3] = col
+        rgba[sel, 3] = 255
+    return rgba
+
+class TileRenderer:
+    """
+    Renders and caches tiles of the configured layers.  Rasterio handles are
+    not thread-safe, so each server thread keeps its own open datasets.
+    """
+
+    def __init__(self, layers=LAYERS, cache_dir=CACHE_DIR, lru_tiles=LRU_TILES):
+        self.layers = layers
+        self.cache_dir = cache_dir
+        self.lru_tiles = lru_tiles
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stretch = {}
+        self._styles = {}
+        self._blank = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+    def _dataset(self, name):
+        handles = self._local.__dict__.setdefault("handles", {})
+        path = self.layers[name]["path"]
+        stamp = self._stamp(path)
+        if name not in handles or handles[name][0] != stamp:
+            if name in handles:
+                handles[name][1].close()
+            handles[name] = (stamp, rasterio.open(path))
+        return handles[name][1]
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return f"{st.st_size}-{st.st_mtime_ns}"
+
+    def _value_range(self, name):
+        spec = self.layers[name]
+        key = (name, self._stamp(spec["path"]))
+        if key not in self._stretch:
+            self._stretch[key] = raster_bounds(spec["path"], mode="percentile", percentiles=spec["stretch"],
+                                               min_value=spec.get("min_value"))
+        return self._stretch[key]
+
+    def _class_style(self, name):
+        spec = self.layers[name]
+        if spec.get("colors"):
+            return spec["colors"], {c: f"Class {c}" for c in spec["colors"]}
+        key = (name, self._stamp(spec["path"]))
+        if key not in self._styles:
+            self._styles[key] = class_style(self._dataset(name))
+        return self._styles[key]
+
+    def layer_info(self):
+        info = {}
+        for name, spec in self.layers.items():
+            if not os.path.exists(spec["path"]):
+                continue
+            src = self._dataset(name)
+            entry = {"path": spec["path"], "kind": spec["kind"],
+                     "bounds_wgs84": list(transform_bounds(src.crs, "EPSG:4326", *src.bounds)),
+                     "url": f"/tiles/{name}/{{z}}/{{x}}/{{y}}.png"}
+            if spec["kind"] == "ramp":
+                entry["range"] = list(self._value_range(name))
+            else:
+                colors, labels = self._class_style(name)
+                entry["legend"] = {labels[c]: "#%02x%02x%02x" % col for c, col in colors.items()}
+            info[name] = entry
+        return info
+
+    def render(self, name, z, x, y):
+        """Colourised RGBA array of one tile (None when the tile misses the raster)."""
+        spec = self.layers[name]
+        src = self._dataset(name)
+        west, south, east, north = tile_bounds(z, x, y)
+        l, b, r, t = transform_bounds(WEB_MERCATOR, src.crs, west, south, east, north)
+        l, b = max(l, src.bounds.left), max(b, src.bounds.bottom)
+        r, t = min(r, src.bounds.right), min(t, src.bounds.top)
+        if l >= r or b >= t:
+            return None
+        w = from_bounds(l, b, r, t, src.transform)
+        c0, r0 = max(0, math.floor(w.col_off)), max(0, math.floor(w.row_off))
+        c1 = min(src.width, math.ceil(w.col_off + w.width))
+        r1 = min(src.height, math.ceil(w.row_off + w.height))
+        if c1 <= c0 or r1 <= r0:
+            return None
+        window = Window(c0, r0, c1 - c0, r1 - r0)
+        # Decimated read of the window: GDAL serves it from an overview when it can
+        out_w = max(1, min(int(window.width), TILE_SIZE * READ_OVERSAMPLE))
+        out_h = max(1, min(int(window.height), TILE_SIZE * READ_OVERSAMPLE))
+        resampling = Resampling[spec["resampling"]]
+        data = src.read(1, window=window, out_shape=(out_h, out_w), masked=True,
+                        resampling=resampling).astype("float32").filled(np.nan)
+        src_transform = src.window_transform(window) * Affine.scale(window.width / out_w, window.height / out_h)
+        tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype="float32")
+        res = (east - west) / TILE_SIZE
+        reproject(data, tile, src_transform=src_transform, src_crs=src.crs, src_nodata=np.nan,
+                  dst_transform=Affine(res, 0, west, 0, -res, north), dst_crs=WEB_MERCATOR,
+                  dst_nodata=np.nan, resampling=resampling)
+        if spec["kind"] == "classes":
+            return apply_classes(np.nan_to_num(tile, nan=0).astype(np.int16), self._class_style(name)[0])
+        vmin, vmax = self._value_range(name)
+        rgba = apply_ramp(np.nan_to_num(tile, nan=vmin), vmin, vmax, spec["ramp"])
+        invalid = ~np.isfinite(tile)
+        if spec.get("min_value") is not None:
+            invalid |= tile < spec["min_value"]
+        rgba[invalid, 3] = 0
+        return rgba
+
+    def tile_png(self, name, z, x, y):
+        stamp = self._stamp(self.layers[name]["path"])
+        key = (name, stamp, z, x, y)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+        disk_path = None
+        if self.cache_dir:
+            disk_path = os.path.join(self.cache_dir, f"{name}-{stamp}", str(z), str(x), f"{y}.png")
+        if disk_path and os.path.exists(disk_path):
+            with open(disk_path, "rb") as f:
+                png = f.read()
+        else:
+            rgba = self.render(name, z, x, y)
+            png = self._blank if rgba is None else encode_png(rgba)
+            if disk_path:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                tmp = f"{disk_path}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(png)
+                os.replace(tmp, disk_path)
+        with self._lock:
+            self._lru[key] = png
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_tiles:
+                self._lru.popitem(last=False)
+        return png
+
+TILE_URL = re.compile(r"^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.png$")
+
+class TileHandler(BaseHTTPRequestHandler):
+    renderer = None
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if content_type == "image/png":
+            self.send_header("Cache-Control", "max-age=300")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/layers"):
+            body = json.dumps(self.renderer.layer_info(), indent=2).encode()
+            return self._send(200, body, "application/json")
+        m = TILE_URL.match(path)
+        if not m:
+            return self._send(404, b"not found", "text/plain")
+        name, z, x, y = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4))
+        if name not in self.renderer.layers or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return self._send(404, b"unknown layer or tile", "text/plain")
+        if not os.path.exists(self.renderer.layers[name]["path"]):
+            return self._send(404, b"layer raster not found", "text/plain")
+        try:
+            png = self.renderer.tile_png(name, z, x, y)
+        except Exception as e:
+            return self._send(500, str(e).encode(), "text/plain")
+        self._send(200, png, "image/png")
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(host=HOST, port=PORT, cache_dir=CACHE_DIR):
+    TileHandler.renderer = TileRenderer(cache_dir=cache_dir)
+    server = ThreadingHTTPServer((host, port), TileHandler)
+    print(f"🗺️  Serving UHI tiles on http://{host}:{port}/tiles/<layer>/{{z}}/{{x}}/{{y}}.png")
+    for name, spec in LAYERS.items():
+        status = "✅" if os.path.exists(spec["path"]) else "⚠️ missing"
+        print(f"   {name:9s} {spec['path']} {status}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        server.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local XYZ tile server for the UHI rasters")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--no-disk-cache", action="store_true", help="keep rendered tiles in memory only")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, None if args.no_disk_cache else args.cache_dir)
+
+if __name__ == "__main__":
+    main()